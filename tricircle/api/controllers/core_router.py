@@ -44,6 +44,8 @@ from tricircle.api.controllers import route_entry
 
 LOG = logging.getLogger(__name__)
 
+SUPPORTED_EXPAND = ['routes', 'interfaces', 'firewall_bypasss']
+
 
 class CoreRouterInterfaceController(rest.RestController):
 
@@ -363,16 +365,27 @@ class CoreRoutersController(rest.RestController):
             return_object = m.FailureMessage()
             return return_object.to_dict()
 
+    def _get_expand(self, params):
+        is_valid, expand = utils.get_expand_params(params, SUPPORTED_EXPAND)
+        if not is_valid:
+            return None, m.InvalidExpand(
+                expand=','.join(expand),
+                supported=','.join(SUPPORTED_EXPAND)).to_dict()
+        return expand, None
+
     @expose(generic=True, template='json')
-    def get_one(self, _id):
+    def get_one(self, _id, **kwargs):
         context = t_context.extract_context_from_environ()
 
         if not policy.enforce(context, policy.ADMIN_API_PODS_SHOW):
             pecan.abort(401, _('Unauthorized to show core_router'))
             return
 
+        expand, error = self._get_expand(kwargs)
+        if error:
+            return error
         try:
-            core_router = db_api.get_core_router(context, _id)
+            core_router = db_api.get_core_router(context, _id, expand=expand)
             return_object = m.SuccessMessage(result={'core_router': core_router})
             return return_object.to_dict()
         except t_exceptions.ResourceNotFound as e:
@@ -384,15 +397,18 @@ class CoreRoutersController(rest.RestController):
             return m.CoreRouterNotFound(core_router_id=_id).to_dict()
 
     @expose(generic=True, template='json')
-    def get_all(self):
+    def get_all(self, **kwargs):
         context = t_context.extract_context_from_environ()
 
         if not policy.enforce(context, policy.ADMIN_API_PODS_LIST):
             pecan.abort(401, _('Unauthorized to list core_routers'))
             return
 
+        expand, error = self._get_expand(kwargs)
+        if error:
+            return error
         try:
-            core_routers = db_api.list_core_routers(context)
+            core_routers = db_api.list_core_routers(context, expand=expand)
             return_object = m.SuccessMessage(result={'core_routers': core_routers})
             return return_object.to_dict()
         except Exception as e:
@@ -26,6 +26,7 @@ import tricircle.common.context as t_context
 import tricircle.common.exceptions as t_exceptions
 from tricircle.common.i18n import _
 from tricircle.common import policy
+from tricircle.common import utils
 
 from tricircle.db import api as db_api
 from tricircle.db import core
@@ -33,6 +34,8 @@ from tricircle.db import models
 
 LOG = logging.getLogger(__name__)
 
+SUPPORTED_EXPAND = ['fabrics']
+
 class DCsController(rest.RestController):
 
     def __init__(self):
@@ -81,29 +84,39 @@ class DCsController(rest.RestController):
         return {'dc': new_dc}
 
     @expose(generic=True, template='json')
-    def get_one(self, _id):
+    def get_one(self, _id, **kwargs):
         context = t_context.extract_context_from_environ()
 
         if not policy.enforce(context, policy.ADMIN_API_PODS_SHOW):
             pecan.abort(401, _('Unauthorized to show dcs'))
             return
 
+        is_valid, expand = utils.get_expand_params(kwargs, SUPPORTED_EXPAND)
+        if not is_valid:
+            pecan.abort(400, _('Unsupported expand: %s') % ','.join(expand))
+            return
+
         try:
-            return {'dc': db_api.get_dc(context, _id)}
+            return {'dc': db_api.get_dc(context, _id, expand=expand)}
         except t_exceptions.ResourceNotFound:
             pecan.abort(404, _('DC not found'))
             return
 
     @expose(generic=True, template='json')
-    def get_all(self):
+    def get_all(self, **kwargs):
         context = t_context.extract_context_from_environ()
 
         if not policy.enforce(context, policy.ADMIN_API_PODS_LIST):
             pecan.abort(401, _('Unauthorized to list dcs'))
             return
 
+        is_valid, expand = utils.get_expand_params(kwargs, SUPPORTED_EXPAND)
+        if not is_valid:
+            pecan.abort(400, _('Unsupported expand: %s') % ','.join(expand))
+            return
+
         try:
-            return {'dcs': db_api.list_dcs(context)}
+            return {'dcs': db_api.list_dcs(context, expand=expand)}
         except Exception as e:
             LOG.exception('Failed to list all dcs: %(exception)s ',
                           {'exception': e})
@@ -22,6 +22,7 @@ from tricircle.common import constants
 import tricircle.common.context as t_context
 import tricircle.common.exceptions as t_exc
 from tricircle.common.i18n import _
+from tricircle.common import metrics
 from tricircle.common import policy
 from tricircle.common import utils
 from tricircle.common import xrpcapi
@@ -149,12 +150,18 @@ class AsyncJobController(rest.RestController):
 
         :param id: 1) if id = 'schemas', return job schemas
                    2) if id = 'detail', return all jobs
-                   3) if id = $job_id, return detailed single job info
+                   3) if id = 'stats', return job execution statistics
+                   4) if id = $job_id, return detailed single job info
+        :param kwargs: for a single job, "wait" is the seconds to wait for
+                       a new job to be handled before returning
         :return: return value is decided by id parameter
         """
         context = t_context.extract_context_from_environ()
         job_resource_map = constants.job_resource_map
 
+        if id == 'stats':
+            return self._get_job_stats(context)
+
         if not policy.enforce(context, policy.ADMIN_API_JOB_SCHEMA_LIST):
             return utils.format_api_error(
                 403, _('Unauthorized to show job information'))
@@ -176,9 +183,18 @@ class AsyncJobController(rest.RestController):
         if id == 'detail':
             return self.get_all(**kwargs)
 
+        wait = kwargs.get('wait')
+        if wait is not None:
+            try:
+                wait = int(wait)
+            except ValueError:
+                wait = -1
+            if wait < 0:
+                return utils.format_api_error(
+                    400, _('Wait should be a non-negative integer'))
+
         try:
             job = db_api.get_job(context, id)
-            return {'job': self._get_more_readable_job(job)}
         except Exception:
             try:
                 job = db_api.get_job_from_log(context, id)
@@ -187,6 +203,21 @@ class AsyncJobController(rest.RestController):
                 return utils.format_api_error(
                     404, _('Resource not found'))
 
+        if wait and job['status'] == constants.JS_New:
+            try:
+                result = self.xjob_handler.wait_job(context, job, wait)
+            except Exception as e:
+                LOG.exception('Failed to wait for job %(job_id)s: '
+                              '%(exception)s ', {'job_id': id,
+                                                 'exception': e})
+                return utils.format_api_error(
+                    500, _('Failed to wait for the job'))
+            if result:
+                # the new job record is removed once handled successfully,
+                # so show the result of the run handling it
+                job['status'] = result
+        return {'job': self._get_more_readable_job(job)}
+
     @expose(generic=True, template='json')
     def get_all(self, **kwargs):
         """Get all the jobs. Using filters, only get a subset of jobs.
@@ -200,6 +231,34 @@ class AsyncJobController(rest.RestController):
             return utils.format_api_error(
                 403, _('Unauthorized to show all jobs'))
 
+        marker = kwargs.pop('marker', None)
+        limit = kwargs.pop('limit', None)
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit <= 0:
+                return utils.format_api_error(
+                    400, _('Limit should be a positive integer'))
+
+        time_filters = []
+        for param, comparator in (('start_time', 'gte'),
+                                  ('end_time', 'lte')):
+            value = kwargs.pop(param, None)
+            if value is None:
+                continue
+            try:
+                value = timeutils.normalize_time(
+                    timeutils.parse_isotime(value))
+            except ValueError:
+                return utils.format_api_error(
+                    400, _('%(param)s should be an ISO 8601 time') % {
+                        'param': param})
+            time_filters.append({'key': 'timestamp',
+                                 'comparator': comparator,
+                                 'value': value})
+
         is_valid_filter, filters = self._get_filters(kwargs)
 
         if not is_valid_filter:
@@ -211,12 +270,21 @@ class AsyncJobController(rest.RestController):
         filters = [{'key': key,
                     'comparator': 'eq',
                     'value': value} for key, value in six.iteritems(filters)]
+        filters.extend(time_filters)
 
         try:
-            jobs_in_job_table = db_api.list_jobs(context, filters)
-            jobs_in_job_log_table = db_api.list_jobs_from_log(context, filters)
-            jobs = jobs_in_job_table + jobs_in_job_log_table
-            return {'jobs': [self._get_more_readable_job(job) for job in jobs]}
+            if limit is None and marker is None:
+                jobs = db_api.iter_jobs(context, filters)
+            else:
+                # newest first, jobs in the job table precede job logs
+                jobs = db_api.list_jobs_with_log(
+                    context, filters, sorts=[('timestamp', False)],
+                    limit=limit, marker=marker)
+            return {'jobs': [self._get_more_readable_job(job)
+                             for job in jobs]}
+        except t_exc.ResourceNotFound:
+            return utils.format_api_error(
+                400, _('Marker %(marker)s not found') % {'marker': marker})
         except Exception as e:
             LOG.exception('Failed to show all asynchronous jobs: '
                           '%(exception)s ', {'exception': e})
@@ -247,6 +315,41 @@ class AsyncJobController(rest.RestController):
 
         return job
 
+    def _get_job_stats(self, context):
+        if not policy.enforce(context, policy.ADMIN_API_JOB_STATS):
+            return utils.format_api_error(
+                403, _('Unauthorized to show job statistics'))
+
+        job_stats = db_api.list_job_stats(context)
+        stats = metrics.merge_stats(
+            [worker_stats['stats'] for worker_stats in job_stats])
+        readable_stats = {}
+        for job_type, type_stats in six.iteritems(stats):
+            readable_type_stats = dict(type_stats['counters'])
+            for timer, histogram in six.iteritems(type_stats['timers']):
+                readable_type_stats[timer] = self._get_more_readable_histogram(
+                    histogram)
+            readable_type_stats['pod_calls'] = dict(
+                (region_name, self._get_more_readable_histogram(histogram))
+                for region_name, histogram in six.iteritems(
+                    type_stats['pod_calls']))
+            readable_stats[job_type] = readable_type_stats
+        failed_jobs, new_jobs = db_api.get_latest_failed_or_new_jobs(
+            context, with_timestamp=True)
+        return {'stats': readable_stats,
+                'queue': metrics.get_queue_stats(new_jobs, failed_jobs),
+                'workers': sorted([worker_stats[
+                    'worker'] for worker_stats in job_stats])}
+
+    @staticmethod
+    def _get_more_readable_histogram(histogram):
+        count = histogram['count']
+        buckets = [str(bound) for bound in metrics.BUCKETS] + ['+Inf']
+        return {'count': count,
+                'sum': histogram['sum'],
+                'avg': histogram['sum'] / count if count else 0,
+                'buckets': dict(zip(buckets, histogram['buckets']))}
+
     def _get_filters(self, params):
         """Return a dictionary of query param filters from the request.
 
@@ -28,8 +28,6 @@ from tricircle.common.i18n import _
 from tricircle.common import policy
 
 from tricircle.db import api as db_api
-from tricircle.db import core
-from tricircle.db import models
 
 LOG = logging.getLogger(__name__)
 
@@ -84,14 +82,13 @@ class PodsController(rest.RestController):
                     409)
 
         try:
-            with context.session.begin():
-                new_pod = core.create_resource(
-                    context, models.Pod,
-                    {'pod_id': _uuid,
-                     'region_name': region_name,
-                     'pod_az_name': pod_az_name,
-                     'dc_name': dc_name,
-                     'az_name': az_name})
+            new_pod = db_api.create_pod(
+                context,
+                {'pod_id': _uuid,
+                 'region_name': region_name,
+                 'pod_az_name': pod_az_name,
+                 'dc_name': dc_name,
+                 'az_name': az_name})
         except db_exc.DBDuplicateEntry as e1:
             LOG.exception('Record already exists on %(region_name)s: '
                           '%(exception)s',
@@ -153,10 +150,9 @@ class PodsController(rest.RestController):
             return
 
         try:
-            with context.session.begin():
-                core.delete_resource(context, models.Pod, _id)
-                pecan.response.status = 200
-                return {}
+            db_api.delete_pod(context, _id)
+            pecan.response.status = 200
+            return {}
         except t_exceptions.ResourceNotFound:
             return Response(_('Pod not found'), 404)
         except Exception as e:
@@ -170,12 +166,9 @@ class PodsController(rest.RestController):
     def _get_top_region(self, ctx):
         top_region_name = ''
         try:
-            with ctx.session.begin():
-                pods = core.query_resource(ctx,
-                                           models.Pod, [], [])
-                for pod in pods:
-                    if pod['az_name'] == '' and pod['region_name'] != '':
-                        return pod['region_name']
+            top_pod = db_api.get_top_pod(ctx)
+            if top_pod:
+                return top_pod['region_name']
         except Exception as e:
             LOG.exception('Failed to get top region: %(exception)s ',
                           {'exception': e})
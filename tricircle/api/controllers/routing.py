@@ -115,6 +115,17 @@ class RoutingController(rest.RestController):
             return utils.format_api_error(
                 403, _('Unauthorized to show all resource routings'))
 
+        marker = kwargs.pop('marker', None)
+        limit = kwargs.pop('limit', None)
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit <= 0:
+                return utils.format_api_error(
+                    400, _('Limit should be a positive integer'))
+
         is_valid_filter, filters = self._get_filters(kwargs)
 
         if not is_valid_filter:
@@ -128,8 +139,13 @@ class RoutingController(rest.RestController):
                     'value': value} for key, value in six.iteritems(filters)]
 
         try:
-            return {'routings': db_api.list_resource_routings(context,
-                                                              filters)}
+            # sort by id so pages are returned in a stable order
+            return {'routings': db_api.list_resource_routings(
+                context, filters, sorts=[('id', True)], limit=limit,
+                marker=marker)}
+        except t_exceptions.ResourceNotFound:
+            return utils.format_api_error(
+                400, _('Marker %(marker)s not found') % {'marker': marker})
         except Exception as e:
             LOG.exception('Failed to show all resource routings: '
                           '%(exception)s ', {'exception': e})
@@ -18,11 +18,11 @@ import functools
 import inspect
 import six
 from six.moves import xrange
-import uuid
 
 import keystoneauth1.identity.generic as auth_identity
 from keystoneauth1 import session
 from keystoneclient.v3 import client as keystone_client
+from neutronclient.common import exceptions as q_exceptions
 from oslo_config import cfg
 from oslo_log import log as logging
 
@@ -72,7 +72,10 @@ client_opts = [
     cfg.IntOpt('max_shadow_port_bulk_size', default=100,
                help='max bulk size to create shadow ports'),
     cfg.IntOpt('max_trunk_subports_bulk_size', default=100,
-               help='max bulk size to create trunk subports')
+               help='max bulk size to create trunk subports'),
+    cfg.IntOpt('max_bulk_get_size', default=100,
+               help='max number of resource ids queried in one list request '
+                    'when getting resources in bulk')
 ]
 client_opt_group = cfg.OptGroup('client')
 cfg.CONF.register_group(client_opt_group)
@@ -91,11 +94,24 @@ def _safe_operation(operation_name):
                 raise exceptions.ResourceNotSupported(resource, operation_name)
             retries = 1
             for i in xrange(retries + 1):
+                admin_token = None
                 try:
                     service = instance.resource_service_map[resource]
                     instance._ensure_endpoint_set(context, service)
                     instance._ensure_token_for_admin(context)
+                    if resource_handle.admin_token_manager.is_cached(
+                            context.auth_token):
+                        admin_token = context.auth_token
                     return func(*args, **kwargs)
+                except q_exceptions.Unauthorized:
+                    # the cached admin token is rejected, the handle has
+                    # dropped it from the cache, fetch a new one and try
+                    # again. tokens of users are not retried
+                    if i == retries or not admin_token:
+                        raise
+                    resource_handle.admin_token_manager.invalidate(
+                        admin_token)
+                    context.auth_token = None
                 except exceptions.EndpointNotAvailable as e:
                     instance._unset_endpoint(service)
                     if i == retries:
@@ -107,16 +123,12 @@ def _safe_operation(operation_name):
                         instance._update_endpoint_from_keystone(context, True)
                     else:
                         raise
-                except exceptions.EndpointNotFound as e:
+                except exceptions.EndpointNotFound:
                     # NOTE(zhiyuan) endpoints are not registered in Keystone
                     # for the given pod and service, we add default behaviours
-                    # for the handle functions
-                    if i < retries and cfg.CONF.client.auto_refresh_endpoint:
-                        LOG.warning('%(exception)s, '
-                                    'update endpoint and try again',
-                                    {'exception': e.message})
-                        instance._update_endpoint_from_keystone(context, True)
-                        continue
+                    # for the handle functions. Endpoints have already been
+                    # refreshed from Keystone during the lookup if
+                    # auto_refresh_endpoint is True, so no need to retry
                     if operation_name == 'list':
                         return []
                     else:
@@ -125,6 +137,51 @@ def _safe_operation(operation_name):
     return handle_func
 
 
+class _ServiceHandleMap(dict):
+    """Map of service type to handle, handles are created on first use"""
+
+    def __init__(self, auth_url):
+        super(_ServiceHandleMap, self).__init__()
+        self.auth_url = auth_url
+
+    def __missing__(self, service):
+        handle = _service_handle_class_map[service](self.auth_url)
+        self[service] = handle
+        return handle
+
+
+def _build_dispatch_tables():
+    service_handle_class_map = {}
+    resource_service_map = {}
+    operation_resources_map = collections.defaultdict(set)
+    shortcut_map = {}
+    for _, handle_class in inspect.getmembers(resource_handle):
+        if not inspect.isclass(handle_class):
+            continue
+        if not hasattr(handle_class, 'service_type'):
+            continue
+        service_type = handle_class.service_type
+        service_handle_class_map[service_type] = handle_class
+        for resource in handle_class.support_resource:
+            resource_service_map[resource] = service_type
+            operation_resources_map['client'].add(resource)
+            for operation, index in six.iteritems(
+                    resource_handle.operation_index_map):
+                # add parentheses to emphasize we mean to do bitwise and
+                if (handle_class.support_resource[resource] & index) == 0:
+                    continue
+                operation_resources_map[operation].add(resource)
+                shortcut_map['%s_%ss' % (operation, resource)] = (
+                    operation, resource)
+    return (service_handle_class_map, resource_service_map,
+            dict(operation_resources_map), shortcut_map)
+
+
+# built once per process and shared by all the Client instances
+(_service_handle_class_map, _resource_service_map, _operation_resources_map,
+ _shortcut_map) = _build_dispatch_tables()
+
+
 class Client(object):
     """Wrapper of all OpenStack service clients
 
@@ -180,39 +237,38 @@ class Client(object):
     add_host method and it has two position parameters and no key parameter.
     For simplicity, action name and method name are the same.
 
-    One more thing to mention, Client registers a partial function
+    One more thing to mention, Client provides a partial function
     (operation)_(resource)s for each operation and each resource. For example,
     you can call create_resources(self, resource, cxt, body) directly to create
     a network, or use create_networks(self, cxt, body) for short.
+
+    The resource and operation tables are built once per process, partial
+    functions are created on first access and service handlers on first use,
+    so constructing a Client for a new region is cheap.
     """
     def __init__(self, region_name=None):
         self.auth_url = cfg.CONF.client.auth_url
-        self.resource_service_map = {}
-        self.operation_resources_map = collections.defaultdict(set)
-        self.service_handle_map = {}
         self.region_name = region_name
         if not self.region_name:
             self.region_name = cfg.CONF.client.top_region_name
-        for _, handle_class in inspect.getmembers(resource_handle):
-            if not inspect.isclass(handle_class):
-                continue
-            if not hasattr(handle_class, 'service_type'):
-                continue
-            handle_obj = handle_class(self.auth_url)
-            self.service_handle_map[handle_obj.service_type] = handle_obj
-            for resource in handle_obj.support_resource:
-                self.resource_service_map[resource] = handle_obj.service_type
-                self.operation_resources_map['client'].add(resource)
-                for operation, index in six.iteritems(
-                        resource_handle.operation_index_map):
-                    # add parentheses to emphasize we mean to do bitwise and
-                    if (handle_obj.support_resource[resource] & index) == 0:
-                        continue
-                    self.operation_resources_map[operation].add(resource)
-                    setattr(self, '%s_%ss' % (operation, resource),
-                            functools.partial(
-                                getattr(self, '%s_resources' % operation),
-                                resource))
+        # the dispatch tables are shared by all the clients, the instance
+        # gets its own copies since callers are free to modify them
+        self.resource_service_map = dict(_resource_service_map)
+        self.operation_resources_map = collections.defaultdict(set)
+        for operation, resources in six.iteritems(_operation_resources_map):
+            self.operation_resources_map[operation] = set(resources)
+        self.service_handle_map = _ServiceHandleMap(self.auth_url)
+
+    def __getattr__(self, name):
+        # (operation)_(resource)s shortcuts are resolved on first access
+        # and kept in the instance afterwards
+        if name not in _shortcut_map:
+            raise AttributeError(name)
+        operation, resource = _shortcut_map[name]
+        func = functools.partial(getattr(self, '%s_resources' % operation),
+                                 resource)
+        setattr(self, name, func)
+        return func
 
     @staticmethod
     def _get_keystone_session(project_id=None):
@@ -224,10 +280,10 @@ class Client(object):
 
     @staticmethod
     def _get_admin_token(project_id=None):
-        return Client._get_keystone_session(project_id).get_token()
+        return resource_handle.ResourceHandle.get_admin_token(project_id)
 
     def _get_admin_project_id(self):
-        return self._get_keystone_session().get_project_id()
+        return resource_handle.admin_token_manager.get_project_id()
 
     def _get_endpoint_from_keystone(self, cxt):
         auth = auth_identity.Token(cfg.CONF.client.auth_url,
@@ -254,15 +310,19 @@ class Client(object):
             region_service_endpoint_map[region_id][service_name] = url
         return region_service_endpoint_map
 
-    def _get_config_with_retry(self, cxt, filters, pod, service, retry):
-        conf_list = api.list_cached_endpoints(cxt, filters)
-        if len(conf_list) == 0:
-            if not retry:
-                raise exceptions.EndpointNotFound(pod, service)
+    def _get_endpoint_url(self, cxt, pod_id, service, retry):
+        url = api.get_cached_endpoint_url(cxt, pod_id, service)
+        if url:
+            return url
+        # endpoints not found in the latest catalog pull are remembered for
+        # a while, so lookups of them do not pull the whole catalog again
+        if retry and not api.is_cached_endpoint_missing(pod_id, service):
             self._update_endpoint_from_keystone(cxt, True)
-            return self._get_config_with_retry(cxt,
-                                               filters, pod, service, False)
-        return conf_list
+            url = api.get_cached_endpoint_url(cxt, pod_id, service)
+            if url:
+                return url
+            api.mark_cached_endpoint_missing(pod_id, service)
+        raise exceptions.EndpointNotFound(pod_id, service)
 
     def _unset_endpoint(self, service):
         handle = self.service_handle_map[service]
@@ -271,22 +331,13 @@ class Client(object):
     def _ensure_endpoint_set(self, cxt, service):
         handle = self.service_handle_map[service]
         if not handle.is_endpoint_url_set():
-            pod_filters = [{'key': 'region_name',
-                            'comparator': 'eq',
-                            'value': self.region_name}]
-            pod_list = api.list_pods(cxt, pod_filters)
-            if len(pod_list) == 0:
+            pod = api.get_pod_by_name(cxt, self.region_name)
+            if not pod:
                 raise exceptions.ResourceNotFound(models.Pod,
                                                   self.region_name)
-            # region_name is unique key, safe to get the first element
-            pod_id = pod_list[0]['pod_id']
-            config_filters = [
-                {'key': 'pod_id', 'comparator': 'eq', 'value': pod_id},
-                {'key': 'service_type', 'comparator': 'eq', 'value': service}]
-            conf_list = self._get_config_with_retry(
-                cxt, config_filters, pod_id, service,
+            url = self._get_endpoint_url(
+                cxt, pod['pod_id'], service,
                 cfg.CONF.client.auto_refresh_endpoint)
-            url = conf_list[0]['service_url']
             handle.update_endpoint_url(url)
 
     def _update_endpoint_from_keystone(self, cxt, is_internal):
@@ -306,40 +357,16 @@ class Client(object):
         else:
             endpoint_map = self._get_endpoint_from_keystone(cxt)
 
+        pod_endpoints = {}
         for region in endpoint_map:
             # use region name to query pod
-            pod_filters = [{'key': 'region_name', 'comparator': 'eq',
-                            'value': region}]
-            pod_list = api.list_pods(cxt, pod_filters)
+            pod = api.get_pod_by_name(cxt, region)
             # skip region/pod not registered in cascade service
-            if len(pod_list) != 1:
+            if not pod:
                 continue
-            for service in endpoint_map[region]:
-                pod_id = pod_list[0]['pod_id']
-                config_filters = [{'key': 'pod_id', 'comparator': 'eq',
-                                   'value': pod_id},
-                                  {'key': 'service_type', 'comparator': 'eq',
-                                   'value': service}]
-                config_list = api.list_cached_endpoints(
-                    cxt, config_filters)
-
-                if len(config_list) > 1:
-                    continue
-                if len(config_list) == 1:
-                    config_id = config_list[0]['service_id']
-                    update_dict = {
-                        'service_url': endpoint_map[region][service]}
-                    api.update_cached_endpoints(
-                        cxt, config_id, update_dict)
-                else:
-                    config_dict = {
-                        'service_id': str(uuid.uuid4()),
-                        'pod_id': pod_id,
-                        'service_type': service,
-                        'service_url': endpoint_map[region][service]
-                    }
-                    api.create_cached_endpoints(
-                        cxt, config_dict)
+            pod_endpoints[pod['pod_id']] = endpoint_map[region]
+        # endpoints of all the regions are written in one transaction
+        api.upsert_cached_endpoints(cxt, pod_endpoints)
 
     def get_endpoint(self, cxt, pod_id, service):
         """Get endpoint url of given pod and service
@@ -350,13 +377,8 @@ class Client(object):
         :return: endpoint url for given pod and service
         :raises: EndpointNotUnique, EndpointNotFound
         """
-        config_filters = [
-            {'key': 'pod_id', 'comparator': 'eq', 'value': pod_id},
-            {'key': 'service_type', 'comparator': 'eq', 'value': service}]
-        conf_list = self._get_config_with_retry(
-            cxt, config_filters, pod_id, service,
-            cfg.CONF.client.auto_refresh_endpoint)
-        return conf_list[0]['service_url']
+        return self._get_endpoint_url(cxt, pod_id, service,
+                                      cfg.CONF.client.auto_refresh_endpoint)
 
     def update_endpoint_from_keystone(self, cxt):
         """Update the database by querying service endpoint url from Keystone
@@ -418,6 +440,38 @@ class Client(object):
         filters = filters or []
         return handle.handle_list(cxt, resource, filters)
 
+    def get_resources_bulk(self, resource, cxt, ids, fields=None):
+        """Get resources of given ids in pod of top layer
+
+        Instead of one get request per resource, ids are split into chunks of
+        at most max_bulk_get_size and each chunk is queried with one list
+        request filtering by multiple ids.
+
+        :param resource: resource type
+        :param cxt: context object
+        :param ids: ids of the resources
+        :param fields: list of field names to return, "id" is always
+        returned, None to return all fields
+        :return: dict of id -> resource dict, resources not found are absent
+        :raises: EndpointNotAvailable
+        """
+        ids = list(collections.OrderedDict.fromkeys(ids))
+        if fields:
+            fields = list(set(fields) | set(['id']))
+        chunk_size = max(cfg.CONF.client.max_bulk_get_size, 1)
+        resources = {}
+        for i in xrange(0, len(ids), chunk_size):
+            filters = [{'key': 'id', 'comparator': 'eq',
+                        'value': ids[i: i + chunk_size]}]
+            if fields:
+                # filters are passed to the list request as query parameters,
+                # so fields works the same way as in the native client
+                filters.append({'key': 'fields', 'comparator': 'eq',
+                                'value': fields})
+            for res in self.list_resources(resource, cxt, filters):
+                resources[res['id']] = res
+        return resources
+
     @_safe_operation('create')
     def create_resources(self, resource, cxt, *args, **kwargs):
         """Create resource in pod of top layer
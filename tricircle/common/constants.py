@@ -174,6 +174,22 @@ job_handles = {
     JT_RESOURCE_RECYCLE: "recycle_resources"
 }
 
+# map job type to its priority when redoing failed or new jobs, jobs with
+# smaller value are handled first
+job_priority_map = {
+    JT_PORT_DELETE: 0,
+    JT_CONFIGURE_ROUTE: 1,
+    JT_ROUTER_SETUP: 1,
+    JT_SEG_RULE_SETUP: 1,
+    JT_NETWORK_UPDATE: 2,
+    JT_SUBNET_UPDATE: 2,
+    JT_SHADOW_PORT_SETUP: 2,
+    JT_TRUNK_SYNC: 2,
+    JT_SFC_SYNC: 2,
+    JT_RESOURCE_RECYCLE: 3
+}
+JOB_DEFAULT_PRIORITY = 2
+
 # map job type to its primary resource and then we only validate the project_id
 # of that resource. For JT_SEG_RULE_SETUP, as it has only one project_id
 # parameter, there is no need to validate it.
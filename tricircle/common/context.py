@@ -15,6 +15,7 @@
 
 import copy
 
+from eventlet import corolocal
 from pecan import request
 
 import oslo_context.context as oslo_ctx
@@ -161,13 +162,16 @@ class ContextBase(oslo_ctx.RequestContext):
 class Context(ContextBase):
     def __init__(self, **kwargs):
         super(Context, self).__init__(**kwargs)
-        self._session = None
+        # a database session can not be shared by green threads, so every
+        # green thread using the context gets its own session
+        self._local = corolocal.local()
 
     @property
     def session(self):
-        if not self._session:
-            self._session = core.get_session()
-        return self._session
+        session = getattr(self._local, 'session', None)
+        if not session:
+            session = self._local.session = core.get_session()
+        return session
 
     def elevated(self, read_deleted=None, overwrite=False):
         """Return a version of this context with admin flag set."""
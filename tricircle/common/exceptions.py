@@ -273,6 +273,22 @@ class RoutingBindFail(TricircleException):
         super(RoutingBindFail, self).__init__(_type=_type)
 
 
+class FanoutTimeout(TricircleException):
+    message = _("Operation on %(label)s timed out after %(timeout)s seconds")
+
+
+class FanoutFailed(TricircleException):
+    message = _("Operation failed on %(count)d of %(total)d targets: "
+                "%(reasons)s")
+
+    def __init__(self, failures, total):
+        self.failures = failures
+        reasons = '; '.join(['%s: %s' % (label, six.text_type(e))
+                             for label, e in failures])
+        super(FanoutFailed, self).__init__(count=len(failures), total=total,
+                                           reasons=reasons)
+
+
 class RouterNetworkLocationMismatch(exceptions.InvalidInput):
     message = _("router located in %(router_az_hint)s, but network located "
                 "in %(net_az_hints)s, location mismatch.")
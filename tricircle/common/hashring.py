@@ -0,0 +1,57 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import hashlib
+
+import six
+
+# number of points each node takes on the ring, more points give a more even
+# distribution of keys
+DEFAULT_REPLICAS = 64
+
+
+class HashRing(object):
+    """Consistent hash ring
+
+    Each node is placed at several points of the ring and a key belongs to
+    the node of the first point after the hash of the key. When a node joins
+    or leaves the ring, only the keys of that node move, keys of the other
+    nodes stay where they are.
+    """
+
+    def __init__(self, nodes, replicas=DEFAULT_REPLICAS):
+        self.nodes = frozenset(nodes)
+        self._ring = {}
+        for node in self.nodes:
+            for i in six.moves.xrange(replicas):
+                self._ring[self._hash('%s-%d' % (node, i))] = node
+        self._points = sorted(self._ring)
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(
+            six.text_type(key).encode('utf-8')).hexdigest()[:8], 16)
+
+    def get_node(self, key):
+        """Get the node a key belongs to
+
+        :param key: key to look up, like a resource id
+        :return: the node owning the key, None if the ring is empty
+        """
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, self._hash(key))
+        return self._ring[self._points[index % len(self._points)]]
@@ -20,6 +20,7 @@ from six.moves import xrange
 import oslo_db.exception as db_exc
 
 from tricircle.common import exceptions
+from tricircle.db import cache
 from tricircle.db import core
 from tricircle.db import models
 
@@ -64,6 +65,7 @@ def get_or_create_route(t_ctx, q_ctx,
                         core.update_resource(t_ctx,
                                              models.ResourceRouting,
                                              route['id'], route)
+                        cache.routing_cache.invalidate_top_id(_id)
                         return route, RES_DONE
                     try:
                         core.delete_resource(t_ctx,
@@ -126,7 +128,8 @@ def get_or_create_element(t_ctx, q_ctx,
                 route['bottom_id'] = new_ele['id']
                 core.update_resource(t_ctx, models.ResourceRouting,
                                      route['id'], route)
-                break
+            cache.routing_cache.invalidate_top_id(ele['id'])
+            break
     if not route:
         raise exceptions.RoutingCreateFail(_type)
     if not route['bottom_id']:
@@ -0,0 +1,163 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Job execution statistics format shared by xjob workers and the API
+
+Statistics of a worker are kept in the following format, so they can be
+saved as json and stats of different workers can be merged::
+
+    {job_type: {'counters': {counter_name: count},
+                'timers': {timer_name: histogram},
+                'pod_calls': {region_name: histogram}}}
+
+    histogram: {'count': count, 'sum': seconds,
+                'buckets': [cumulative count of each bucket in BUCKETS]}
+
+Recording is done by tricircle.xjob.telemetry in the xjob workers, this
+module only holds the format and the aggregation of saved statistics.
+
+The job queue, jobs whose latest status is new or failed, is shared by all
+the workers, so its statistics are computed from the job table on demand.
+"""
+
+import copy
+import os
+
+from oslo_utils import timeutils
+import six
+
+# upper bounds in seconds of histogram buckets, the last bucket is +Inf
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800)
+
+QUEUE_WAIT = 'queue_wait'
+LOCK_WAIT = 'lock_wait'
+EXECUTION = 'execution'
+TIMERS = (QUEUE_WAIT, LOCK_WAIT, EXECUTION)
+
+SUCCESS = 'success'
+FAIL = 'fail'
+LOCK_FAIL = 'lock_fail'
+RETRY = 'retry'
+EXPIRED = 'expired'
+TIMEOUT = 'timeout'
+COUNTERS = (SUCCESS, FAIL, LOCK_FAIL, RETRY, EXPIRED, TIMEOUT)
+
+
+def new_histogram():
+    return {'count': 0, 'sum': 0.0, 'buckets': [0] * (len(BUCKETS) + 1)}
+
+
+def observe_histogram(histogram, seconds):
+    histogram['count'] += 1
+    histogram['sum'] += seconds
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram['buckets'][i] += 1
+    histogram['buckets'][-1] += 1
+
+
+def _merge_histogram(histogram, other):
+    histogram['count'] += other['count']
+    histogram['sum'] += other['sum']
+    histogram['buckets'] = [
+        a + b for a, b in zip(histogram['buckets'], other['buckets'])]
+
+
+def merge_stats(stats_list):
+    """Merge statistics of several workers into one"""
+    merged = {}
+    for stats in stats_list:
+        for job_type, job_stats in six.iteritems(stats):
+            if job_type not in merged:
+                merged[job_type] = copy.deepcopy(job_stats)
+                continue
+            merged_stats = merged[job_type]
+            for name, count in six.iteritems(job_stats['counters']):
+                merged_stats['counters'][name] = merged_stats[
+                    'counters'].get(name, 0) + count
+            for key in ('timers', 'pod_calls'):
+                for name, histogram in six.iteritems(job_stats[key]):
+                    if name in merged_stats[key]:
+                        _merge_histogram(merged_stats[key][name], histogram)
+                    else:
+                        merged_stats[key][name] = copy.deepcopy(histogram)
+    return merged
+
+
+def get_queue_stats(new_jobs, failed_jobs):
+    """Get statistics of the job queue
+
+    :param new_jobs: jobs whose latest status is new, with timestamp
+    :param failed_jobs: jobs whose latest status is failed, with timestamp
+    :return: dict with depth, new_jobs, failed_jobs, max_wait_time and
+             avg_wait_time
+    """
+    now = timeutils.utcnow()
+    wait_times = [(now - job['timestamp']).total_seconds()
+                  for job in new_jobs + failed_jobs]
+    return {'depth': len(wait_times),
+            'new_jobs': len(new_jobs),
+            'failed_jobs': len(failed_jobs),
+            'max_wait_time': max(wait_times) if wait_times else 0,
+            'avg_wait_time': (sum(wait_times) / len(wait_times)
+                              if wait_times else 0)}
+
+
+def _format_histogram(lines, metric, labels, histogram):
+    for bound, count in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+        lines.append('%s_bucket{%s,le="%s"} %d' % (
+            metric, labels, bound, count))
+    lines.append('%s_sum{%s} %f' % (metric, labels, histogram['sum']))
+    lines.append('%s_count{%s} %d' % (metric, labels, histogram['count']))
+
+
+def format_prometheus(stats):
+    """Format statistics in Prometheus text exposition format"""
+    lines = []
+    job_types = sorted(stats)
+    lines.append('# TYPE tricircle_job_total counter')
+    for job_type in job_types:
+        for name, count in sorted(six.iteritems(
+                stats[job_type]['counters'])):
+            lines.append('tricircle_job_total{type="%s",outcome="%s"} %d' % (
+                job_type, name, count))
+    for timer in TIMERS:
+        metric = 'tricircle_job_%s_seconds' % timer
+        lines.append('# TYPE %s histogram' % metric)
+        for job_type in job_types:
+            _format_histogram(lines, metric, 'type="%s"' % job_type,
+                              stats[job_type]['timers'][timer])
+    metric = 'tricircle_job_pod_call_seconds'
+    lines.append('# TYPE %s histogram' % metric)
+    for job_type in job_types:
+        for region_name, histogram in sorted(six.iteritems(
+                stats[job_type]['pod_calls'])):
+            _format_histogram(
+                lines, metric,
+                'type="%s",region="%s"' % (job_type, region_name), histogram)
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_file(path, stats):
+    """Write statistics to the file atomically
+
+    The content is written to a temporary file first and then renamed, so
+    readers like the textfile collector of node exporter never see a
+    partial file.
+    """
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(format_prometheus(stats))
+    os.rename(tmp_path, path)
@@ -14,13 +14,13 @@
 #    under the License.
 
 import tricircle.common.client
-
-# Todo: adding rpc cap negotiation configuration after first release
-# import tricircle.common.xrpcapi
+import tricircle.common.xrpcapi
 
 
 def list_opts():
     return [
         ('client', tricircle.common.client.client_opts),
+        ('DEFAULT', tricircle.common.xrpcapi.xjob_opts),
+        # Todo: adding rpc cap negotiation configuration after first release
         # ('upgrade_levels', tricircle.common.xrpcapi.rpcapi_cap_opt),
     ]
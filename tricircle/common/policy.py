@@ -62,6 +62,7 @@ ADMIN_API_JOB_LIST = 'admin_api:jobs:list'
 ADMIN_API_JOB_SCHEMA_LIST = 'admin_api:jobs:schema_list'
 ADMIN_API_JOB_REDO = 'admin_api:jobs:redo'
 ADMIN_API_JOB_DELETE = 'admin_api:jobs:delete'
+ADMIN_API_JOB_STATS = 'admin_api:jobs:stats'
 
 
 tricircle_admin_api_policies = [
@@ -108,7 +109,10 @@ tricircle_admin_api_policies = [
                        description='Redo job'),
     policy.RuleDefault(ADMIN_API_JOB_DELETE,
                        'rule:admin_api',
-                       description='Delete job')
+                       description='Delete job'),
+    policy.RuleDefault(ADMIN_API_JOB_STATS,
+                       'rule:admin_api',
+                       description='Show job statistics')
 ]
 
 
@@ -13,14 +13,23 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import datetime
+import os
+import time
+
+import eventlet
 import keystoneauth1.identity.generic as auth_identity
 from keystoneauth1 import session
+import requests
 
+from neutronclient import client as q_http_client
 from neutronclient.common import exceptions as q_exceptions
 from neutronclient.neutron import client as q_client
 from neutronclient.v2_0 import client as neutron_client
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import timeutils
 from tricircle.common import constants as cons
 from tricircle.common import exceptions
 
@@ -28,6 +37,23 @@ client_opts = [
     cfg.IntOpt('neutron_timeout',
                default=60,
                help='timeout for neutron client in seconds'),
+    cfg.IntOpt('neutron_client_pool_size',
+               default=64,
+               help='Max number of neutron clients kept for reuse, clients '
+                    'are pooled per endpoint and token and share keep-alive '
+                    'connections to the endpoint. Set to 0 to create a new '
+                    'client for every request'),
+    cfg.IntOpt('neutron_client_idle_timeout',
+               default=300,
+               help='Seconds a pooled neutron client stays unused before it '
+                    'is evicted'),
+    cfg.IntOpt('admin_token_refresh_margin',
+               default=300,
+               help='Seconds ahead of expiry a cached admin token is '
+                    'refreshed in background. Tokens not used since the last '
+                    'fetch are dropped instead. Set to 0 to disable the '
+                    'background refresh, tokens are then fetched again when '
+                    'they are about to expire'),
 ]
 cfg.CONF.register_opts(client_opts, group='client')
 
@@ -64,6 +90,241 @@ class SimpleNeutronClient(neutron_client.Client):
         return self.delete(self.tricircle_resource_path % (resource))
 
 
+class _SessionHTTPClient(q_http_client.HTTPClient):
+    """HTTP client sending requests through a shared requests session
+
+    neutronclient sends every request with requests.request, which opens a
+    new connection each time. Sending through a session keeps connections
+    to the endpoint alive for later requests.
+    """
+
+    def __init__(self, http_session, **kwargs):
+        super(_SessionHTTPClient, self).__init__(**kwargs)
+        self.http_session = http_session
+
+    def request(self, url, method, body=None, headers=None, **kwargs):
+        content_type = kwargs.pop('content_type', None) or 'application/json'
+        headers = headers or {}
+        headers.setdefault('Accept', content_type)
+        if body:
+            headers.setdefault('Content-Type', content_type)
+        if self.global_request_id:
+            headers.setdefault(q_http_client.REQ_ID_HEADER,
+                               self.global_request_id)
+        headers['User-Agent'] = q_http_client.USER_AGENT
+        if q_http_client.osprofiler_web:
+            headers.update(q_http_client.osprofiler_web.get_trace_id_headers())
+        resp = self.http_session.request(
+            method, url, data=body, headers=headers,
+            verify=self.verify_cert, timeout=self.timeout, **kwargs)
+        return resp, resp.text
+
+
+class NeutronClientPool(object):
+    """Pool of neutron clients shared by all neutron resource handles
+
+    Clients are keyed by endpoint and token, and clients of the same
+    endpoint share one requests session, so connections to the endpoint are
+    reused even after the token changes. The least recently used clients are
+    evicted when the pool is full, and clients unused for
+    neutron_client_idle_timeout seconds are evicted, together with the
+    session once no client of the endpoint is left.
+    """
+
+    def __init__(self):
+        # (endpoint_url, token) -> (client, last used time)
+        self._clients = collections.OrderedDict()
+        # endpoint_url -> requests session
+        self._sessions = {}
+
+    def _evict(self, now):
+        max_size = cfg.CONF.client.neutron_client_pool_size
+        idle_timeout = cfg.CONF.client.neutron_client_idle_timeout
+        while self._clients:
+            key, (_, used_at) = next(iter(self._clients.items()))
+            if len(self._clients) <= max_size and (
+                    now - used_at < idle_timeout):
+                break
+            del self._clients[key]
+        endpoint_urls = set(key[0] for key in self._clients)
+        for endpoint_url in list(self._sessions):
+            if endpoint_url not in endpoint_urls:
+                self._sessions.pop(endpoint_url).close()
+
+    def get(self, endpoint_url, token, auth_url, timeout):
+        kwargs = {'token': token, 'auth_url': auth_url,
+                  'endpoint_url': endpoint_url, 'timeout': timeout}
+        if cfg.CONF.client.neutron_client_pool_size <= 0:
+            return SimpleNeutronClient(**kwargs)
+        now = time.time()
+        self._evict(now)
+        key = (endpoint_url, token)
+        client = self._clients.pop(key, (None, None))[0]
+        if not client:
+            if endpoint_url not in self._sessions:
+                self._sessions[endpoint_url] = requests.Session()
+            client = SimpleNeutronClient(**kwargs)
+            client.httpclient = _SessionHTTPClient(
+                self._sessions[endpoint_url], **kwargs)
+        # the most recently used client goes to the end
+        self._clients[key] = (client, now)
+        self._evict(now)
+        return client
+
+    def clear(self):
+        self._clients.clear()
+        for http_session in self._sessions.values():
+            http_session.close()
+        self._sessions.clear()
+
+
+neutron_client_pool = NeutronClientPool()
+
+# a cached token is fetched again before use if it expires within this time
+_MIN_TOKEN_LIFE = 60
+# seconds between two checks of the background token refresh
+_TOKEN_REFRESH_CHECK_INTERVAL = 30
+
+
+class AdminTokenManager(object):
+    """Cache of admin tokens scoped to projects
+
+    Keystone is hit once per token lifetime instead of once per call. A
+    green thread refreshes the tokens used since their last fetch ahead of
+    expiry, so requests don't wait for Keystone. A token rejected by a
+    service, for example revoked or issued before the admin credentials were
+    rotated, is dropped with invalidate() and fetched again on next use. The
+    numbers of fetches, cache hits and background refreshes are kept for
+    debugging, see get_stats().
+    """
+
+    def __init__(self):
+        # project_id -> {'token', 'project_id', 'expires_at', 'used'}, None
+        # key is for the admin project
+        self._tokens = {}
+        # project_id -> green thread fetching the token
+        self._fetchers = {}
+        self._refresher_pid = None
+        self.stats = {'fetches': 0, 'hits': 0, 'refreshes': 0}
+
+    @staticmethod
+    def _fetch(project_id):
+        sess = ResourceHandle.get_keystone_session(project_id)
+        auth_ref = sess.auth.get_access(sess)
+        return {'token': auth_ref.auth_token,
+                'project_id': auth_ref.project_id,
+                'expires_at': timeutils.normalize_time(auth_ref.expires),
+                'used': False}
+
+    def _fetch_once(self, project_id):
+        # concurrent callers share one fetch of the same project
+        fetcher = self._fetchers.get(project_id)
+        if fetcher is not None:
+            return fetcher.wait()
+        fetcher = eventlet.spawn(self._fetch, project_id)
+        self._fetchers[project_id] = fetcher
+        try:
+            entry = fetcher.wait()
+        finally:
+            self._fetchers.pop(project_id, None)
+        self._tokens[project_id] = entry
+        self.stats['fetches'] += 1
+        LOG.debug('Fetched admin token of project %(project_id)s, token '
+                  'stats: %(stats)s',
+                  {'project_id': project_id, 'stats': self.stats})
+        return entry
+
+    def _ensure_refresher(self):
+        if cfg.CONF.client.admin_token_refresh_margin <= 0:
+            return
+        # green threads of the parent process don't run in forked workers
+        if self._refresher_pid != os.getpid():
+            self._refresher_pid = os.getpid()
+            eventlet.spawn(self._refresh_loop)
+
+    def _refresh_loop(self):
+        while True:
+            eventlet.sleep(_TOKEN_REFRESH_CHECK_INTERVAL)
+            try:
+                self.refresh()
+            except Exception:
+                LOG.exception('Failed to refresh admin tokens')
+
+    def refresh(self):
+        """Refresh tokens about to expire"""
+        margin = datetime.timedelta(
+            seconds=cfg.CONF.client.admin_token_refresh_margin)
+        now = timeutils.utcnow()
+        for project_id, entry in list(self._tokens.items()):
+            if entry['expires_at'] - now > margin:
+                continue
+            if not entry['used']:
+                # not used during its lifetime, stop refreshing it
+                self._tokens.pop(project_id, None)
+                continue
+            try:
+                self._fetch_once(project_id)
+            except Exception:
+                # the token is fetched again on use once it expires
+                LOG.exception('Failed to refresh admin token of project '
+                              '%(project_id)s', {'project_id': project_id})
+                continue
+            self.stats['refreshes'] += 1
+
+    def _get_entry(self, project_id):
+        entry = self._tokens.get(project_id)
+        if entry and entry['expires_at'] - timeutils.utcnow() > (
+                datetime.timedelta(seconds=_MIN_TOKEN_LIFE)):
+            self.stats['hits'] += 1
+        else:
+            entry = self._fetch_once(project_id)
+            self._ensure_refresher()
+        entry['used'] = True
+        return entry
+
+    def get_token(self, project_id=None):
+        """Get an admin token
+
+        :param project_id: project the token is scoped to, the admin project
+                           if not given
+        :return: token id
+        """
+        return self._get_entry(project_id)['token']
+
+    def get_project_id(self, project_id=None):
+        """Get id of the project an admin token is scoped to"""
+        return self._get_entry(project_id)['project_id']
+
+    def is_cached(self, token):
+        """Check if the token is an admin token from the cache"""
+        return any(entry['token'] == token
+                   for entry in list(self._tokens.values()))
+
+    def invalidate(self, token):
+        """Drop the cached entries of a rejected token
+
+        :param token: token id
+        :return: True if the token was cached
+        """
+        dropped = False
+        for project_id, entry in list(self._tokens.items()):
+            if entry['token'] == token:
+                self._tokens.pop(project_id, None)
+                dropped = True
+        if dropped:
+            LOG.warning('Cached admin token rejected, dropped from cache')
+        return dropped
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def clear(self):
+        self._tokens.clear()
+
+
+admin_token_manager = AdminTokenManager()
+
+
 def _transform_filters(filters):
     filter_dict = {}
     for query_filter in filters:
@@ -108,7 +369,7 @@ class ResourceHandle(object):
 
     @staticmethod
     def get_admin_token(project_id=None):
-        return ResourceHandle.get_keystone_session(project_id).get_token()
+        return admin_token_manager.get_token(project_id)
 
 
 class NeutronResourceHandle(ResourceHandle):
@@ -131,10 +392,9 @@ class NeutronResourceHandle(ResourceHandle):
         token = cxt.auth_token
         if not token and cxt.is_admin:
             token = self.get_admin_token(cxt.tenant)
-        return SimpleNeutronClient(token=token,
-                               auth_url=self.auth_url,
-                               endpoint_url=self.endpoint_url,
-                               timeout=cfg.CONF.client.neutron_timeout)
+        return neutron_client_pool.get(self.endpoint_url, token,
+                                       self.auth_url,
+                                       cfg.CONF.client.neutron_timeout)
 
     def handle_list(self, cxt, resource, filters):
         try:
@@ -146,6 +406,9 @@ class NeutronResourceHandle(ResourceHandle):
         except q_exceptions.ConnectionFailed:
             raise exceptions.EndpointNotAvailable(
                 'neutron', client.httpclient.endpoint_url)
+        except q_exceptions.Unauthorized:
+            admin_token_manager.invalidate(client.httpclient.auth_token)
+            raise
 
     def handle_create(self, cxt, resource, *args, **kwargs):
         try:
@@ -160,6 +423,9 @@ class NeutronResourceHandle(ResourceHandle):
         except q_exceptions.ConnectionFailed:
             raise exceptions.EndpointNotAvailable(
                 'neutron', client.httpclient.endpoint_url)
+        except q_exceptions.Unauthorized:
+            admin_token_manager.invalidate(client.httpclient.auth_token)
+            raise
 
     def handle_update(self, cxt, resource, *args, **kwargs):
         try:
@@ -169,6 +435,9 @@ class NeutronResourceHandle(ResourceHandle):
         except q_exceptions.ConnectionFailed:
             raise exceptions.EndpointNotAvailable(
                 'neutron', client.httpclient.endpoint_url)
+        except q_exceptions.Unauthorized:
+            admin_token_manager.invalidate(client.httpclient.auth_token)
+            raise
 
     def handle_get(self, cxt, resource, resource_id):
         try:
@@ -177,6 +446,9 @@ class NeutronResourceHandle(ResourceHandle):
         except q_exceptions.ConnectionFailed:
             raise exceptions.EndpointNotAvailable(
                 'neutron', client.httpclient.endpoint_url)
+        except q_exceptions.Unauthorized:
+            admin_token_manager.invalidate(client.httpclient.auth_token)
+            raise
         except q_exceptions.NotFound:
             LOG.debug("%(resource)s %(resource_id)s not found",
                       {'resource': resource, 'resource_id': resource_id})
@@ -189,6 +461,9 @@ class NeutronResourceHandle(ResourceHandle):
         except q_exceptions.ConnectionFailed:
             raise exceptions.EndpointNotAvailable(
                 'neutron', client.httpclient.endpoint_url)
+        except q_exceptions.Unauthorized:
+            admin_token_manager.invalidate(client.httpclient.auth_token)
+            raise
         except q_exceptions.NotFound:
             LOG.debug("Delete %(resource)s %(resource_id)s which not found",
                       {'resource': resource, 'resource_id': resource_id})
@@ -203,6 +478,9 @@ class NeutronResourceHandle(ResourceHandle):
         except q_exceptions.ConnectionFailed:
             raise exceptions.EndpointNotAvailable(
                 'neutron', client.httpclient.endpoint_url)
+        except q_exceptions.Unauthorized:
+            admin_token_manager.invalidate(client.httpclient.auth_token)
+            raise
 
 
 def _convert_into_with_meta(item, resp):
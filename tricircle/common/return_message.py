@@ -113,6 +113,10 @@ class ResourceNotFound(FailureMessage):
     message = _("Resource could not be found.")
     code = 404
 
+class InvalidExpand(FailureMessage):
+    message = _("Invalid expand: %(expand)s, supported: %(supported)s.")
+    code = 400
+
 class CoreRouterNotFound(ResourceNotFound):
     message = _("CoreRouter %(core_router_id)s could not be found.")
     
@@ -155,6 +155,29 @@ def format_error(code, message, error_type=None):
     return {error_type: {'message': message, 'code': code, 'status':'fail','content':{}}}
 
 
+def get_expand_params(params, supported):
+    """Get relationships to expand from the "expand" query parameter
+
+    The parameter can be a comma separated string like expand=routes,dcs or
+    be repeated like expand=routes&expand=dcs.
+
+    :param params: the URI params coming from the wsgi layer
+    :param supported: names of the relationships can be expanded
+    :return: (flag, expand), flag indicates whether all the names are
+    supported, and expand denotes the list of names
+    """
+    values = params.get('expand') or []
+    if not isinstance(values, list):
+        values = [values]
+    expand = []
+    for value in values:
+        expand.extend(name.strip() for name in value.split(',')
+                      if name.strip())
+    if [name for name in expand if name not in supported]:
+        return False, expand
+    return True, expand
+
+
 def format_api_error(code, message, error_type=None):
     return format_error(code, message, error_type)
 
@@ -16,10 +16,17 @@
 Client side of the job daemon RPC API.
 """
 
+import datetime
+import time
+
+import eventlet
+
 from oslo_config import cfg
 import oslo_messaging as messaging
+from oslo_utils import timeutils
 
 from tricircle.common import constants
+from tricircle.common import hashring
 from tricircle.common import rpc
 from tricircle.common import serializer as t_serializer
 from tricircle.common import topics
@@ -34,6 +41,55 @@ rpcapi_cap_opt = cfg.StrOpt('xjobapi',
                                  'xjob api in any service')
 CONF.register_opt(rpcapi_cap_opt, 'upgrade_levels')
 
+xjob_opts = [
+    cfg.BoolOpt('enable_job_coalescing',
+                default=True,
+                help='Whether to coalesce job triggers for a resource which '
+                     'already has a pending new job. The timestamp of the '
+                     'pending job is bumped instead of creating a new job '
+                     'and notifying the xjob daemon again'),
+    cfg.FloatOpt('job_coalescing_window',
+                 default=0,
+                 help='Seconds to delay notifying the xjob daemon of a new '
+                      'job, job triggers for the same resource within this '
+                      'window are coalesced into the new job. Set to 0 to '
+                      'notify at once'),
+    cfg.BoolOpt('enable_job_sharding',
+                default=False,
+                help='Whether to shard jobs across xjob worker processes by '
+                     'resource id with a consistent hash ring. Jobs of a '
+                     'resource are sent to the worker owning it, and the '
+                     'shards rebalance when workers join or leave'),
+    cfg.IntOpt('xjob_worker_down_time',
+               default=30,
+               help='Seconds since the last heartbeat after which an xjob '
+                    'worker is considered down and removed from the hash '
+                    'ring for job sharding. Job triggers sent to a worker '
+                    'that is down but not yet removed stay in its queue '
+                    'until the worker of the same index on the host '
+                    'restarts, otherwise the jobs are only recovered by '
+                    'the periodic redo task'),
+    cfg.IntOpt('max_job_wait_time',
+               default=300,
+               help='Maximum seconds a caller can wait for a job to be '
+                    'handled by the xjob daemon'),
+    cfg.IntOpt('redo_time_span',
+               default=172800,
+               help='Time span in seconds, we calculate the latest job '
+                    'timestamp by subtracting this time span from the '
+                    'current timestamp, jobs created between these two '
+                    'timestamps will be redone and are counted in the job '
+                    'queue statistics'),
+]
+CONF.register_opts(xjob_opts)
+
+# seconds to cache the hash ring of xjob workers before reloading it
+_SHARD_RING_REFRESH_INTERVAL = 5
+# seconds between the first two checks of a job being waited for, the
+# interval is doubled after every check up to _MAX_WAIT_JOB_POLL_INTERVAL
+_WAIT_JOB_POLL_INTERVAL = 0.5
+_MAX_WAIT_JOB_POLL_INTERVAL = 5
+
 
 class XJobAPI(object):
 
@@ -63,22 +119,97 @@ class XJobAPI(object):
         self.client = rpc.get_client(target,
                                      version_cap=version_cap,
                                      serializer=serializer)
+        self._shard_ring = hashring.HashRing([])
+        self._shard_ring_loaded_at = None
 
     # to do the version compatibility for future purpose
     def _determine_version_cap(self, target):
         version_cap = 1.0
         return version_cap
 
-    def invoke_method(self, ctxt, project_id, method, _type, id):
-        db_api.new_job(ctxt, project_id, _type, id)
-        self.client.prepare(exchange='openstack').cast(
-            ctxt, method, payload={_type: id})
+    def _get_shard_ring(self, ctxt):
+        now = time.time()
+        if self._shard_ring_loaded_at is None or (
+                now - self._shard_ring_loaded_at >=
+                _SHARD_RING_REFRESH_INTERVAL):
+            alive_after = timeutils.utcnow() - datetime.timedelta(
+                seconds=CONF.xjob_worker_down_time)
+            workers = db_api.list_xjob_workers(ctxt, alive_after)
+            if set(workers) != self._shard_ring.nodes:
+                self._shard_ring = hashring.HashRing(workers)
+            self._shard_ring_loaded_at = now
+        return self._shard_ring
+
+    def get_shard_worker(self, ctxt, resource_id):
+        """Get the xjob worker owning jobs of the resource
+
+        :param ctxt: tricircle context
+        :param resource_id: resource id of the job
+        :return: name of the worker, None if no worker is alive
+        """
+        return self._get_shard_ring(ctxt).get_node(resource_id)
+
+    def _cast(self, ctxt, method, _type, id):
+        server = None
+        if CONF.enable_job_sharding:
+            server = self.get_shard_worker(ctxt, id)
+        if server:
+            # send to the worker owning the resource so jobs of one resource
+            # don't contend for the job lease in different workers
+            cctxt = self.client.prepare(exchange='openstack', server=server)
+        else:
+            cctxt = self.client.prepare(exchange='openstack')
+        cctxt.cast(ctxt, method, payload={_type: id})
+
+    def notify_job_done(self, ctxt, _type, id):
+        # every worker listens on the fanout queue of the topic
+        self.client.prepare(exchange='openstack', fanout=True).cast(
+            ctxt, 'job_done', payload={_type: id})
+
+    def wait_job(self, ctxt, job, timeout):
+        """Wait for a new job to be handled by the xjob daemon
+
+        The job is checked in the database with backoff in the calling
+        process, so waiters don't occupy green threads of xjob workers.
+
+        :param ctxt: tricircle context
+        :param job: dict of the new job
+        :param timeout: seconds to wait at most, capped by max_job_wait_time
+        :return: JS_Success or JS_Fail, None if the job is not handled before
+                 timeout
+        """
+        deadline = time.time() + min(timeout, CONF.max_job_wait_time)
+        interval = _WAIT_JOB_POLL_INTERVAL
+        while True:
+            result = db_api.get_job_result(ctxt, job['type'],
+                                           job['resource_id'],
+                                           job['timestamp'])
+            remaining = deadline - time.time()
+            if result or remaining <= 0:
+                return result
+            eventlet.sleep(min(interval, remaining))
+            interval = min(interval * 2, _MAX_WAIT_JOB_POLL_INTERVAL)
+
+    def invoke_method(self, ctxt, project_id, method, _type, id,
+                      coalesce=False):
+        if coalesce and CONF.enable_job_coalescing:
+            if db_api.touch_new_job(ctxt, _type, id):
+                # the daemon has been notified of the pending job
+                return
+            db_api.new_job(ctxt, project_id, _type, id)
+            if CONF.job_coalescing_window > 0:
+                eventlet.spawn_after(CONF.job_coalescing_window,
+                                     self._cast, ctxt, method, _type, id)
+                return
+        else:
+            db_api.new_job(ctxt, project_id, _type, id)
+        self._cast(ctxt, method, _type, id)
 
     def setup_bottom_router(self, ctxt, project_id, net_id, router_id, pod_id):
         self.invoke_method(
             ctxt, project_id, constants.job_handles[constants.JT_ROUTER_SETUP],
             constants.JT_ROUTER_SETUP,
-            '%s#%s#%s' % (pod_id, router_id, net_id))
+            '%s#%s#%s' % (pod_id, router_id, net_id), coalesce=True)
 
     def configure_route(self, ctxt, project_id, router_id):
         # NOTE(zhiyuan) this RPC is called by plugin in Neutron server, whose
@@ -88,44 +219,46 @@ class XJobAPI(object):
         self.invoke_method(
             ctxt, project_id,
             constants.job_handles[constants.JT_CONFIGURE_ROUTE],
-            constants.JT_CONFIGURE_ROUTE, router_id)
+            constants.JT_CONFIGURE_ROUTE, router_id, coalesce=True)
 
     def delete_server_port(self, ctxt, project_id, port_id, pod_id):
         self.invoke_method(
             ctxt, project_id, constants.job_handles[constants.JT_PORT_DELETE],
             constants.JT_PORT_DELETE,
-            '%s#%s' % (pod_id, port_id))
+            '%s#%s' % (pod_id, port_id), coalesce=True)
 
     def configure_security_group_rules(self, ctxt, project_id):
         self.invoke_method(
             ctxt, project_id,
             constants.job_handles[constants.JT_SEG_RULE_SETUP],
-            constants.JT_SEG_RULE_SETUP, project_id)
+            constants.JT_SEG_RULE_SETUP, project_id, coalesce=True)
 
     def update_network(self, ctxt, project_id, network_id, pod_id):
         self.invoke_method(
             ctxt, project_id,
             constants.job_handles[constants.JT_NETWORK_UPDATE],
             constants.JT_NETWORK_UPDATE,
-            '%s#%s' % (pod_id, network_id))
+            '%s#%s' % (pod_id, network_id), coalesce=True)
 
     def update_subnet(self, ctxt, project_id, subnet_id, pod_id):
         self.invoke_method(
             ctxt, project_id,
             constants.job_handles[constants.JT_SUBNET_UPDATE],
             constants.JT_SUBNET_UPDATE,
-            '%s#%s' % (pod_id, subnet_id))
+            '%s#%s' % (pod_id, subnet_id), coalesce=True)
 
     def setup_shadow_ports(self, ctxt, project_id, pod_id, net_id):
         self.invoke_method(
             ctxt, project_id,
             constants.job_handles[constants.JT_SHADOW_PORT_SETUP],
-            constants.JT_SHADOW_PORT_SETUP, '%s#%s' % (pod_id, net_id))
+            constants.JT_SHADOW_PORT_SETUP, '%s#%s' % (pod_id, net_id),
+            coalesce=True)
 
     def sync_trunk(self, t_ctx, project_id, trunk_id, pod_id):
         self.invoke_method(
             t_ctx, project_id, constants.job_handles[constants.JT_TRUNK_SYNC],
-            constants.JT_TRUNK_SYNC, '%s#%s' % (pod_id, trunk_id))
+            constants.JT_TRUNK_SYNC, '%s#%s' % (pod_id, trunk_id),
+            coalesce=True)
 
     def sync_service_function_chain(self, ctxt, project_id, portchain_id,
                                     net_id, pod_id):
@@ -133,10 +266,10 @@ class XJobAPI(object):
             ctxt, project_id,
             constants.job_handles[constants.JT_SFC_SYNC],
             constants.JT_SFC_SYNC,
-            '%s#%s#%s' % (pod_id, portchain_id, net_id))
+            '%s#%s#%s' % (pod_id, portchain_id, net_id), coalesce=True)
 
     def recycle_resources(self, ctxt, project_id):
         self.invoke_method(
             ctxt, project_id,
             constants.job_handles[constants.JT_RESOURCE_RECYCLE],
-            constants.JT_RESOURCE_RECYCLE, project_id)
+            constants.JT_RESOURCE_RECYCLE, project_id, coalesce=True)
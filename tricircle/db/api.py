@@ -13,15 +13,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import datetime
 import functools
+import six
+from six.moves import xrange
 import sqlalchemy as sql
-from sqlalchemy import or_
 import time
 
 from oslo_config import cfg
 from oslo_db import exception as db_exc
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
 
@@ -30,6 +33,7 @@ from tricircle.common.context import is_admin_context as _is_admin_context
 from tricircle.common import exceptions
 from tricircle.common.i18n import _
 
+from tricircle.db import cache
 from tricircle.db import core
 from tricircle.db import models
 
@@ -37,20 +41,28 @@ from tricircle.db import models
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
+# limit the length of "IN" clause when querying routings by top ids
+MAX_TOP_IDS_PER_QUERY = 500
+
 
 def create_pod(context, pod_dict):
     with context.session.begin():
-        return core.create_resource(context, models.Pod, pod_dict)
+        pod = core.create_resource(context, models.Pod, pod_dict)
+    cache.pod_registry.bump_version()
+    return pod
 
 
 def delete_pod(context, pod_id):
     with context.session.begin():
-        return core.delete_resource(context, models.Pod, pod_id)
+        core.delete_resource(context, models.Pod, pod_id)
+    cache.pod_registry.bump_version()
 
 
 def get_pod(context, pod_id):
-    with context.session.begin():
-        return core.get_resource(context, models.Pod, pod_id)
+    pod = cache.pod_registry.get_pod(context, pod_id)
+    if not pod:
+        raise exceptions.ResourceNotFound(models.Pod, pod_id)
+    return pod
 
 
 def list_pods(context, filters=None, sorts=None):
@@ -60,19 +72,23 @@ def list_pods(context, filters=None, sorts=None):
 
 def update_pod(context, pod_id, update_dict):
     with context.session.begin():
-        return core.update_resource(context, models.Pod, pod_id, update_dict)
+        pod = core.update_resource(context, models.Pod, pod_id, update_dict)
+    cache.pod_registry.bump_version()
+    return pod
 
 
 def create_cached_endpoints(context, config_dict):
     with context.session.begin():
-        return core.create_resource(context, models.CachedEndpoint,
-                                    config_dict)
+        endpoint = core.create_resource(context, models.CachedEndpoint,
+                                        config_dict)
+    cache.endpoint_registry.bump_version()
+    return endpoint
 
 
 def delete_cached_endpoints(context, config_id):
     with context.session.begin():
-        return core.delete_resource(context, models.CachedEndpoint,
-                                    config_id)
+        core.delete_resource(context, models.CachedEndpoint, config_id)
+    cache.endpoint_registry.bump_version()
 
 
 def get_cached_endpoints(context, config_id):
@@ -88,8 +104,61 @@ def list_cached_endpoints(context, filters=None, sorts=None):
 
 def update_cached_endpoints(context, config_id, update_dict):
     with context.session.begin():
-        return core.update_resource(
+        endpoint = core.update_resource(
             context, models.CachedEndpoint, config_id, update_dict)
+    cache.endpoint_registry.bump_version()
+    return endpoint
+
+
+def upsert_cached_endpoints(context, pod_endpoints):
+    """Create or update service endpoints of pods in bulk
+
+    Existing endpoints of the given pods are read with one query, then urls
+    of the changed ones are updated and the new ones are inserted in the
+    same transaction. (pod_id, service_type) pairs which already have more
+    than one endpoint are left untouched.
+
+    :param context: context object
+    :param pod_endpoints: dict of pod_id -> {service_type: service_url}
+    :return: None
+    """
+    if not pod_endpoints:
+        return
+    with context.session.begin():
+        query = context.session.query(models.CachedEndpoint).filter(
+            models.CachedEndpoint.pod_id.in_(list(pod_endpoints)))
+        existing = collections.defaultdict(list)
+        for endpoint in query:
+            existing[(endpoint.pod_id, endpoint.service_type)].append(
+                endpoint)
+        rows = []
+        for pod_id, service_urls in six.iteritems(pod_endpoints):
+            for service_type, service_url in six.iteritems(service_urls):
+                endpoints = existing.get((pod_id, service_type))
+                if not endpoints:
+                    rows.append({'service_id': uuidutils.generate_uuid(),
+                                 'pod_id': pod_id,
+                                 'service_type': service_type,
+                                 'service_url': service_url})
+                elif len(endpoints) == 1:
+                    if endpoints[0].service_url != service_url:
+                        endpoints[0].service_url = service_url
+        if rows:
+            context.session.execute(
+                models.CachedEndpoint.__table__.insert().values(rows))
+    cache.endpoint_registry.bump_version()
+
+
+def get_cached_endpoint_url(context, pod_id, service_type):
+    return cache.endpoint_registry.get_url(context, pod_id, service_type)
+
+
+def is_cached_endpoint_missing(pod_id, service_type):
+    return cache.endpoint_registry.is_missing(pod_id, service_type)
+
+
+def mark_cached_endpoint_missing(pod_id, service_type):
+    cache.endpoint_registry.mark_missing(pod_id, service_type)
 
 
 def create_resource_mapping(context, top_id, bottom_id, pod_id, project_id,
@@ -110,12 +179,94 @@ def create_resource_mapping(context, top_id, bottom_id, pod_id, project_id,
         return None
     finally:
         context.session.close()
+        cache.routing_cache.invalidate_top_id(top_id)
+
+
+def create_resource_mappings(context, entries):
+    """Create resource routings in bulk
 
+    Entries already in the routing table are skipped, the rest are inserted
+    with multi-row INSERT statements in one transaction. If other workers
+    insert some of the entries concurrently, fall back to creating the
+    remaining entries one by one.
 
-def list_resource_routings(context, filters=None, sorts=None):
+    :param context: context object
+    :param entries: a list of dicts with keys 'top_id', 'bottom_id',
+    'pod_id', 'project_id' and 'resource_type'
+    :return: a list of the entries actually inserted
+    """
+    unique_entries = collections.OrderedDict()
+    for entry in entries:
+        key = (entry['top_id'], entry['pod_id'], entry['resource_type'])
+        unique_entries.setdefault(key, entry)
+    if not unique_entries:
+        return []
+
+    top_ids = list(set(key[0] for key in unique_entries))
+    pod_ids = list(set(key[1] for key in unique_entries))
+    new_entries = []
+    try:
+        with context.session.begin():
+            existing_keys = set()
+            for i in xrange(0, len(top_ids), MAX_TOP_IDS_PER_QUERY):
+                query = context.session.query(
+                    models.ResourceRouting.top_id,
+                    models.ResourceRouting.pod_id,
+                    models.ResourceRouting.resource_type).filter(
+                    models.ResourceRouting.top_id.in_(
+                        top_ids[i: i + MAX_TOP_IDS_PER_QUERY]),
+                    models.ResourceRouting.pod_id.in_(pod_ids))
+                existing_keys.update(tuple(row) for row in query)
+            new_entries = [
+                entry for key, entry in six.iteritems(unique_entries)
+                if key not in existing_keys]
+            now = timeutils.utcnow()
+            rows = [{'top_id': entry['top_id'],
+                     'bottom_id': entry['bottom_id'],
+                     'pod_id': entry['pod_id'],
+                     'project_id': entry['project_id'],
+                     'resource_type': entry['resource_type'],
+                     'created_at': now} for entry in new_entries]
+            table = models.ResourceRouting.__table__
+            for i in xrange(0, len(rows), MAX_TOP_IDS_PER_QUERY):
+                context.session.execute(
+                    table.insert().values(rows[i: i + MAX_TOP_IDS_PER_QUERY]))
+    except db_exc.DBDuplicateEntry:
+        # some entries are created by others after we check, the whole
+        # transaction has been rolled back, create entries one by one
+        new_entries = [
+            entry for entry in new_entries if create_resource_mapping(
+                context, entry['top_id'], entry['bottom_id'],
+                entry['pod_id'], entry['project_id'],
+                entry['resource_type'])]
+    finally:
+        for top_id in top_ids:
+            cache.routing_cache.invalidate_top_id(top_id)
+    return new_entries
+
+
+def list_resource_routings(context, filters=None, sorts=None, limit=None,
+                           marker=None, fields=None):
     with context.session.begin():
         return core.query_resource(context, models.ResourceRouting,
-                                   filters or [], sorts or [])
+                                   filters or [], sorts or [], limit=limit,
+                                   marker=marker, fields=fields)
+
+
+def iter_resource_routings(context, filters=None, sorts=None,
+                           batch_size=core.DEFAULT_BATCH_SIZE, fields=None):
+    """Iterate resource routings without loading them all into memory
+
+    The routing table may contain a large number of entries, consumers that
+    only need to scan the routings once should use this function rather than
+    list_resource_routings. The transaction keeps open until the returned
+    generator is exhausted.
+    """
+    with context.session.begin():
+        for routing in core.iter_resources(
+                context, models.ResourceRouting, filters or [], sorts or [],
+                batch_size=batch_size, fields=fields):
+            yield routing
 
 
 def get_resource_routing(context, id):
@@ -125,13 +276,107 @@ def get_resource_routing(context, id):
 
 def delete_resource_routing(context, id):
     with context.session.begin():
-        return core.delete_resource(context, models.ResourceRouting, id)
+        route = core.get_resource(context, models.ResourceRouting, id)
+        core.delete_resource(context, models.ResourceRouting, id)
+        _delete_route_digests_by_resource_ids(context, [route['bottom_id']])
+    cache.routing_cache.invalidate_top_id(route['top_id'])
 
 
 def update_resource_routing(context, id, update_dict):
     with context.session.begin():
-        return core.update_resource(context, models.ResourceRouting, id,
-                                    update_dict)
+        old_route = core.get_resource(context, models.ResourceRouting, id)
+        route = core.update_resource(context, models.ResourceRouting, id,
+                                     update_dict)
+    cache.routing_cache.invalidate_top_id(old_route['top_id'])
+    cache.routing_cache.invalidate_top_id(route['top_id'])
+    return route
+
+
+def invalidate_routing_cache(top_id=None, bottom_id=None):
+    """Drop cached routing entries
+
+    :param top_id: drop entries of the given top resource
+    :param bottom_id: drop entries containing the given bottom resource
+    :return: None, the whole cache is cleared if neither id is given
+    """
+    if top_id is None and bottom_id is None:
+        cache.routing_cache.clear()
+        return
+    if top_id is not None:
+        cache.routing_cache.invalidate_top_id(top_id)
+    if bottom_id is not None:
+        cache.routing_cache.invalidate_bottom_id(bottom_id)
+
+
+def get_routing_cache_stats():
+    """Get hit, miss, eviction counters and size of the routing cache"""
+    return cache.routing_cache.get_stats()
+
+
+def _query_bottom_mappings(context, top_ids, resource_type):
+    """Query routings joined with pods for the given top ids
+
+    :param context: context object
+    :param top_ids: list of resource ids on top
+    :param resource_type: resource type
+    :return: a dict {top_id: [(pod dict, bottom_id)]}
+    """
+    mappings = collections.defaultdict(list)
+    for i in xrange(0, len(top_ids), MAX_TOP_IDS_PER_QUERY):
+        query = context.session.query(
+            models.ResourceRouting.top_id, models.ResourceRouting.bottom_id,
+            models.Pod).join(
+            models.Pod, models.ResourceRouting.pod_id == models.Pod.pod_id)
+        query = query.filter(
+            models.ResourceRouting.top_id.in_(
+                top_ids[i: i + MAX_TOP_IDS_PER_QUERY]),
+            models.ResourceRouting.resource_type == resource_type)
+        query = query.order_by(models.ResourceRouting.id)
+        for top_id, bottom_id, pod in query:
+            if not bottom_id:
+                continue
+            mappings[top_id].append((pod.to_dict(), bottom_id))
+    return mappings
+
+
+def get_bottom_mappings_by_top_ids(context, top_ids, resource_type):
+    """Get resource ids and pods on bottom for several top resources
+
+    Routings and pods are retrieved in one query, top ids not cached yet are
+    queried in chunks of MAX_TOP_IDS_PER_QUERY.
+
+    :param context: context object
+    :param top_ids: iterable of resource ids on top
+    :param resource_type: resource type
+    :return: a dict {top_id: [(pod dict, bottom_id)]}, top ids without
+    mappings are mapped to empty lists
+    """
+    ret = {}
+    use_cache = CONF.enable_routing_cache
+    missing_ids = []
+    for top_id in top_ids:
+        if top_id in ret:
+            continue
+        mappings = None
+        if use_cache:
+            mappings = cache.routing_cache.get(top_id, resource_type)
+        if mappings is None:
+            missing_ids.append(top_id)
+            mappings = []
+        ret[top_id] = mappings
+    if not missing_ids:
+        return ret
+
+    with context.session.begin():
+        queried_mappings = _query_bottom_mappings(context, missing_ids,
+                                                  resource_type)
+    for top_id, mappings in six.iteritems(queried_mappings):
+        ret[top_id] = mappings
+        if use_cache:
+            cache.routing_cache.set(top_id, resource_type, mappings)
+    # NOTE: empty result is not cached since it usually means the mapping is
+    # about to be created, probably by another process
+    return ret
 
 
 def get_bottom_mappings_by_top_id(context, top_id, resource_type):
@@ -142,20 +387,8 @@ def get_bottom_mappings_by_top_id(context, top_id, resource_type):
     :param resource_type: resource type
     :return: a list of tuple (pod dict, bottom_id)
     """
-    route_filters = [{'key': 'top_id', 'comparator': 'eq', 'value': top_id},
-                     {'key': 'resource_type',
-                      'comparator': 'eq',
-                      'value': resource_type}]
-    mappings = []
-    with context.session.begin():
-        routes = core.query_resource(
-            context, models.ResourceRouting, route_filters, [])
-        for route in routes:
-            if not route['bottom_id']:
-                continue
-            pod = core.get_resource(context, models.Pod, route['pod_id'])
-            mappings.append((pod, route['bottom_id']))
-    return mappings
+    return get_bottom_mappings_by_top_ids(
+        context, [top_id], resource_type)[top_id]
 
 
 def delete_pre_created_resource_mapping(context, name):
@@ -171,6 +404,9 @@ def delete_pre_created_resource_mapping(context, name):
                           'value': entries[0]['bottom_id']}])
             core.delete_resource(context, models.ResourceRouting,
                                  entries[0]['id'])
+    if entries:
+        cache.routing_cache.invalidate_top_id(name)
+        cache.routing_cache.invalidate_top_id(entries[0]['bottom_id'])
 
 
 def get_pod_by_top_id(context, _id):
@@ -180,16 +416,27 @@ def get_pod_by_top_id(context, _id):
     :param _id: the top id of resource
     :returns: pod resource
     """
-    route_filters = [{'key': 'top_id', 'comparator': 'eq', 'value': _id}]
-    with context.session.begin():
-        routes = core.query_resource(
-            context, models.ResourceRouting, route_filters, [])
+    use_cache = CONF.enable_routing_cache
+    if use_cache:
+        # resource type is not specified, so None is used as the cache key
+        mappings = cache.routing_cache.get(_id, None)
+        if mappings is not None:
+            return mappings[0][0]
+
+    with context.session.begin():
+        query = context.session.query(
+            models.ResourceRouting.bottom_id, models.Pod).join(
+            models.Pod, models.ResourceRouting.pod_id == models.Pod.pod_id)
+        routes = query.filter(models.ResourceRouting.top_id == _id).all()
         if not routes or len(routes) != 1:
             return None
-        route = routes[0]
-        if not route['bottom_id']:
+        bottom_id, pod = routes[0]
+        if not bottom_id:
             return None
-        return core.get_resource(context, models.Pod, route['pod_id'])
+        pod = pod.to_dict()
+    if use_cache:
+        cache.routing_cache.set(_id, None, [(pod, bottom_id)])
+    return pod
 
 
 def get_bottom_id_by_top_id_region_name(context, top_id,
@@ -209,6 +456,29 @@ def get_bottom_id_by_top_id_region_name(context, top_id,
     return None
 
 
+def get_bottom_ids_by_top_ids_region_name(context, top_ids,
+                                          region_name, resource_type):
+    """Get resource bottom ids by top ids and bottom pod name
+
+    :param context: context object
+    :param top_ids: iterable of resource ids on top
+    :param region_name: name of bottom pod
+    :param resource_type: resource type
+    :return: a dict {top_id: bottom_id}, bottom_id is None if the resource
+    is not mapped to the given pod
+    """
+    ret = {}
+    all_mappings = get_bottom_mappings_by_top_ids(context, top_ids,
+                                                  resource_type)
+    for top_id, mappings in six.iteritems(all_mappings):
+        ret[top_id] = None
+        for pod, bottom_id in mappings:
+            if pod['region_name'] == region_name:
+                ret[top_id] = bottom_id
+                break
+    return ret
+
+
 def get_bottom_mappings_by_tenant_pod(context,
                                       tenant_id,
                                       pod_id,
@@ -255,7 +525,12 @@ def delete_mappings_by_top_id(context, top_id, pod_id=None):
     if pod_id:
         filters.append({'key': 'pod_id', 'comparator': 'eq', 'value': pod_id})
     with context.session.begin():
+        routes = core.query_resource(context, models.ResourceRouting,
+                                     filters, [])
         core.delete_resources(context, models.ResourceRouting, filters=filters)
+        _delete_route_digests_by_resource_ids(
+            context, [route['bottom_id'] for route in routes])
+    cache.routing_cache.invalidate_top_id(top_id)
 
 
 def delete_mappings_by_bottom_id(context, bottom_id):
@@ -264,57 +539,28 @@ def delete_mappings_by_bottom_id(context, bottom_id):
             context, models.ResourceRouting,
             filters=[{'key': 'bottom_id', 'comparator': 'eq',
                       'value': bottom_id}])
+        _delete_route_digests_by_resource_ids(context, [bottom_id])
+    cache.routing_cache.invalidate_bottom_id(bottom_id)
 
 
 def get_next_bottom_pod(context, current_pod_id=None):
-    pods = list_pods(context, sorts=[(models.Pod.pod_id, True)])
-    # NOTE(zhiyuan) number of pods is small, just traverse to filter top pod
-    pods = [pod for pod in pods if pod['az_name']]
-    for index, pod in enumerate(pods):
-        if not current_pod_id:
-            return pod
-        if pod['pod_id'] == current_pod_id and index < len(pods) - 1:
-            return pods[index + 1]
-    return None
+    return cache.pod_registry.get_next_bottom_pod(context, current_pod_id)
 
 
 def get_top_pod(context):
-
-    filters = [{'key': 'az_name', 'comparator': 'eq', 'value': ''}]
-    pods = list_pods(context, filters=filters)
-
-    # only one should be searched
-    for pod in pods:
-        if (pod['region_name'] != '') and \
-                (pod['az_name'] == ''):
-            return pod
-
-    return None
+    return cache.pod_registry.get_top_pod(context)
 
 
 def get_pod_by_name(context, region_name):
-
-    filters = [{'key': 'region_name',
-                'comparator': 'eq', 'value': region_name}]
-    pods = list_pods(context, filters=filters)
-
-    # only one should be searched
-    for pod in pods:
-        if pod['region_name'] == region_name:
-            return pod
-
-    return None
+    return cache.pod_registry.get_pod_by_name(context, region_name)
 
 
 def find_pods_by_az_or_region(context, az_or_region):
     # if az_or_region is None or empty, returning None value directly.
     if not az_or_region:
         return None
-    query = context.session.query(models.Pod)
-    query = query.filter(or_(models.Pod.region_name == az_or_region,
-                             models.Pod.az_name == az_or_region))
-
-    return [obj.to_dict() for obj in query]
+    return cache.pod_registry.find_pods_by_az_or_region(context,
+                                                        az_or_region)
 
 
 def find_pod_by_az_or_region(context, az_or_region):
@@ -350,6 +596,38 @@ def new_job(context, project_id, _type, resource_id):
         return job
 
 
+def touch_new_job(context, _type, resource_id):
+    """Bump the timestamp of the pending new job of the resource
+
+    A bumped new job is newer than the job currently running for the
+    resource, if any, so the worker runs the job again after the current run,
+    just like a newly created job. Only new jobs newer than the latest failed
+    or running job are bumped. A new job not newer than them is left behind
+    by a run which failed or has not seen it, no worker is going to pick it
+    up before the periodic redo, so the caller needs to notify the daemon.
+
+    :return: True if a pending new job newer than the latest failed or
+    running job exists
+    """
+    with context.session.begin():
+        latest = context.session.query(
+            sql.func.max(models.AsyncJob.timestamp)).filter(
+            sql.and_(models.AsyncJob.type == _type,
+                     models.AsyncJob.resource_id == resource_id,
+                     models.AsyncJob.status.in_([constants.JS_Fail,
+                                                 constants.JS_Running]))
+        ).scalar()
+        query = context.session.query(models.AsyncJob).filter(
+            sql.and_(models.AsyncJob.type == _type,
+                     models.AsyncJob.resource_id == resource_id,
+                     models.AsyncJob.status == constants.JS_New))
+        if latest is not None:
+            query = query.filter(models.AsyncJob.timestamp > latest)
+        return bool(query.update(
+            {'timestamp': sql.func.current_timestamp()},
+            synchronize_session=False))
+
+
 def register_job(context, project_id, _type, resource_id):
     try:
         context.session.begin()
@@ -373,7 +651,13 @@ def register_job(context, project_id, _type, resource_id):
         context.session.close()
 
 
-def get_latest_failed_or_new_jobs(context):
+def get_latest_failed_or_new_jobs(context, with_timestamp=False):
+    """Get jobs whose latest status is failed or new
+
+    :param with_timestamp: whether to return the latest timestamp of the job
+    :return: (failed_jobs, new_jobs), lists of job dicts with type,
+    resource_id, project_id and optionally timestamp attributes
+    """
     current_timestamp = timeutils.utcnow()
     time_span = datetime.timedelta(seconds=CONF.redo_time_span)
     latest_timestamp = current_timestamp - time_span
@@ -392,10 +676,10 @@ def get_latest_failed_or_new_jobs(context):
     # then we join the result with the original table and group again, in each
     # group, we pick the "minimum" of the status, for status, the ascendant
     # sort sequence is "0_Fail", "1_Success", "2_Running", "3_New"
-    query = context.session.query(models.AsyncJob.type,
-                                  models.AsyncJob.resource_id,
-                                  models.AsyncJob.project_id,
-                                  sql.func.min(models.AsyncJob.status)).join(
+    query = context.session.query(
+        models.AsyncJob.type, models.AsyncJob.resource_id,
+        models.AsyncJob.project_id, sql.func.min(models.AsyncJob.status),
+        sql.func.max(models.AsyncJob.timestamp)).join(
         stmt, sql.and_(models.AsyncJob.type == stmt.c.type,
                        models.AsyncJob.resource_id == stmt.c.resource_id,
                        models.AsyncJob.timestamp == stmt.c.timestamp))
@@ -403,43 +687,133 @@ def get_latest_failed_or_new_jobs(context):
                            models.AsyncJob.type,
                            models.AsyncJob.resource_id)
 
-    for job_type, resource_id, project_id, status in query:
+    for job_type, resource_id, project_id, status, timestamp in query:
+        job = {'type': job_type, 'resource_id': resource_id,
+               'project_id': project_id}
+        if with_timestamp:
+            job['timestamp'] = timestamp
         if status == constants.JS_Fail:
-            failed_jobs.append({'type': job_type, 'resource_id': resource_id,
-                                'project_id': project_id})
+            failed_jobs.append(job)
         elif status == constants.JS_New:
-            new_jobs.append({'type': job_type, 'resource_id': resource_id,
-                             'project_id': project_id})
+            new_jobs.append(job)
     return failed_jobs, new_jobs
 
 
-def list_jobs(context, filters=None, sorts=None):
+def list_jobs(context, filters=None, sorts=None, limit=None, marker=None):
     with context.session.begin():
         # get all jobs from job table
         jobs = core.query_resource(context, models.AsyncJob,
-                                   filters or [], sorts or [])
+                                   filters or [], sorts or [], limit=limit,
+                                   marker=marker)
         return jobs
 
 
-def list_jobs_from_log(context, filters=None, sorts=None):
-    with context.session.begin():
-        # get all jobs from job log table, because the job log table only
-        # stores successful jobs, so this method merely returns successful jobs
-        if filters is not None:
-            for filter in filters:
-                if filter.get('key') == 'status':
-                    job_status = filter['value']
-                    # job entry in job log table has no status attribute.
-                    if job_status == constants.JS_Success:
-                        filters.remove(filter)
-                    else:
-                        return []
+def _get_job_log_filters(filters):
+    """Convert job filters to filters for the job log table
 
+    The job log table only stores successful jobs and has no status column,
+    so the status filter is removed from the filters.
+
+    :return: (filters, matched), matched is False if the status filter never
+    matches successful jobs
+    """
+    log_filters = []
+    for _filter in filters or []:
+        if _filter.get('key') == 'status':
+            if _filter['value'] != constants.JS_Success:
+                return [], False
+            continue
+        log_filters.append(_filter)
+    return log_filters, True
+
+
+def list_jobs_from_log(context, filters=None, sorts=None, limit=None,
+                       marker=None):
+    # get all jobs from job log table, because the job log table only
+    # stores successful jobs, so this method merely returns successful jobs
+    filters, matched = _get_job_log_filters(filters)
+    if not matched:
+        return []
+    with context.session.begin():
         jobs_in_log = core.query_resource(
-            context, models.AsyncJobLog, filters or [], sorts or [])
+            context, models.AsyncJobLog, filters, sorts or [],
+            limit=limit, marker=marker)
         return jobs_in_log
 
 
+def iter_jobs(context, filters=None, sorts=None,
+              batch_size=core.DEFAULT_BATCH_SIZE):
+    """Iterate jobs in both job table and job log table
+
+    Jobs in the job table are yielded first, then successful jobs in the job
+    log table. The transaction keeps open until the returned generator is
+    exhausted.
+    """
+    with context.session.begin():
+        for job in core.iter_resources(context, models.AsyncJob,
+                                       filters or [], sorts or [],
+                                       batch_size=batch_size):
+            yield job
+        log_filters, matched = _get_job_log_filters(filters)
+        if not matched:
+            return
+        for job in core.iter_resources(context, models.AsyncJobLog,
+                                       log_filters, sorts or [],
+                                       batch_size=batch_size):
+            yield job
+
+
+def list_jobs_with_log(context, filters=None, sorts=None, limit=None,
+                       marker=None):
+    """List jobs in the job table followed by jobs in the job log table
+
+    The two tables are paginated as one list, the marker can be the id of a
+    job in either table. A marker not found in both tables raises
+    ResourceNotFound.
+    """
+    in_log = False
+    if marker:
+        try:
+            get_job(context, marker)
+        except exceptions.ResourceNotFound:
+            in_log = True
+    jobs = []
+    if not in_log:
+        jobs = list_jobs(context, filters, sorts, limit, marker)
+        # the marker has been consumed by the job table
+        marker = None
+        if limit is not None:
+            limit -= len(jobs)
+            if limit <= 0:
+                return jobs
+    return jobs + list_jobs_from_log(context, filters, sorts, limit, marker)
+
+
+def purge_job_logs(context, before, batch_size=core.DEFAULT_BATCH_SIZE):
+    """Delete job logs older than the given timestamp
+
+    Job logs are deleted in batches, each batch in its own transaction, so
+    the job log table is not locked for a long time.
+
+    :param before: job logs with timestamp earlier than it are deleted
+    :param batch_size: max number of job logs deleted in one transaction
+    :return: number of deleted job logs
+    """
+    purged = 0
+    while True:
+        with context.session.begin():
+            log_ids = [log_id for (log_id,) in context.session.query(
+                models.AsyncJobLog.id).filter(
+                models.AsyncJobLog.timestamp < before).limit(batch_size)]
+            if log_ids:
+                context.session.query(models.AsyncJobLog).filter(
+                    models.AsyncJobLog.id.in_(log_ids)).delete(
+                    synchronize_session=False)
+        purged += len(log_ids)
+        if len(log_ids) < batch_size:
+            return purged
+
+
 def get_job(context, job_id):
     with context.session.begin():
         return core.get_resource(context, models.AsyncJob, job_id)
@@ -480,6 +854,34 @@ def get_running_job(context, _type, resource_id):
         return None
 
 
+def get_job_result(context, _type, resource_id, timestamp):
+    """Get the result of the run handling a new job
+
+    A new job is handled by a run which starts after the job is created. The
+    run saves the timestamp of the latest new job in its job log or failed
+    job, so the result is found by comparing timestamps.
+
+    :param timestamp: timestamp of the new job
+    :return: JS_Success or JS_Fail, None if the job is not handled yet
+    """
+    # sqlite has problem comparing timestamps with and without microseconds,
+    # so we slide the timestamp a bit and use ">"
+    timestamp = timestamp - datetime.timedelta(microseconds=1)
+    with context.session.begin():
+        if context.session.query(models.AsyncJobLog.id).filter(
+                sql.and_(models.AsyncJobLog.type == _type,
+                         models.AsyncJobLog.resource_id == resource_id,
+                         models.AsyncJobLog.timestamp > timestamp)).first():
+            return constants.JS_Success
+        if context.session.query(models.AsyncJob.id).filter(
+                sql.and_(models.AsyncJob.type == _type,
+                         models.AsyncJob.resource_id == resource_id,
+                         models.AsyncJob.status == constants.JS_Fail,
+                         models.AsyncJob.timestamp > timestamp)).first():
+            return constants.JS_Fail
+        return None
+
+
 def finish_job(context, job_id, successful, timestamp):
     status = constants.JS_Success if successful else constants.JS_Fail
     with context.session.begin():
@@ -510,6 +912,216 @@ def finish_job(context, job_id, successful, timestamp):
                 synchronize_session=False)
 
 
+def claim_job_lease(context, _type, resource_id, owner, host, lease_time):
+    """Claim the lease of the job identified by type and resource id
+
+    The lease is claimed if no lease exists or the existing lease has
+    expired. An expired lease is taken over by a conditional update, so only
+    one worker wins and the others return at once instead of waiting for a
+    lock.
+
+    :param owner: unique id of the claimer
+    :param host: host of the claimer
+    :param lease_time: seconds the lease stays valid without renewal
+    :return: True if the lease is claimed
+    """
+    now = timeutils.utcnow()
+    values = {'owner': owner,
+              'host': host,
+              'heartbeat_at': now,
+              'expire_at': now + datetime.timedelta(seconds=lease_time)}
+    try:
+        with context.session.begin():
+            query = context.session.query(models.AsyncJobLease).filter(
+                sql.and_(models.AsyncJobLease.type == _type,
+                         models.AsyncJobLease.resource_id == resource_id,
+                         models.AsyncJobLease.expire_at < now))
+            if query.update(values, synchronize_session=False):
+                return True
+            values.update({'type': _type, 'resource_id': resource_id})
+            core.create_resource(context, models.AsyncJobLease, values)
+            return True
+    except (db_exc.DBDuplicateEntry, db_exc.DBDeadlock):
+        # a valid lease is held by another worker
+        return False
+
+
+def renew_job_lease(context, _type, resource_id, owner, lease_time):
+    """Extend the lease held by the owner
+
+    :return: False if the lease is no longer held by the owner
+    """
+    now = timeutils.utcnow()
+    with context.session.begin():
+        return bool(context.session.query(models.AsyncJobLease).filter(
+            sql.and_(models.AsyncJobLease.type == _type,
+                     models.AsyncJobLease.resource_id == resource_id,
+                     models.AsyncJobLease.owner == owner)).update(
+            {'heartbeat_at': now,
+             'expire_at': now + datetime.timedelta(seconds=lease_time)},
+            synchronize_session=False))
+
+
+def release_job_lease(context, _type, resource_id, owner):
+    with context.session.begin():
+        context.session.query(models.AsyncJobLease).filter(
+            sql.and_(models.AsyncJobLease.type == _type,
+                     models.AsyncJobLease.resource_id == resource_id,
+                     models.AsyncJobLease.owner == owner)).delete(
+            synchronize_session=False)
+
+
+def update_job_stats(context, worker, stats):
+    """Save job statistics of the xjob worker
+
+    :param worker: unique name of the worker
+    :param stats: dict of job statistics
+    :return: None
+    """
+    values = {'stats': jsonutils.dumps(stats),
+              'updated_at': timeutils.utcnow()}
+    with context.session.begin():
+        if context.session.query(models.AsyncJobStats).filter(
+                models.AsyncJobStats.worker == worker).update(
+                values, synchronize_session=False):
+            return
+        values['worker'] = worker
+        core.create_resource(context, models.AsyncJobStats, values)
+
+
+def list_job_stats(context, updated_after=None):
+    """List job statistics saved by xjob workers
+
+    :param updated_after: only list statistics updated after this time
+    :return: list of dicts with worker, stats and updated_at
+    """
+    with context.session.begin():
+        query = context.session.query(models.AsyncJobStats)
+        if updated_after:
+            query = query.filter(
+                models.AsyncJobStats.updated_at > updated_after)
+        job_stats = []
+        for entry in query:
+            job_stats.append({'worker': entry.worker,
+                              'stats': jsonutils.loads(entry.stats),
+                              'updated_at': entry.updated_at})
+        return job_stats
+
+
+def delete_job_stats(context, updated_before):
+    with context.session.begin():
+        context.session.query(models.AsyncJobStats).filter(
+            models.AsyncJobStats.updated_at < updated_before).delete(
+            synchronize_session=False)
+
+
+def report_xjob_worker(context, worker, host):
+    """Register the xjob worker or refresh its heartbeat
+
+    :param worker: unique name of the worker
+    :param host: host the worker runs on
+    :return: None
+    """
+    values = {'host': host, 'heartbeat_at': timeutils.utcnow()}
+    with context.session.begin():
+        if context.session.query(models.XJobWorker).filter(
+                models.XJobWorker.worker == worker).update(
+                values, synchronize_session=False):
+            return
+        values['worker'] = worker
+        core.create_resource(context, models.XJobWorker, values)
+
+
+def list_xjob_workers(context, alive_after=None):
+    """List names of registered xjob workers
+
+    :param alive_after: only list workers with heartbeat after this time
+    :return: sorted list of worker names
+    """
+    with context.session.begin():
+        query = context.session.query(models.XJobWorker.worker)
+        if alive_after:
+            query = query.filter(
+                models.XJobWorker.heartbeat_at > alive_after)
+        return sorted(entry.worker for entry in query)
+
+
+def delete_xjob_worker(context, worker):
+    with context.session.begin():
+        context.session.query(models.XJobWorker).filter(
+            models.XJobWorker.worker == worker).delete(
+            synchronize_session=False)
+
+
+def get_route_digests(context, keys):
+    """Get digests of the routes last applied to bottom resources
+
+    :param keys: list of (region_name, resource_type, resource_id)
+    :return: dict whose keys are from the given keys and values are
+    (digest, updated_at), resources without digest are not included
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+    resource_ids = set([key[2] for key in keys])
+    digests = {}
+    with context.session.begin():
+        entries = context.session.query(models.RouteDigest).filter(
+            models.RouteDigest.resource_id.in_(resource_ids)).all()
+        for entry in entries:
+            key = (entry.region_name, entry.resource_type, entry.resource_id)
+            if key in keys:
+                digests[key] = (entry.digest, entry.updated_at)
+    return digests
+
+
+def _delete_route_digests(context, keys):
+    for region_name, resource_type, resource_id in keys:
+        context.session.query(models.RouteDigest).filter(
+            sql.and_(models.RouteDigest.region_name == region_name,
+                     models.RouteDigest.resource_type == resource_type,
+                     models.RouteDigest.resource_id == resource_id)).delete(
+            synchronize_session=False)
+
+
+def _delete_route_digests_by_resource_ids(context, resource_ids):
+    # called when routing entries are removed, digests of the deleted bottom
+    # routers and subnets are not needed any more
+    resource_ids = [_id for _id in resource_ids if _id]
+    if not resource_ids:
+        return
+    context.session.query(models.RouteDigest).filter(
+        models.RouteDigest.resource_id.in_(resource_ids)).delete(
+        synchronize_session=False)
+
+
+def delete_route_digests(context, keys):
+    with context.session.begin():
+        _delete_route_digests(context, keys)
+
+
+def update_route_digests(context, digests):
+    """Save digests of the routes applied to bottom resources
+
+    :param digests: dict whose keys are (region_name, resource_type,
+    resource_id) and values are digests of the applied routes
+    :return: None
+    """
+    now = timeutils.utcnow()
+    try:
+        with context.session.begin():
+            _delete_route_digests(context, digests.keys())
+            for key, digest in six.iteritems(digests):
+                region_name, resource_type, resource_id = key
+                context.session.add(models.RouteDigest(
+                    region_name=region_name, resource_type=resource_type,
+                    resource_id=resource_id, digest=digest, updated_at=now))
+    except db_exc.DBDuplicateEntry:
+        # digests are saved by another worker at the same time, remove them
+        # so routes of these resources will be applied again next time
+        delete_route_digests(context, digests.keys())
+
+
 def ensure_agent_exists(context, pod_id, host, _type, tunnel_ip):
     try:
         context.session.begin()
@@ -721,14 +1333,15 @@ def delete_core_router(context, core_router_id):
         return core.delete_resource(context, models.CoreRouter, core_router_id)
 
 
-def get_core_router(context, core_router_id):
+def get_core_router(context, core_router_id, expand=None):
     with context.session.begin():
-        return core.get_resource(context, models.CoreRouter, core_router_id)
+        return core.get_resource(context, models.CoreRouter, core_router_id,
+                                 expand=expand)
 
 
-def list_core_routers(context, filters=None, sorts=None):
+def list_core_routers(context, filters=None, sorts=None, expand=None):
     return core.query_resource(context, models.CoreRouter, filters or [],
-                               sorts or [])
+                               sorts or [], expand=expand)
 
 
 def update_core_router(context, core_router_id, update_dict):
@@ -851,14 +1464,15 @@ def delete_region(context, region_id):
         return core.delete_resource(context, models.Region, region_id)
 
 
-def get_region(context, region_id):
+def get_region(context, region_id, expand=None):
     with context.session.begin():
-        return core.get_resource(context, models.Region, region_id)
+        return core.get_resource(context, models.Region, region_id,
+                                 expand=expand)
 
 
-def list_regions(context, filters=None, sorts=None):
+def list_regions(context, filters=None, sorts=None, expand=None):
     return core.query_resource(context, models.Region, filters or [],
-                               sorts or [])
+                               sorts or [], expand=expand)
 
 
 def update_region(context, region_id, update_dict):
@@ -875,14 +1489,15 @@ def delete_dc(context, dc_id):
         return core.delete_resource(context, models.DC, dc_id)
 
 
-def get_dc(context, dc_id):
+def get_dc(context, dc_id, expand=None):
     with context.session.begin():
-        return core.get_resource(context, models.DC, dc_id)
+        return core.get_resource(context, models.DC, dc_id,
+                                 expand=expand)
 
 
-def list_dcs(context, filters=None, sorts=None):
+def list_dcs(context, filters=None, sorts=None, expand=None):
     return core.query_resource(context, models.DC, filters or [],
-                               sorts or [])
+                               sorts or [], expand=expand)
 
 
 def update_dc(context, dc_id, update_dict):
@@ -949,14 +1564,15 @@ def delete_route_entry(context, route_entry_id):
         return core.delete_resource(context, models.RouteEntry, route_entry_id)
 
 
-def get_route_entry(context, route_entry_id):
+def get_route_entry(context, route_entry_id, expand=None):
     with context.session.begin():
-        return core.get_resource(context, models.RouteEntry, route_entry_id)
+        return core.get_resource(context, models.RouteEntry, route_entry_id,
+                                 expand=expand)
 
 
-def list_route_entrys(context, filters=None, sorts=None):
+def list_route_entrys(context, filters=None, sorts=None, expand=None):
     return core.query_resource(context, models.RouteEntry, filters or [],
-                               sorts or [])
+                               sorts or [], expand=expand)
 
 def update_route_entry(context, route_entry_id, update_dict):
     with context.session.begin():
@@ -0,0 +1,456 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+import time
+
+from oslo_config import cfg
+import sqlalchemy as sql
+
+from tricircle.db import core
+from tricircle.db import models
+
+
+cache_opts = [
+    cfg.BoolOpt('enable_routing_cache',
+                default=False,
+                help='Whether to cache top to bottom resource routing lookups '
+                     'in process memory. Only routing changes made by the '
+                     'same process invalidate the cache, so changes made by '
+                     'other processes become visible after '
+                     'routing_cache_ttl seconds'),
+    cfg.IntOpt('routing_cache_ttl',
+               default=30,
+               help='Seconds a cached resource routing entry stays valid'),
+    cfg.IntOpt('routing_cache_size',
+               default=10000,
+               help='Max number of (top_id, resource_type) entries kept in '
+                    'the resource routing cache, least recently used entries '
+                    'are evicted first'),
+    cfg.IntOpt('pod_registry_refresh_interval',
+               default=60,
+               help='Seconds between two reloads of the in-memory pod '
+                    'registry, so pod changes made by other processes are '
+                    'picked up. Lookups missing in the registry always '
+                    'trigger a reload. Set to 0 to reload on every lookup'),
+    cfg.IntOpt('pod_registry_miss_ttl',
+               default=5,
+               help='Seconds a pod lookup still missing after reloading the '
+                    'pod registry is remembered as missing, lookups of it '
+                    'in this period do not reload the registry again. Pod '
+                    'changes made by the same process clear the missing '
+                    'lookups at once. Set to 0 to disable negative caching'),
+    cfg.IntOpt('endpoint_cache_ttl',
+               default=60,
+               help='Seconds between two reloads of the in-memory service '
+                    'endpoint map, so endpoint changes made by other '
+                    'processes are picked up. Set to 0 to reload on every '
+                    'lookup'),
+    cfg.IntOpt('endpoint_negative_cache_ttl',
+               default=60,
+               help='Seconds a service endpoint not found even after '
+                    'refreshing endpoints from Keystone is remembered as '
+                    'missing. Lookups of a missing endpoint fail at once '
+                    'instead of pulling the Keystone catalog again. Set to 0 '
+                    'to disable negative caching'),
+]
+cfg.CONF.register_opts(cache_opts)
+
+
+class RoutingCache(object):
+    """LRU cache with TTL for top to bottom resource routing lookups
+
+    Entries are keyed by (top_id, resource_type), the value is a list of
+    (pod dict, bottom_id) tuples. Besides the main LRU map, the cache keeps
+    top_id and bottom_id indexes so that routing changes can drop all the
+    affected entries without scanning the whole cache.
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # {(top_id, resource_type): (expire_time, mappings)}
+        self._entries = collections.OrderedDict()
+        self._top_index = collections.defaultdict(set)
+        self._bottom_index = collections.defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return cfg.CONF.routing_cache_size
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return cfg.CONF.routing_cache_ttl
+
+    @staticmethod
+    def _copy(mappings):
+        # callers are free to modify the returned pod dicts
+        return [(dict(pod), bottom_id) for pod, bottom_id in mappings]
+
+    def _remove(self, key):
+        _, mappings = self._entries.pop(key)
+        top_keys = self._top_index.get(key[0])
+        if top_keys is not None:
+            top_keys.discard(key)
+            if not top_keys:
+                del self._top_index[key[0]]
+        for _, bottom_id in mappings:
+            bottom_keys = self._bottom_index.get(bottom_id)
+            if bottom_keys is None:
+                continue
+            bottom_keys.discard(key)
+            if not bottom_keys:
+                del self._bottom_index[bottom_id]
+
+    def get(self, top_id, resource_type):
+        """Get cached mappings
+
+        :param top_id: resource id on top
+        :param resource_type: resource type
+        :return: a list of tuple (pod dict, bottom_id), or None if the entry
+        is not cached or has expired
+        """
+        key = (top_id, resource_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expire_time, mappings = entry
+            if expire_time <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            # move to the end so the least recently used entry stays first
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+            return self._copy(mappings)
+
+    def set(self, top_id, resource_type, mappings):
+        max_size = self.max_size
+        if max_size <= 0:
+            return
+        key = (top_id, resource_type)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (time.time() + self.ttl,
+                                  self._copy(mappings))
+            self._top_index[top_id].add(key)
+            for _, bottom_id in mappings:
+                self._bottom_index[bottom_id].add(key)
+
+    def invalidate_top_id(self, top_id):
+        with self._lock:
+            for key in list(self._top_index.get(top_id, ())):
+                self._remove(key)
+
+    def invalidate_bottom_id(self, bottom_id):
+        with self._lock:
+            for key in list(self._bottom_index.get(bottom_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._top_index.clear()
+            self._bottom_index.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._entries)}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+routing_cache = RoutingCache()
+
+
+# returned by lookups which succeed with no pod, like getting the next pod of
+# the last bottom pod, so they are not taken as misses
+_NO_POD = object()
+
+
+class PodRegistry(object):
+    """In-memory snapshot of the pods table
+
+    Pods are indexed by pod_id, region_name and az_name. Pod changes made by
+    the current process bump the version of the registry, which forces the
+    next lookup to reload the snapshot. Changes made by other processes are
+    picked up by reloading the snapshot every pod_registry_refresh_interval
+    seconds, and also when a lookup misses. A lookup still missing after the
+    reload is remembered for pod_registry_miss_ttl seconds, so repeated
+    lookups of unknown pods do not reload the snapshot every time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._loaded_version = None
+        self._loaded_time = 0
+        self._pods_by_id = {}
+        self._pods_by_region = {}
+        self._pods_by_az = collections.defaultdict(list)
+        # bottom pods sorted by pod_id, top pod has empty az_name
+        self._bottom_pods = []
+        self._bottom_pod_index = {}
+        self._top_pod = None
+        # {lookup key: expire_time}
+        self._misses = {}
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+            self._misses.clear()
+
+    def _is_stale(self):
+        if self._loaded_version != self._version:
+            return True
+        interval = cfg.CONF.pod_registry_refresh_interval
+        return time.time() - self._loaded_time >= interval
+
+    def _load(self, context):
+        with self._lock:
+            version = self._version
+        pods = core.query_resource(context, models.Pod, [],
+                                   [(models.Pod.pod_id, True)])
+        pods_by_id = {}
+        pods_by_region = {}
+        pods_by_az = collections.defaultdict(list)
+        bottom_pods = []
+        top_pod = None
+        for pod in pods:
+            pods_by_id[pod['pod_id']] = pod
+            pods_by_region[pod['region_name']] = pod
+            pods_by_az[pod['az_name']].append(pod)
+            if pod['az_name']:
+                bottom_pods.append(pod)
+            elif pod['az_name'] == '' and pod['region_name'] and not top_pod:
+                top_pod = pod
+        with self._lock:
+            self._pods_by_id = pods_by_id
+            self._pods_by_region = pods_by_region
+            self._pods_by_az = pods_by_az
+            self._bottom_pods = bottom_pods
+            self._bottom_pod_index = dict(
+                (pod['pod_id'], i) for i, pod in enumerate(bottom_pods))
+            self._top_pod = top_pod
+            self._loaded_version = version
+            self._loaded_time = time.time()
+
+    def _ensure_loaded(self, context, force=False):
+        if force or self._is_stale():
+            self._load(context)
+
+    def _is_missing(self, key):
+        with self._lock:
+            expire_time = self._misses.get(key)
+            if expire_time is None:
+                return False
+            if expire_time <= time.time():
+                del self._misses[key]
+                return False
+            return True
+
+    def _lookup(self, context, key, func):
+        self._ensure_loaded(context)
+        ret = func()
+        if not ret and ret is not _NO_POD and not self._is_missing(key):
+            # the pod may be created by other processes after the registry
+            # is loaded, so reload the registry and try again
+            self._ensure_loaded(context, force=True)
+            ret = func()
+            ttl = cfg.CONF.pod_registry_miss_ttl
+            if not ret and ret is not _NO_POD and ttl > 0:
+                with self._lock:
+                    self._misses[key] = time.time() + ttl
+        if ret is _NO_POD:
+            return None
+        return ret
+
+    def get_pod(self, context, pod_id):
+        pod = self._lookup(context, ('pod_id', pod_id),
+                           lambda: self._pods_by_id.get(pod_id))
+        return dict(pod) if pod else None
+
+    def get_pod_by_name(self, context, region_name):
+        pod = self._lookup(context, ('region_name', region_name),
+                           lambda: self._pods_by_region.get(region_name))
+        return dict(pod) if pod else None
+
+    def get_top_pod(self, context):
+        pod = self._lookup(context, ('top',), lambda: self._top_pod)
+        return dict(pod) if pod else None
+
+    def find_pods_by_az_or_region(self, context, az_or_region):
+        def _find():
+            pods = list(self._pods_by_az.get(az_or_region, []))
+            pod = self._pods_by_region.get(az_or_region)
+            if pod and pod not in pods:
+                pods.append(pod)
+            return pods
+
+        return [dict(pod) for pod in self._lookup(
+            context, ('az_or_region', az_or_region), _find)]
+
+    def get_next_bottom_pod(self, context, current_pod_id=None):
+        def _get_next():
+            if not current_pod_id:
+                return self._bottom_pods[0] if self._bottom_pods else None
+            index = self._bottom_pod_index.get(current_pod_id)
+            if index is None:
+                return None
+            if index < len(self._bottom_pods) - 1:
+                return self._bottom_pods[index + 1]
+            # current pod is the last one, no next pod is a hit, not a miss
+            return _NO_POD
+
+        pod = self._lookup(context, ('next_bottom', current_pod_id),
+                           _get_next)
+        return dict(pod) if pod else None
+
+    def list_pods(self, context):
+        self._ensure_loaded(context)
+        return [dict(pod) for pod in sorted(
+            self._pods_by_id.values(), key=lambda pod: pod['pod_id'])]
+
+
+pod_registry = PodRegistry()
+
+
+class EndpointRegistry(object):
+    """In-memory snapshot of the cached_endpoints table
+
+    Service urls are indexed by (pod_id, service_type). Like PodRegistry,
+    endpoint changes made by the current process bump the version of the
+    registry and the snapshot is reloaded every endpoint_cache_ttl seconds.
+    Besides, endpoints which can not be found even after refreshing from
+    Keystone are remembered as missing for endpoint_negative_cache_ttl
+    seconds, lookups of them neither reload the snapshot nor lead callers to
+    pull the Keystone catalog again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._loaded_version = None
+        self._loaded_time = 0
+        self._urls = {}
+        # {(pod_id, service_type): expire_time}
+        self._missing = {}
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+
+    def _is_stale(self):
+        if self._loaded_version != self._version:
+            return True
+        return time.time() - self._loaded_time >= cfg.CONF.endpoint_cache_ttl
+
+    def _load(self, context):
+        with self._lock:
+            version = self._version
+        endpoints = core.query_resource(
+            context, models.CachedEndpoint, [],
+            [(models.CachedEndpoint.service_id, True)])
+        urls = {}
+        for endpoint in endpoints:
+            urls.setdefault((endpoint['pod_id'], endpoint['service_type']),
+                            endpoint['service_url'])
+        with self._lock:
+            self._urls = urls
+            self._loaded_version = version
+            self._loaded_time = time.time()
+
+    def is_missing(self, pod_id, service_type):
+        key = (pod_id, service_type)
+        with self._lock:
+            expire_time = self._missing.get(key)
+            if expire_time is None:
+                return False
+            if expire_time <= time.time():
+                del self._missing[key]
+                return False
+            return True
+
+    def mark_missing(self, pod_id, service_type):
+        ttl = cfg.CONF.endpoint_negative_cache_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._missing[(pod_id, service_type)] = time.time() + ttl
+
+    def get_url(self, context, pod_id, service_type):
+        """Get the url of the service in the pod
+
+        :return: service url, or None if the endpoint is not found
+        """
+        key = (pod_id, service_type)
+        if self._is_stale():
+            self._load(context)
+        url = self._urls.get(key)
+        if url or self.is_missing(pod_id, service_type):
+            return url
+        # the endpoint may be created by other processes after the registry
+        # is loaded, so reload the registry and try again
+        self._load(context)
+        return self._urls.get(key)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._urls = {}
+            self._missing.clear()
+
+
+endpoint_registry = EndpointRegistry()
+
+
+def _reset_pod_registry(target, connection, **kw):
+    # the pods table is (re)created or dropped, cached pods are meaningless
+    pod_registry.bump_version()
+
+
+def _reset_endpoint_registry(target, connection, **kw):
+    endpoint_registry.clear()
+
+
+sql.event.listen(models.Pod.__table__, 'after_create', _reset_pod_registry)
+sql.event.listen(models.Pod.__table__, 'after_drop', _reset_pod_registry)
+sql.event.listen(models.CachedEndpoint.__table__, 'after_create',
+                 _reset_endpoint_registry)
+sql.event.listen(models.CachedEndpoint.__table__, 'after_drop',
+                 _reset_endpoint_registry)
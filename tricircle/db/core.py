@@ -14,17 +14,21 @@
 #    under the License.
 
 
+import operator
 import threading
 
 import sqlalchemy as sql
 from sqlalchemy.ext import declarative
+from sqlalchemy import orm
 from sqlalchemy.inspection import inspect
 
 
 from oslo_config import cfg
 import oslo_db.options as db_options
 import oslo_db.sqlalchemy.session as db_session
+from oslo_db.sqlalchemy import utils as db_utils
 from oslo_utils import strutils
+import six
 
 from tricircle.common import exceptions
 
@@ -35,37 +39,108 @@ db_opts = [
 ]
 cfg.CONF.register_opts(db_opts)
 
+# number of rows fetched in one round trip when iterating resources
+DEFAULT_BATCH_SIZE = 1000
+
 _LOCK = threading.Lock()
 _engine_facade = None
 ModelBase = declarative.declarative_base()
 
 
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace(
+        '%', '\\%').replace('_', '\\_')
+
+
+def _in_criterion(column, value):
+    if not value:
+        # avoid the "IN ()" warning and an inefficient query
+        return sql.false()
+    return column.in_(value)
+
+
+def _not_in_criterion(column, value):
+    if not value:
+        return sql.true()
+    return ~column.in_(value)
+
+
+_FILTER_CRITERIA = {
+    'eq': lambda column, value: column == value,
+    'ne': lambda column, value: column != value,
+    'lt': lambda column, value: column < value,
+    'lte': lambda column, value: column <= value,
+    'gt': lambda column, value: column > value,
+    'gte': lambda column, value: column >= value,
+    'in': _in_criterion,
+    'nin': _not_in_criterion,
+    'like': lambda column, value: column.like(value),
+    'prefix': lambda column, value: column.like(
+        _escape_like(value) + '%', escape='\\'),
+}
+_MULTI_VALUE_COMPARATORS = ('in', 'nin')
+
+
 def _filter_query(model, query, filters):
     """Apply filter to query
 
     :param model:
     :param query:
     :param filters: list of filter dict with key 'key', 'comparator', 'value'
-    like {'key': 'pod_id', 'comparator': 'eq', 'value': 'test_pod_uuid'}
+    like {'key': 'pod_id', 'comparator': 'eq', 'value': 'test_pod_uuid'},
+    supported comparators are 'eq', 'ne', 'lt', 'lte', 'gt', 'gte', 'in',
+    'nin', 'like' and 'prefix', value of 'in' and 'nin' filters is a list
     :return:
     """
-    filter_dict = {}
     for query_filter in filters:
-        # only eq filter supported at first
-        if query_filter['comparator'] != 'eq':
+        comparator = query_filter['comparator']
+        if comparator not in _FILTER_CRITERIA:
             continue
 
         key = query_filter['key']
         if key not in model.attributes:
             continue
+        value = query_filter['value']
         if isinstance(inspect(model).columns[key].type, sql.Boolean):
-            filter_dict[key] = strutils.bool_from_string(query_filter['value'])
-        else:
-            filter_dict[key] = query_filter['value']
-    if filter_dict:
-        return query.filter_by(**filter_dict)
-    else:
-        return query
+            if comparator in _MULTI_VALUE_COMPARATORS:
+                value = [strutils.bool_from_string(v) for v in value]
+            else:
+                value = strutils.bool_from_string(value)
+        query = query.filter(
+            _FILTER_CRITERIA[comparator](getattr(model, key), value))
+    return query
+
+
+def _paginate_query(context, model, query, sorts, limit, marker):
+    """Apply sorts and keyset pagination to query
+
+    Primary key columns are appended to the sort keys so the sort order is
+    stable, rows after the marker row are selected with a WHERE clause
+    built from the sort key values of the marker row, so the database only
+    scans the requested page instead of the whole table.
+
+    :param sorts: list of (sort_key, sort_dir) tuples, sort_key is a model
+    attribute like models.Pod.pod_id or an attribute name, sort_dir is True
+    for ascending order
+    :param limit: max number of rows returned, None means no limit
+    :param marker: primary key value of the last row in the previous page
+    :return:
+    """
+    sort_keys = []
+    sort_dirs = []
+    for sort_key, sort_dir in sorts:
+        if not isinstance(sort_key, six.string_types):
+            sort_key = sort_key.key
+        sort_keys.append(sort_key)
+        sort_dirs.append('asc' if sort_dir else 'desc')
+    for pkey in inspect(model).primary_key:
+        if pkey.key not in sort_keys:
+            sort_keys.append(pkey.key)
+            # follow the direction of the last sort key
+            sort_dirs.append(sort_dirs[-1] if sort_dirs else 'asc')
+    marker_obj = _get_resource(context, model, marker) if marker else None
+    return db_utils.paginate_query(query, model, limit, sort_keys,
+                                   marker=marker_obj, sort_dirs=sort_dirs)
 
 
 def _get_engine_facade():
@@ -80,8 +155,45 @@ def _get_engine_facade():
         return _engine_facade
 
 
-def _get_resource(context, model, pk_value):
-    res_obj = context.session.query(model).get(pk_value)
+# selectin loading is only available since SQLAlchemy 1.2
+_eager_load = getattr(orm, 'selectinload', orm.subqueryload)
+
+
+def _get_eager_relationships(model, expand):
+    """Get relationships that should be loaded together with the model
+
+    Relationships listed in the attributes of the model are part of the
+    resource dict, so they are always loaded, other relationships are loaded
+    only if they are in expand.
+    """
+    expand = expand or ()
+    return [rel.key for rel in inspect(model).relationships
+            if rel.key in model.attributes or rel.key in expand]
+
+
+def _load_relationships(model, query, expand):
+    for key in _get_eager_relationships(model, expand):
+        query = query.options(_eager_load(getattr(model, key)))
+    return query
+
+
+def _to_dict(obj, expand):
+    res_dict = obj.to_dict()
+    for key in expand or ():
+        if key in res_dict:
+            continue
+        value = getattr(obj, key)
+        if isinstance(value, DictBase):
+            value = value.to_dict()
+        elif value is not None:
+            value = [child.to_dict() for child in value]
+        res_dict[key] = value
+    return res_dict
+
+
+def _get_resource(context, model, pk_value, expand=None):
+    query = _load_relationships(model, context.session.query(model), expand)
+    res_obj = query.get(pk_value)
     if not res_obj:
         raise exceptions.ResourceNotFound(model, pk_value)
     return res_obj
@@ -113,8 +225,17 @@ def get_engine():
     return _get_engine_facade().get_engine()
 
 
-def get_resource(context, model, pk_value):
-    return _get_resource(context, model, pk_value).to_dict()
+def get_resource(context, model, pk_value, expand=None):
+    """Get resource
+
+    :param context: context object
+    :param model: model class
+    :param pk_value: primary key value
+    :param expand: names of relationships also returned in the resource dict,
+    other relationships not in the attributes of the model are not loaded
+    :return: resource dict
+    """
+    return _to_dict(_get_resource(context, model, pk_value, expand), expand)
 
 
 def get_resource_object(context, model, pk_value):
@@ -131,13 +252,85 @@ def initialize():
         connection='sqlite:///:memory:')
 
 
-def query_resource(context, model, filters, sorts):
-    query = context.session.query(model)
+def _get_resource_query(context, model, filters, sorts, limit=None,
+                        marker=None, fields=None, expand=None,
+                        eager_load=True):
+    if fields:
+        fields = [field for field in fields if field in model.attributes]
+    if not fields and not expand:
+        # resource dicts are read-only, so load column tuples directly if
+        # the model has no relationship attributes
+        fields = _get_column_attributes(model)
+    if fields:
+        query = context.session.query(
+            *[getattr(model, field) for field in fields])
+    else:
+        query = context.session.query(model)
     query = _filter_query(model, query, filters)
-    for sort_key, sort_dir in sorts:
-        sort_dir_func = sql.asc if sort_dir else sql.desc
-        query = query.order_by(sort_dir_func(sort_key))
-    return [obj.to_dict() for obj in query]
+    if not fields and eager_load:
+        query = _load_relationships(model, query, expand)
+    if limit or marker:
+        query = _paginate_query(context, model, query, sorts, limit, marker)
+    else:
+        for sort_key, sort_dir in sorts:
+            sort_dir_func = sql.asc if sort_dir else sql.desc
+            query = query.order_by(sort_dir_func(sort_key))
+    return query, fields
+
+
+def _iter_query_dicts(query, fields, expand=None):
+    if fields:
+        for row in query:
+            yield dict(zip(fields, row))
+    else:
+        for obj in query:
+            yield _to_dict(obj, expand)
+
+
+def iter_resources(context, model, filters, sorts,
+                   batch_size=DEFAULT_BATCH_SIZE, fields=None):
+    """Iterate resources without loading all the rows into memory
+
+    Rows are fetched from the database in batches of batch_size with a
+    server-side cursor where the driver supports it. The returned generator
+    must be consumed inside the transaction of context.session.
+
+    :param context: context object
+    :param model: model class
+    :param filters: list of filter dict, see _filter_query
+    :param sorts: list of (sort_key, sort_dir) tuples
+    :param batch_size: number of rows fetched in one round trip
+    :param fields: list of attribute names, if specified, only these columns
+    are loaded and returned
+    :return: generator of resource dicts
+    """
+    # eager loading of collections doesn't work with yield_per, relationships
+    # are loaded when accessed instead
+    query, fields = _get_resource_query(context, model, filters, sorts,
+                                        fields=fields, eager_load=False)
+    return _iter_query_dicts(query.yield_per(batch_size), fields)
+
+
+def query_resource(context, model, filters, sorts, limit=None, marker=None,
+                   fields=None, expand=None):
+    """Query resources
+
+    :param context: context object
+    :param model: model class
+    :param filters: list of filter dict, see _filter_query
+    :param sorts: list of (sort_key, sort_dir) tuples
+    :param limit: max number of resources returned
+    :param marker: primary key value of the last resource in the previous
+    page, only resources after the marker are returned
+    :param fields: list of attribute names, if specified, only these columns
+    are loaded and returned
+    :param expand: names of relationships also returned in the resource
+    dicts, ignored if fields is specified
+    :return: list of resource dicts
+    """
+    query, fields = _get_resource_query(context, model, filters, sorts,
+                                        limit, marker, fields, expand)
+    return list(_iter_query_dicts(query, fields, expand))
 
 
 def update_resource(context, model, pk_value, update_dict):
@@ -162,6 +355,59 @@ def update_resources(context, model, filters, update_dict):
     query.update(update_dict, synchronize_session=False)
 
 
+# {model class: (attribute names, state getter, attribute getter)}
+_ATTRIBUTE_GETTERS = {}
+# {model class: column attribute names, or None if some of the attributes
+# are not columns}
+_COLUMN_ATTRIBUTES = {}
+
+
+def _get_attribute_getters(cls):
+    try:
+        return _ATTRIBUTE_GETTERS[cls]
+    except KeyError:
+        attributes = tuple(cls.attributes)
+        if len(attributes) == 1:
+            # getters with one item don't return a tuple
+            item_getter = operator.itemgetter(attributes[0])
+            attr_getter = operator.attrgetter(attributes[0])
+
+            def state_getter(state):
+                return (item_getter(state),)
+
+            def getter(obj):
+                return (attr_getter(obj),)
+        elif attributes:
+            state_getter = operator.itemgetter(*attributes)
+            getter = operator.attrgetter(*attributes)
+        else:
+            def state_getter(state):
+                return ()
+
+            getter = state_getter
+        _ATTRIBUTE_GETTERS[cls] = (attributes, state_getter, getter)
+        return _ATTRIBUTE_GETTERS[cls]
+
+
+def _get_column_attributes(model):
+    """Get attribute names if all the attributes of the model are columns
+
+    Rows of such models can be read as plain tuples instead of ORM objects,
+    which skips the identity map and attribute instrumentation.
+    """
+    try:
+        return _COLUMN_ATTRIBUTES[model]
+    except KeyError:
+        column_keys = set(attr.key for attr in inspect(model).column_attrs)
+        if model.attributes and all(
+                attr in column_keys for attr in model.attributes):
+            attributes = list(model.attributes)
+        else:
+            attributes = None
+        _COLUMN_ATTRIBUTES[model] = attributes
+        return attributes
+
+
 class DictBase(object):
     attributes = []
 
@@ -170,10 +416,16 @@ class DictBase(object):
         return cls(**d)
 
     def to_dict(self):
-        d = {}
-        for attr in self.__class__.attributes:
-            d[attr] = getattr(self, attr)
-        return d
+        attributes, state_getter, getter = _get_attribute_getters(
+            self.__class__)
+        try:
+            # loaded attributes are kept in the instance dict, reading them
+            # from there skips the instrumented attribute descriptors
+            values = state_getter(self.__dict__)
+        except KeyError:
+            # some attributes are not loaded or expired
+            values = getter(self)
+        return dict(zip(attributes, values))
 
     def __getitem__(self, key):
         return getattr(self, key)
@@ -0,0 +1,37 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import MetaData, Table
+from sqlalchemy import Index
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    resource_routings = Table('resource_routings', meta, autoload=True)
+    async_jobs = Table('async_jobs', meta, autoload=True)
+
+    # bottom mappings lookup by top id and resource type, pod_id and
+    # bottom_id are included so the lookup is answered by the index alone
+    Index('resource_routings0top_id0resource_type0pod_id0bottom_id',
+          resource_routings.c.top_id, resource_routings.c.resource_type,
+          resource_routings.c.pod_id, resource_routings.c.bottom_id).create()
+    # routings lookup by pod, project and resource type
+    Index('resource_routings0pod_id0project_id0resource_type',
+          resource_routings.c.pod_id, resource_routings.c.project_id,
+          resource_routings.c.resource_type).create()
+    # latest job lookup grouped by job type and resource id
+    Index('async_jobs0type0resource_id0timestamp',
+          async_jobs.c.type, async_jobs.c.resource_id,
+          async_jobs.c.timestamp).create()
@@ -0,0 +1,38 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sqlalchemy as sql
+
+
+def upgrade(migrate_engine):
+    meta = sql.MetaData()
+    meta.bind = migrate_engine
+
+    async_job_leases = sql.Table(
+        'async_job_leases', meta,
+        sql.Column('type', sql.String(length=36), primary_key=True),
+        sql.Column('resource_id', sql.String(length=127), primary_key=True),
+        sql.Column('owner', sql.String(length=36), nullable=False),
+        sql.Column('host', sql.String(length=255), nullable=False),
+        sql.Column('heartbeat_at', sql.DateTime, nullable=False),
+        sql.Column('expire_at', sql.DateTime, nullable=False, index=True),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8')
+
+    async_job_leases.create()
+
+
+def downgrade(migrate_engine):
+    raise NotImplementedError('downgrade not support')
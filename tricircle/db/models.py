@@ -64,6 +64,10 @@ class ResourceRouting(core.ModelBase, core.DictBase, models.TimestampMixin):
         schema.UniqueConstraint(
             'top_id', 'pod_id', 'resource_type',
             name='resource_routings0top_id0pod_id0resource_type'),
+        sql.Index('resource_routings0top_id0resource_type0pod_id0bottom_id',
+                  'top_id', 'resource_type', 'pod_id', 'bottom_id'),
+        sql.Index('resource_routings0pod_id0project_id0resource_type',
+                  'pod_id', 'project_id', 'resource_type'),
     )
     attributes = ['id', 'top_id', 'bottom_id', 'pod_id', 'project_id',
                   'resource_type', 'created_at', 'updated_at']
@@ -88,6 +92,8 @@ class AsyncJob(core.ModelBase, core.DictBase):
         schema.UniqueConstraint(
             'type', 'status', 'resource_id', 'extra_id',
             name='async_jobs0type0status0resource_id0extra_id'),
+        sql.Index('async_jobs0type0resource_id0timestamp',
+                  'type', 'resource_id', 'timestamp'),
     )
 
     attributes = ['id', 'project_id', 'type', 'timestamp', 'status',
@@ -118,6 +124,60 @@ class AsyncJobLog(core.ModelBase, core.DictBase):
                            index=True)
 
 
+class AsyncJobLease(core.ModelBase, core.DictBase):
+    __tablename__ = 'async_job_leases'
+
+    attributes = ['type', 'resource_id', 'owner', 'host', 'heartbeat_at',
+                  'expire_at']
+
+    type = sql.Column('type', sql.String(length=36), primary_key=True)
+    resource_id = sql.Column('resource_id', sql.String(length=127),
+                             primary_key=True)
+    owner = sql.Column('owner', sql.String(length=36), nullable=False)
+    host = sql.Column('host', sql.String(length=255), nullable=False)
+    heartbeat_at = sql.Column('heartbeat_at', sql.DateTime, nullable=False)
+    expire_at = sql.Column('expire_at', sql.DateTime, nullable=False,
+                           index=True)
+
+
+class AsyncJobStats(core.ModelBase, core.DictBase):
+    __tablename__ = 'async_job_stats'
+
+    attributes = ['worker', 'stats', 'updated_at']
+
+    worker = sql.Column('worker', sql.String(length=255), primary_key=True)
+    stats = sql.Column('stats', MediumText(), nullable=False)
+    updated_at = sql.Column('updated_at', sql.DateTime, nullable=False,
+                            index=True)
+
+
+class XJobWorker(core.ModelBase, core.DictBase):
+    __tablename__ = 'xjob_workers'
+
+    attributes = ['worker', 'host', 'heartbeat_at']
+
+    worker = sql.Column('worker', sql.String(length=255), primary_key=True)
+    host = sql.Column('host', sql.String(length=255), nullable=False)
+    heartbeat_at = sql.Column('heartbeat_at', sql.DateTime, nullable=False,
+                              index=True)
+
+
+class RouteDigest(core.ModelBase, core.DictBase):
+    __tablename__ = 'route_digests'
+
+    attributes = ['region_name', 'resource_type', 'resource_id', 'digest',
+                  'updated_at']
+
+    region_name = sql.Column('region_name', sql.String(length=255),
+                             primary_key=True)
+    resource_type = sql.Column('resource_type', sql.String(length=64),
+                               primary_key=True)
+    resource_id = sql.Column('resource_id', sql.String(length=127),
+                             primary_key=True)
+    digest = sql.Column('digest', sql.String(length=40), nullable=False)
+    updated_at = sql.Column('updated_at', sql.DateTime, nullable=False)
+
+
 class ShadowAgent(core.ModelBase, core.DictBase):
     __tablename__ = 'shadow_agents'
     __table_args__ = (
@@ -261,15 +321,15 @@ class CoreRouter(core.ModelBase, core.DictBase):
     routes = orm.relationship(CoreRouterRoute,
                               backref='core_router',
                               cascade='all, delete, delete-orphan',
-                              lazy='subquery')
+                              lazy='select')
     interfaces = orm.relationship(CoreRouterInterface,
                               backref='core_router',
                               cascade='all, delete, delete-orphan',
-                              lazy='subquery')
+                              lazy='select')
     firewall_bypasss= orm.relationship(FirewallBypass,
                               backref='core_router',
                               cascade='all, delete, delete-orphan',
-                              lazy='subquery')
+                              lazy='select')
 
 class TricircleResource(core.ModelBase, core.DictBase, models.TimestampMixin):
     __tablename__ = 'tricircle_resources'
@@ -309,7 +369,7 @@ class DC(core.ModelBase, core.DictBase):
     fabrics = orm.relationship(Fabric,
                               backref='dc',
                               cascade='all, delete, delete-orphan',
-                              lazy='subquery')
+                              lazy='select')
  
 class Region(core.ModelBase, core.DictBase):
     __tablename__ = 'regions'
@@ -320,7 +380,7 @@ class Region(core.ModelBase, core.DictBase):
                              unique=True, nullable=False)
     dcs= orm.relationship(DC,backref='region',
                               cascade='all, delete, delete-orphan',
-                              lazy='subquery')
+                              lazy='select')
 
 class DestinationCidr(core.ModelBase, core.DictBase):
     __tablename__ = 'destination_cidrs'
@@ -344,5 +404,5 @@ class RouteEntry(core.ModelBase, core.DictBase):
     description = sql.Column('description', sql.String(length=255), nullable=True)
     destination_cidr_list= orm.relationship(DestinationCidr,backref='route_entry',
                               cascade='all, delete, delete-orphan',
-                              lazy='subquery')
+                              lazy='select')
 
@@ -225,7 +225,8 @@ class TricircleTrunkPlugin(plugin.TrunkPlugin):
         route_filters = [{'key': 'resource_type',
                           'comparator': 'eq',
                           'value': t_constants.RT_TRUNK}]
-        routes = db_api.list_resource_routings(t_ctx, route_filters)
+        routes = db_api.iter_resource_routings(
+            t_ctx, route_filters, fields=['top_id', 'bottom_id'])
         for route in routes:
             bottom_top_map[route['bottom_id']] = route['top_id']
             top_bottom_map[route['top_id']] = route['bottom_id']
@@ -237,8 +238,7 @@ class TricircleTrunkPlugin(plugin.TrunkPlugin):
                 # if mapping exists, we retrieve trunk information
                 # from bottom, otherwise from top
                 if mappings:
-                    pod_id = mappings[0][0]['pod_id']
-                    current_pod = db_api.get_pod(t_ctx, pod_id)
+                    current_pod = mappings[0][0]
                     ret = self._get_trunks_from_pod_with_limit(
                         context, current_pod, bottom_top_map, top_bottom_map,
                         filters, limit, marker)
@@ -1017,10 +1017,10 @@ class NetworkHelper(object):
         :param entries: a list of (top_id, bottom_id, resource_type) tuples.
         :return: None
         """
-        for top_id, btm_id, resource_type in entries:
-            if db_api.get_bottom_id_by_top_id_region_name(
-                    t_ctx, top_id, pod['region_name'], resource_type):
-                continue
-            db_api.create_resource_mapping(t_ctx, top_id, btm_id,
-                                           pod['pod_id'], project_id,
-                                           resource_type)
+        db_api.create_resource_mappings(
+            t_ctx, [{'top_id': top_id,
+                     'bottom_id': btm_id,
+                     'pod_id': pod['pod_id'],
+                     'project_id': project_id,
+                     'resource_type': resource_type}
+                    for top_id, btm_id, resource_type in entries])
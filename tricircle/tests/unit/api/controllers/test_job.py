@@ -11,6 +11,7 @@
 # under the License.
 
 import copy
+import datetime
 import mock
 from mock import patch
 from oslo_utils import timeutils
@@ -23,11 +24,13 @@ import pecan
 from tricircle.api.controllers import job
 from tricircle.common import constants
 from tricircle.common import context
+from tricircle.common import metrics
 from tricircle.common import policy
 from tricircle.common import xrpcapi
 from tricircle.db import api as db_api
 from tricircle.db import core
 from tricircle.db import models
+from tricircle.xjob import telemetry
 
 
 class FakeRPCAPI(xrpcapi.XJobAPI):
@@ -257,6 +260,92 @@ class AsyncJobControllerTest(unittest.TestCase):
         self.assertEqual(amount_of_all_jobs - amount_of_succ_jobs,
                          len(jobs_4['jobs']))
 
+    @patch.object(pecan, 'response', new=FakeResponse)
+    @patch.object(context, 'extract_context_from_environ')
+    def test_get_one_wait(self, mock_context):
+        mock_context.return_value = self.context
+        job_type = constants.JT_CONFIGURE_ROUTE
+        new_job = db_api.new_job(self.context, 'project_id', job_type,
+                                 'router_id')
+
+        res = self.controller.get_one(new_job['id'], wait='x')
+        self._validate_error_code(res, 400)
+        res = self.controller.get_one(new_job['id'], wait='-1')
+        self._validate_error_code(res, 400)
+
+        with patch.object(self.controller.xjob_handler,
+                          'wait_job') as mock_wait:
+            # the job is not handled in time
+            mock_wait.return_value = None
+            res = self.controller.get_one(new_job['id'], wait='5')
+            self.assertEqual('NEW', res['job']['status'])
+            self.assertEqual(5, mock_wait.call_args[0][2])
+
+            mock_wait.return_value = constants.JS_Success
+            res = self.controller.get_one(new_job['id'], wait='5')
+            self.assertEqual('SUCCESS', res['job']['status'])
+            self.assertEqual({'router_id': 'router_id'},
+                             res['job']['resource'])
+
+            mock_wait.side_effect = Exception()
+            res = self.controller.get_one(new_job['id'], wait='5')
+            self._validate_error_code(res, 500)
+
+            # no wait by default
+            res = self.controller.get_one(new_job['id'])
+            self.assertEqual('NEW', res['job']['status'])
+            self.assertEqual(3, mock_wait.call_count)
+
+    @patch.object(pecan, 'response', new=FakeResponse)
+    @patch.object(context, 'extract_context_from_environ')
+    def test_get_job_stats(self, mock_context):
+        mock_context.return_value = self.context
+        telemetry.reset()
+        self.addCleanup(telemetry.reset)
+        telemetry.observe(constants.JT_CONFIGURE_ROUTE, metrics.EXECUTION,
+                          0.2)
+        telemetry.increment(constants.JT_CONFIGURE_ROUTE, metrics.SUCCESS)
+        db_api.update_job_stats(self.context, 'worker1',
+                                telemetry.get_stats())
+        telemetry.observe(constants.JT_CONFIGURE_ROUTE, metrics.EXECUTION,
+                          0.4)
+        telemetry.observe_pod_call('pod_1', 0.1,
+                                   job_type=constants.JT_CONFIGURE_ROUTE)
+        db_api.update_job_stats(self.context, 'worker2',
+                                telemetry.get_stats())
+
+        # failure case, only admin can show job statistics
+        self.context.is_admin = False
+        res = self.controller.get_one('stats')
+        self._validate_error_code(res, 403)
+        self.context.is_admin = True
+
+        res = self.controller.get_one('stats')
+        self.assertEqual(['worker1', 'worker2'], res['workers'])
+        route_stats = res['stats'][constants.JT_CONFIGURE_ROUTE]
+        self.assertEqual(2, route_stats['success'])
+        self.assertEqual(0, route_stats['fail'])
+        execution = route_stats['execution']
+        self.assertEqual(3, execution['count'])
+        self.assertAlmostEqual(0.8, execution['sum'])
+        self.assertAlmostEqual(0.8 / 3, execution['avg'])
+        self.assertEqual(0, execution['buckets']['0.1'])
+        self.assertEqual(3, execution['buckets']['0.5'])
+        self.assertEqual(3, execution['buckets']['+Inf'])
+        self.assertEqual(0, route_stats['queue_wait']['avg'])
+        self.assertEqual(1, route_stats['pod_calls']['pod_1']['count'])
+        self.assertEqual({'depth': 0, 'new_jobs': 0, 'failed_jobs': 0,
+                          'max_wait_time': 0, 'avg_wait_time': 0},
+                         res['queue'])
+
+        # the job queue is read from the job table
+        db_api.new_job(self.context, 'project_id',
+                       constants.JT_CONFIGURE_ROUTE, 'router_id')
+        res = self.controller.get_one('stats')
+        self.assertEqual(1, res['queue']['depth'])
+        self.assertEqual(1, res['queue']['new_jobs'])
+        self.assertEqual(0, res['queue']['failed_jobs'])
+
     @patch.object(pecan, 'response', new=FakeResponse)
     @patch.object(context, 'extract_context_from_environ')
     def test_get_all_jobs(self, mock_context):
@@ -377,6 +466,53 @@ class AsyncJobControllerTest(unittest.TestCase):
         self.assertEqual(amount_of_running_jobs,
                          len(jobs_job_status_filter_3['jobs']))
 
+    @patch.object(pecan, 'response', new=FakeResponse)
+    @patch.object(context, 'extract_context_from_environ')
+    def test_get_all_jobs_with_pagination(self, mock_context):
+        mock_context.return_value = self.context
+
+        now = timeutils.utcnow().replace(microsecond=0)
+        job_types = sorted(self.job_resource_map.keys())[:5]
+        for i, job_type in enumerate(job_types):
+            job = self._prepare_job_element(job_type)
+            resource_id = '#'.join([job['resource'][resource_id]
+                                    for resource_type, resource_id
+                                    in self.job_resource_map[job_type]])
+            new_job = db_api.new_job(self.context, job['project_id'],
+                                     job_type, resource_id)
+            db_api.finish_job(self.context, new_job['id'], True,
+                              now + datetime.timedelta(minutes=i))
+
+        # newest jobs first, page by page
+        pages = []
+        marker = None
+        while True:
+            kwargs = {'limit': '2'}
+            if marker:
+                kwargs['marker'] = marker
+            jobs = self.controller.get_all(**kwargs)['jobs']
+            if not jobs:
+                break
+            pages.append([job['type'] for job in jobs])
+            marker = jobs[-1]['id']
+        self.assertEqual([job_types[4:2:-1], job_types[2:0:-1],
+                          job_types[0:1]], pages)
+
+        # filter by time range
+        start_time = (now + datetime.timedelta(minutes=1)).isoformat()
+        end_time = (now + datetime.timedelta(minutes=3)).isoformat()
+        jobs = self.controller.get_all(start_time=start_time,
+                                       end_time=end_time)['jobs']
+        self.assertEqual(set(job_types[1:4]),
+                         set([job['type'] for job in jobs]))
+
+        # failure case, invalid limit, marker or time
+        for kwargs in ({'limit': '0'}, {'limit': 'a'},
+                       {'limit': '2', 'marker': 'fake_marker'},
+                       {'start_time': 'fake_time'}):
+            res = self.controller.get_all(**kwargs)
+            self._validate_error_code(res, 400)
+
     @patch.object(pecan, 'response', new=FakeResponse)
     @patch.object(pecan, 'response', new=mock.Mock)
     @patch.object(context, 'extract_context_from_environ')
@@ -263,6 +263,28 @@ class RoutingControllerTest(unittest.TestCase):
         res = self.controller.get_all(**kw_filter4)
         self._validate_error_code(res, 400)
 
+        # paginate the routings, routings are sorted by id
+        routings = self.controller.get_all(limit='1')['routings']
+        self.assertEqual(1, len(routings))
+        self.assertEqual('c7f641c9-8462-4007-84b2-3035d8cfb7a3',
+                         routings[0]['top_id'])
+        routings = self.controller.get_all(
+            limit='1', marker=routings[0]['id'])['routings']
+        self.assertEqual(1, len(routings))
+        self.assertEqual('b669a2da-ca95-47db-a2a9-ba9e546d82ee',
+                         routings[0]['top_id'])
+        routings = self.controller.get_all(
+            limit='1', marker=routings[0]['id'], resource_type='port')
+        self.assertEqual([], routings['routings'])
+
+        # failure case, invalid limit or marker
+        res = self.controller.get_all(limit='abc')
+        self._validate_error_code(res, 400)
+        res = self.controller.get_all(limit='-1')
+        self._validate_error_code(res, 400)
+        res = self.controller.get_all(limit='1', marker='-1')
+        self._validate_error_code(res, 400)
+
         # failure case, only admin can show all resource routings
         self.context.is_admin = False
         res = self.controller.get_all()
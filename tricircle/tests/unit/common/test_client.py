@@ -14,21 +14,29 @@
 #    under the License.
 
 
+import datetime
+import functools
+import six
+import time
 import unittest
-import uuid
 
 import mock
 from mock import patch
 from oslo_config import cfg
+from oslo_utils import timeutils
 
 import keystoneclient.v3.client as k_client
+import neutronclient.common.exceptions as q_exceptions
 
 from tricircle.common import client
+from tricircle.common import constants
 from tricircle.common import context
 from tricircle.common import exceptions
 from tricircle.common import resource_handle
 from tricircle.db import api
+from tricircle.db import cache
 from tricircle.db import core
+import tricircle.tests.unit.utils as test_utils
 
 
 FAKE_AZ = 'fake_az'
@@ -247,6 +255,11 @@ class ClientTest(unittest.TestCase):
     def test_list_endpoint_not_found_retry(self):
         cfg.CONF.set_override(name='auto_refresh_endpoint', override=True,
                               group='client')
+        # endpoints not found are remembered as missing by default, disable
+        # negative caching so the second lookup pulls the catalog again
+        cfg.CONF.set_override('endpoint_negative_cache_ttl', 0)
+        self.addCleanup(cfg.CONF.clear_override,
+                        'endpoint_negative_cache_ttl')
         # delete the configuration so endpoint cannot be found
         api.delete_cached_endpoints(self.context, FAKE_SERVICE_ID)
 
@@ -327,30 +340,60 @@ class ClientTest(unittest.TestCase):
         self.assertEqual(endpoint_map,
                          {FAKE_SITE_NAME: {FAKE_SERVICE_NAME: FAKE_URL}})
 
-    @patch.object(uuid, 'uuid4')
-    @patch.object(api, 'create_cached_endpoints')
-    @patch.object(api, 'update_cached_endpoints')
-    def test_update_endpoint_from_keystone(self, update_mock, create_mock,
-                                           uuid_mock):
+    def test_update_endpoint_from_keystone(self):
         self.client._get_admin_token = mock.Mock()
         self.client._get_endpoint_from_keystone = mock.Mock()
         self.client._get_endpoint_from_keystone.return_value = {
-            FAKE_SITE_NAME: {FAKE_TYPE: FAKE_URL,
+            FAKE_SITE_NAME: {FAKE_TYPE: FAKE_URL_INVALID,
                              'another_fake_type': 'http://127.0.0.1:34567'},
             'not_registered_pod': {FAKE_TYPE: FAKE_URL}
         }
-        uuid_mock.return_value = 'another_fake_service_id'
 
         self.client.update_endpoint_from_keystone(self.context)
-        update_dict = {'service_url': FAKE_URL}
-        create_dict = {'service_id': 'another_fake_service_id',
-                       'pod_id': FAKE_SITE_ID,
-                       'service_type': 'another_fake_type',
-                       'service_url': 'http://127.0.0.1:34567'}
+        endpoints = api.list_cached_endpoints(self.context)
         # not registered pod is skipped
-        update_mock.assert_called_once_with(
-            self.context, FAKE_SERVICE_ID, update_dict)
-        create_mock.assert_called_once_with(self.context, create_dict)
+        self.assertEqual(2, len(endpoints))
+        url_map = dict((e['service_type'], e['service_url'])
+                       for e in endpoints)
+        self.assertEqual({FAKE_TYPE: FAKE_URL_INVALID,
+                          'another_fake_type': 'http://127.0.0.1:34567'},
+                         url_map)
+        # existing endpoint is updated in place
+        self.assertEqual(FAKE_URL_INVALID, api.get_cached_endpoints(
+            self.context, FAKE_SERVICE_ID)['service_url'])
+        # the in-memory endpoint map is refreshed
+        self.assertEqual(FAKE_URL_INVALID, self.client.get_endpoint(
+            self.context, FAKE_SITE_ID, FAKE_TYPE))
+
+    def test_get_endpoint_negative_cache(self):
+        cfg.CONF.set_override(name='auto_refresh_endpoint', override=True,
+                              group='client')
+        self.client._get_admin_token = mock.Mock()
+        self.client._get_admin_project_id = mock.Mock()
+        self.client._get_endpoint_from_keystone = mock.Mock()
+        self.client._get_endpoint_from_keystone.return_value = {
+            FAKE_SITE_NAME: {FAKE_TYPE: FAKE_URL}}
+
+        for _ in range(3):
+            self.assertRaises(exceptions.EndpointNotFound,
+                              self.client.get_endpoint, self.context,
+                              FAKE_SITE_ID, 'unknown_type')
+        # the catalog is pulled only once for the missing endpoint
+        self.assertEqual(
+            1, self.client._get_endpoint_from_keystone.call_count)
+        # known endpoints are still served from memory
+        self.assertEqual(FAKE_URL, self.client.get_endpoint(
+            self.context, FAKE_SITE_ID, FAKE_TYPE))
+
+        # once the missing mark expires, the catalog is pulled again
+        self.client._get_endpoint_from_keystone.return_value = {
+            FAKE_SITE_NAME: {'unknown_type': FAKE_URL}}
+        expire_time = time.time() + cfg.CONF.endpoint_negative_cache_ttl
+        with patch.object(cache.time, 'time', return_value=expire_time):
+            self.assertEqual(FAKE_URL, self.client.get_endpoint(
+                self.context, FAKE_SITE_ID, 'unknown_type'))
+        self.assertEqual(
+            2, self.client._get_endpoint_from_keystone.call_count)
 
     def test_get_endpoint(self):
         cfg.CONF.set_override(name='auto_refresh_endpoint', override=False,
@@ -358,6 +401,151 @@ class ClientTest(unittest.TestCase):
         url = self.client.get_endpoint(self.context, FAKE_SITE_ID, FAKE_TYPE)
         self.assertEqual(url, FAKE_URL)
 
+    @patch.object(FakeClient, 'list_fake_res')
+    def test_get_resources_bulk(self, mock_list):
+        def _list(search_opts):
+            return [{'id': _id, 'name': 'res_%s' % _id}
+                    for _id in search_opts['id'] if _id != 'id4']
+
+        mock_list.side_effect = _list
+        cfg.CONF.set_override('max_bulk_get_size', 2, group='client')
+        self.addCleanup(cfg.CONF.clear_override, 'max_bulk_get_size',
+                        group='client')
+        ids = ['id1', 'id2', 'id1', 'id3', 'id4', 'id5']
+        resources = self.client.get_resources_bulk(
+            FAKE_RESOURCE, self.context, ids, fields=['name'])
+        # duplicated ids are queried once, missing resources are absent
+        self.assertEqual(set(['id1', 'id2', 'id3', 'id5']), set(resources))
+        self.assertEqual('res_id3', resources['id3']['name'])
+        self.assertEqual(3, mock_list.call_count)
+        search_opts_list = [call[0][0] for call in mock_list.call_args_list]
+        self.assertEqual([['id1', 'id2'], ['id3', 'id4'], ['id5']],
+                         [opts['id'] for opts in search_opts_list])
+        for opts in search_opts_list:
+            self.assertEqual(set(['id', 'name']), set(opts['fields']))
+
+        mock_list.reset_mock()
+        self.assertEqual({}, self.client.get_resources_bulk(
+            FAKE_RESOURCE, self.context, []))
+        self.assertFalse(mock_list.called)
+
+    def test_dispatch_tables_shared(self):
+        with patch.object(client.inspect, 'getmembers') as mock_getmembers:
+            client1 = client.Client('region1')
+            client2 = client.Client('region2')
+        # tables are built at import, not on each construction
+        self.assertFalse(mock_getmembers.called)
+        self.assertEqual(client1.resource_service_map,
+                         client2.resource_service_map)
+        self.assertIn('port', client1.operation_resources_map['create'])
+        # instance tables are copies, modifying one client does not affect
+        # the others
+        self.assertNotIn(FAKE_RESOURCE, client1.resource_service_map)
+        self.assertNotIn(FAKE_RESOURCE,
+                         client1.operation_resources_map['list'])
+
+        # handles are created on first use, one per client
+        self.assertEqual({}, dict(client1.service_handle_map))
+        handle = client1.service_handle_map[constants.ST_NEUTRON]
+        self.assertIsInstance(handle, resource_handle.NeutronResourceHandle)
+        self.assertIs(handle, client1.service_handle_map[constants.ST_NEUTRON])
+        self.assertIsNot(handle,
+                         client2.service_handle_map[constants.ST_NEUTRON])
+
+        # shortcuts are resolved on first access
+        with patch.object(client.Client, 'create_resources') as mock_create:
+            client1.create_ports(self.context, {'port': {}})
+            mock_create.assert_called_once_with('port', self.context,
+                                                {'port': {}})
+        self.assertIs(client1.create_ports, client1.create_ports)
+        self.assertRaises(AttributeError, getattr, client1, 'create_fakes')
+        # get is not supported for security group rules
+        self.assertFalse(hasattr(client1, 'get_security_group_rules'))
+
+    def test_client_construction_cost(self):
+        with patch.object(client.inspect, 'getmembers') as mock_getmembers, \
+                patch.object(resource_handle.ResourceHandle, '__init__',
+                             return_value=None) as mock_handle_init:
+            clients = [client.Client('region%d' % i) for i in range(100)]
+            # constructing clients neither scans resource_handle nor
+            # creates handles
+            self.assertFalse(mock_getmembers.called)
+            self.assertFalse(mock_handle_init.called)
+            for cli in clients:
+                self.assertNotIn('create_ports', cli.__dict__)
+            # the handle is created on first use
+            self.assertIsInstance(
+                clients[0].service_handle_map[constants.ST_NEUTRON],
+                resource_handle.NeutronResourceHandle)
+            self.assertEqual(1, mock_handle_init.call_count)
+
+    @test_utils.benchmark
+    def test_client_construction_benchmark(self):
+        def _construct_eagerly():
+            # what constructing a client used to cost
+            (handle_class_map, _, _,
+             shortcut_map) = client._build_dispatch_tables()
+            cli = client.Client()
+            for service, handle_class in six.iteritems(handle_class_map):
+                cli.service_handle_map[service] = handle_class(cli.auth_url)
+            for name, (operation, resource) in six.iteritems(shortcut_map):
+                setattr(cli, name, functools.partial(
+                    getattr(cli, '%s_resources' % operation), resource))
+
+        def _measure(func, times=1000, repeat=3):
+            # take the best of several runs to reduce noise
+            best = None
+            for _ in range(repeat):
+                start = time.time()
+                for _ in range(times):
+                    func()
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return best / times
+
+        eager_time = _measure(_construct_eagerly)
+        lazy_time = _measure(client.Client)
+        print('Client construction: eager %.1fus, lazy %.1fus' % (
+            eager_time * 1e6, lazy_time * 1e6))
+
+    @patch.object(FakeClient, 'list_fake_res')
+    def test_list_admin_token_rejected(self, mock_list):
+        manager = resource_handle.AdminTokenManager()
+        fetched = []
+
+        def _fetch(project_id):
+            fetched.append(project_id)
+            return {'token': 'token%d' % len(fetched),
+                    'project_id': project_id or 'admin_project_id',
+                    'expires_at': timeutils.utcnow() + datetime.timedelta(
+                        seconds=3600),
+                    'used': False}
+
+        cfg.CONF.set_override('admin_token_refresh_margin', 0, 'client')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'admin_token_refresh_margin', 'client')
+        mock_list.side_effect = [q_exceptions.Unauthorized, FAKE_RESOURCES]
+        with patch.object(resource_handle, 'admin_token_manager',
+                          new=manager), patch.object(manager, '_fetch',
+                                                     side_effect=_fetch):
+            ctx = context.get_admin_context()
+            resources = self.client.list_resources(FAKE_RESOURCE, ctx, [])
+            self.assertEqual(FAKE_RESOURCES, resources)
+            # the rejected admin token is dropped and fetched again
+            self.assertEqual('token2', ctx.auth_token)
+            self.assertFalse(manager.is_cached('token1'))
+            self.assertEqual([None, 'admin_project_id'], fetched)
+
+            # tokens of users are not retried
+            mock_list.reset_mock()
+            mock_list.side_effect = q_exceptions.Unauthorized
+            ctx = context.Context(auth_token='user_token', is_admin=True)
+            self.assertRaises(q_exceptions.Unauthorized,
+                              self.client.list_resources,
+                              FAKE_RESOURCE, ctx, [])
+            self.assertEqual(1, mock_list.call_count)
+            self.assertEqual('user_token', ctx.auth_token)
+
     @patch.object(FakeClient, 'list_fake_res')
     def test_resource_handle_endpoint_unavailable(self, mock_list):
         handle = FakeResHandle(None)
@@ -0,0 +1,64 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+from six.moves import xrange
+import unittest
+
+from oslo_utils import uuidutils
+
+from tricircle.common import hashring
+
+
+class HashRingTest(unittest.TestCase):
+    def setUp(self):
+        self.keys = [uuidutils.generate_uuid() for _ in xrange(3000)]
+        self.nodes = ['host.%d' % i for i in xrange(3)]
+
+    def _get_owners(self, ring):
+        return dict((key, ring.get_node(key)) for key in self.keys)
+
+    def test_empty_ring(self):
+        self.assertIsNone(hashring.HashRing([]).get_node('key'))
+
+    def test_distribution(self):
+        owners = self._get_owners(hashring.HashRing(self.nodes))
+        self.assertEqual(owners, self._get_owners(
+            hashring.HashRing(reversed(self.nodes))))
+        counts = collections.Counter(owners.values())
+        self.assertEqual(set(self.nodes), set(counts))
+        for node in self.nodes:
+            # each node owns roughly one third of the keys
+            self.assertGreater(counts[node], len(self.keys) / 6)
+
+    def test_rebalance(self):
+        owners = self._get_owners(hashring.HashRing(self.nodes))
+
+        # keys only move to the joining node
+        new_owners = self._get_owners(
+            hashring.HashRing(self.nodes + ['host.3']))
+        moved = [key for key in self.keys if owners[key] != new_owners[key]]
+        self.assertTrue(moved)
+        self.assertLess(len(moved), len(self.keys) / 2)
+        for key in moved:
+            self.assertEqual('host.3', new_owners[key])
+
+        # only keys of the leaving node move
+        new_owners = self._get_owners(hashring.HashRing(self.nodes[1:]))
+        for key in self.keys:
+            if owners[key] == self.nodes[0]:
+                self.assertIn(new_owners[key], self.nodes[1:])
+            else:
+                self.assertEqual(owners[key], new_owners[key])
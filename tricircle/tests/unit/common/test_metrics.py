@@ -0,0 +1,118 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+import six
+
+from tricircle.common import metrics
+
+
+def _new_job_stats(counters=None, timers=None, pod_calls=None):
+    job_stats = {
+        'counters': dict((name, 0) for name in metrics.COUNTERS),
+        'timers': dict((name, metrics.new_histogram())
+                       for name in metrics.TIMERS),
+        'pod_calls': {}}
+    job_stats['counters'].update(counters or {})
+    for name, seconds in six.iteritems(timers or {}):
+        metrics.observe_histogram(job_stats['timers'][name], seconds)
+    for region_name, seconds in six.iteritems(pod_calls or {}):
+        job_stats['pod_calls'][region_name] = metrics.new_histogram()
+        metrics.observe_histogram(job_stats['pod_calls'][region_name],
+                                  seconds)
+    return job_stats
+
+
+class MetricsTest(unittest.TestCase):
+    def test_observe_histogram(self):
+        histogram = metrics.new_histogram()
+        for seconds in (0.005, 0.2, 0.2, 4000):
+            metrics.observe_histogram(histogram, seconds)
+        self.assertEqual(4, histogram['count'])
+        self.assertAlmostEqual(4000.405, histogram['sum'])
+        # buckets are cumulative, 4000 seconds only falls into +Inf
+        self.assertEqual([1, 1, 1, 3, 3, 3, 3, 3, 3, 3, 3, 4],
+                         histogram['buckets'])
+
+    def test_merge_stats(self):
+        stats1 = {'router': _new_job_stats(
+            counters={metrics.SUCCESS: 1},
+            timers={metrics.EXECUTION: 0.2}, pod_calls={'pod_1': 0.2})}
+        stats2 = {'router': _new_job_stats(
+            counters={metrics.FAIL: 1},
+            timers={metrics.EXECUTION: 2}, pod_calls={'pod_2': 0.2}),
+            'port': _new_job_stats(counters={metrics.SUCCESS: 1})}
+
+        merged = metrics.merge_stats([stats1, stats2])
+        self.assertEqual(set(['router', 'port']), set(merged))
+        router_stats = merged['router']
+        self.assertEqual(1, router_stats['counters'][metrics.SUCCESS])
+        self.assertEqual(1, router_stats['counters'][metrics.FAIL])
+        histogram = router_stats['timers'][metrics.EXECUTION]
+        self.assertEqual(2, histogram['count'])
+        self.assertAlmostEqual(2.2, histogram['sum'])
+        self.assertEqual(set(['pod_1', 'pod_2']),
+                         set(router_stats['pod_calls']))
+        # input statistics are not changed
+        self.assertEqual(1, stats1['router']['timers'][
+            metrics.EXECUTION]['count'])
+
+    @patch('oslo_utils.timeutils.utcnow')
+    def test_get_queue_stats(self, mock_now):
+        mock_now.return_value = datetime.datetime(2000, 1, 1, 12, 0, 0)
+        self.assertEqual({'depth': 0, 'new_jobs': 0, 'failed_jobs': 0,
+                          'max_wait_time': 0, 'avg_wait_time': 0},
+                         metrics.get_queue_stats([], []))
+        new_jobs = [{'timestamp': datetime.datetime(2000, 1, 1, 11, 59, 0)}]
+        failed_jobs = [{'timestamp': datetime.datetime(2000, 1, 1, 11, 55, 0)}]
+        self.assertEqual({'depth': 2, 'new_jobs': 1, 'failed_jobs': 1,
+                          'max_wait_time': 300, 'avg_wait_time': 180},
+                         metrics.get_queue_stats(new_jobs, failed_jobs))
+
+    def test_write_prometheus_file(self):
+        stats = {'router': _new_job_stats(
+            counters={metrics.SUCCESS: 1},
+            timers={metrics.QUEUE_WAIT: 0.2}, pod_calls={'pod_1': 0.02})}
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'xjob.prom')
+
+        metrics.write_prometheus_file(path, stats)
+        self.assertEqual(['xjob.prom'], os.listdir(tmp_dir))
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('# TYPE tricircle_job_total counter', lines)
+        self.assertIn(
+            'tricircle_job_total{type="router",outcome="success"} 1', lines)
+        self.assertIn('tricircle_job_total{type="router",outcome="fail"} 0',
+                      lines)
+        self.assertIn('# TYPE tricircle_job_queue_wait_seconds histogram',
+                      lines)
+        self.assertIn('tricircle_job_queue_wait_seconds_bucket'
+                      '{type="router",le="0.1"} 0', lines)
+        self.assertIn('tricircle_job_queue_wait_seconds_bucket'
+                      '{type="router",le="0.5"} 1', lines)
+        self.assertIn('tricircle_job_queue_wait_seconds_bucket'
+                      '{type="router",le="+Inf"} 1', lines)
+        self.assertIn('tricircle_job_queue_wait_seconds_count'
+                      '{type="router"} 1', lines)
+        self.assertIn('tricircle_job_pod_call_seconds_count'
+                      '{type="router",region="pod_1"} 1', lines)
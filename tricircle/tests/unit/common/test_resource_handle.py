@@ -13,10 +13,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+import eventlet
+import mock
 from mock import patch
 import unittest
 
 import neutronclient.common.exceptions as q_exceptions
+from oslo_config import cfg
+from oslo_utils import timeutils
 
 from tricircle.common import context
 from tricircle.common import exceptions
@@ -25,6 +30,7 @@ from tricircle.common import resource_handle
 
 class FakeHttpClient(object):
     endpoint_url = 'fake_endpoint_url'
+    auth_token = 'fake_token'
 
 
 class FakeNeutronClient(object):
@@ -75,6 +81,16 @@ class ResourceHandleTest(unittest.TestCase):
                           self.context, 'network', body)
         self.assertIsNone(self.handle.endpoint_url)
 
+    @patch.object(FakeNeutronClient, 'create_network')
+    def test_handle_create_unauthorized(self, mock_create):
+        mock_create.side_effect = q_exceptions.Unauthorized
+        with patch.object(resource_handle, 'admin_token_manager') as manager:
+            self.assertRaises(q_exceptions.Unauthorized,
+                              self.handle.handle_create,
+                              self.context, 'network', {'name': 'net1'})
+            # the rejected token is dropped if it's a cached admin token
+            manager.invalidate.assert_called_once_with('fake_token')
+
     @patch.object(FakeNeutronClient, 'show_network')
     def test_handle_get(self, mock_get):
         fake_network_id = 'fake_network_id'
@@ -162,3 +178,176 @@ class ResourceHandleTest(unittest.TestCase):
                           self.handle.handle_action, self.context, 'router',
                           'remove_gateway', fake_router_id)
         self.assertIsNone(self.handle.endpoint_url)
+
+
+class NeutronClientPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = resource_handle.NeutronClientPool()
+        self.addCleanup(self.pool.clear)
+
+    def _get(self, endpoint_url, token):
+        return self.pool.get(endpoint_url, token, 'auth_url', 60)
+
+    def test_get(self):
+        client = self._get('http://pod1:9696', 'token1')
+        self.assertIsInstance(client, resource_handle.SimpleNeutronClient)
+        self.assertIs(client, self._get('http://pod1:9696', 'token1'))
+
+        # clients of the same endpoint share the session
+        client2 = self._get('http://pod1:9696', 'token2')
+        self.assertIsNot(client, client2)
+        self.assertEqual('token2', client2.httpclient.auth_token)
+        self.assertIs(client.httpclient.http_session,
+                      client2.httpclient.http_session)
+        client3 = self._get('http://pod2:9696', 'token1')
+        self.assertIsNot(client.httpclient.http_session,
+                         client3.httpclient.http_session)
+
+        # pooling is disabled
+        cfg.CONF.set_override('neutron_client_pool_size', 0, 'client')
+        self.addCleanup(cfg.CONF.clear_override, 'neutron_client_pool_size',
+                        'client')
+        self.assertIsNot(self._get('http://pod1:9696', 'token1'),
+                         self._get('http://pod1:9696', 'token1'))
+
+    def test_evict(self):
+        cfg.CONF.set_override('neutron_client_pool_size', 2, 'client')
+        self.addCleanup(cfg.CONF.clear_override, 'neutron_client_pool_size',
+                        'client')
+        with patch.object(resource_handle.time, 'time') as mock_time:
+            mock_time.return_value = 1000
+            client1 = self._get('http://pod1:9696', 'token1')
+            client2 = self._get('http://pod2:9696', 'token1')
+            session2 = client2.httpclient.http_session
+            self._get('http://pod1:9696', 'token1')
+            # the least recently used client is evicted when the pool is full
+            self._get('http://pod3:9696', 'token1')
+            self.assertIs(client1, self._get('http://pod1:9696', 'token1'))
+            self.assertIsNot(client2, self._get('http://pod2:9696', 'token1'))
+            self.assertIsNot(session2, self._get(
+                'http://pod2:9696', 'token1').httpclient.http_session)
+
+            # idle clients are evicted
+            idle_timeout = cfg.CONF.client.neutron_client_idle_timeout
+            mock_time.return_value = 1000 + idle_timeout
+            self.assertIsNot(client1, self._get('http://pod1:9696',
+                                                'token1'))
+            self.assertEqual(1, len(self.pool._clients))
+            self.assertEqual(['http://pod1:9696'], list(self.pool._sessions))
+
+    def test_request(self):
+        client = self._get('http://pod1:9696', 'token1')
+        http_session = mock.Mock()
+        http_session.request.return_value.text = 'text'
+        client.httpclient.http_session = http_session
+        resp, body = client.httpclient.request(
+            'http://pod1:9696/v2.0/networks', 'POST', body='body')
+        self.assertEqual('text', body)
+        http_session.request.assert_called_once_with(
+            'POST', 'http://pod1:9696/v2.0/networks', data='body',
+            headers=mock.ANY, verify=True, timeout=60)
+        headers = http_session.request.call_args[1]['headers']
+        self.assertEqual('application/json', headers['Content-Type'])
+
+    def test_resource_handle_get_client(self):
+        handle = resource_handle.NeutronResourceHandle('auth_url')
+        handle.update_endpoint_url('http://pod1:9696')
+        ctx = context.Context(auth_token='token1')
+        self.addCleanup(resource_handle.neutron_client_pool.clear)
+        self.assertIs(handle._get_client(ctx), handle._get_client(ctx))
+        # the pool is shared by resource handles
+        other_handle = resource_handle.NeutronResourceHandle('auth_url')
+        other_handle.update_endpoint_url('http://pod1:9696')
+        self.assertIs(handle._get_client(ctx), other_handle._get_client(ctx))
+
+
+class AdminTokenManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = resource_handle.AdminTokenManager()
+        self.fetched = []
+        self.lifetime = 3600
+        patcher = patch.object(resource_handle.ResourceHandle,
+                               'get_keystone_session',
+                               side_effect=self._get_keystone_session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cfg.CONF.set_override('admin_token_refresh_margin', 0, 'client')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'admin_token_refresh_margin', 'client')
+
+    def _get_keystone_session(self, project_id=None):
+        self.fetched.append(project_id)
+        auth_ref = mock.Mock(
+            auth_token='token%d' % len(self.fetched),
+            project_id=project_id or 'admin_project_id',
+            expires=timeutils.utcnow() + datetime.timedelta(
+                seconds=self.lifetime))
+        sess = mock.Mock()
+        sess.auth.get_access.return_value = auth_ref
+        return sess
+
+    def test_get_token(self):
+        for _ in range(10):
+            self.assertEqual('token1', self.manager.get_token())
+        self.assertEqual('admin_project_id', self.manager.get_project_id())
+        self.assertEqual('token2', self.manager.get_token('project_id'))
+        self.assertEqual([None, 'project_id'], self.fetched)
+        self.assertEqual({'fetches': 2, 'hits': 10, 'refreshes': 0},
+                         self.manager.get_stats())
+
+        # tokens about to expire are fetched again
+        self.manager._tokens['project_id']['expires_at'] = (
+            timeutils.utcnow() + datetime.timedelta(seconds=10))
+        self.assertEqual('token3', self.manager.get_token('project_id'))
+
+    def test_get_token_concurrently(self):
+        pool = eventlet.GreenPool()
+        tokens = list(pool.imap(lambda _: self.manager.get_token(),
+                                range(5)))
+        self.assertEqual(['token1'] * 5, tokens)
+        self.assertEqual([None], self.fetched)
+
+    def test_refresh(self):
+        cfg.CONF.set_override('admin_token_refresh_margin', 300, 'client')
+        self.manager.get_token('project1')
+        self.manager.get_token('project2')
+        self.manager.refresh()
+        # tokens far from expiry are not refreshed
+        self.assertEqual(['project1', 'project2'], self.fetched)
+
+        for entry in self.manager._tokens.values():
+            entry['expires_at'] = timeutils.utcnow() + datetime.timedelta(
+                seconds=100)
+        self.manager._tokens['project2']['used'] = False
+        self.manager.refresh()
+        # only the used token is refreshed, the unused one is dropped
+        self.assertEqual(['project1', 'project2', 'project1'], self.fetched)
+        self.assertEqual(['project1'], list(self.manager._tokens))
+        self.assertEqual('token3', self.manager.get_token('project1'))
+        self.assertEqual(1, self.manager.get_stats()['refreshes'])
+
+    def test_invalidate(self):
+        self.assertEqual('token1', self.manager.get_token())
+        self.assertEqual('token2', self.manager.get_token('project_id'))
+        self.assertTrue(self.manager.is_cached('token1'))
+        self.assertFalse(self.manager.is_cached('user_token'))
+
+        self.assertTrue(self.manager.invalidate('token1'))
+        self.assertFalse(self.manager.is_cached('token1'))
+        self.assertFalse(self.manager.invalidate('token1'))
+        self.assertFalse(self.manager.invalidate('user_token'))
+        # only the rejected token is fetched again
+        self.assertEqual('token3', self.manager.get_token())
+        self.assertEqual('token2', self.manager.get_token('project_id'))
+        self.assertEqual([None, 'project_id', None], self.fetched)
+
+    def test_resource_handle_admin_token(self):
+        handle = resource_handle.NeutronResourceHandle('auth_url')
+        handle.update_endpoint_url('http://pod1:9696')
+        self.addCleanup(resource_handle.neutron_client_pool.clear)
+        with patch.object(resource_handle, 'admin_token_manager',
+                          new=self.manager):
+            ctx = context.get_admin_context()
+            ctx.tenant = 'project_id'
+            self.assertIs(handle._get_client(ctx), handle._get_client(ctx))
+        self.assertEqual(['project_id'], self.fetched)
@@ -0,0 +1,224 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import eventlet
+import mock
+from mock import patch
+import six
+from six.moves import xrange
+import unittest
+
+from oslo_config import cfg
+
+from tricircle.common import constants
+from tricircle.common import context
+from tricircle.common import xrpcapi
+from tricircle.db import api
+from tricircle.db import core
+from tricircle.db import models
+
+
+class XJobAPITest(unittest.TestCase):
+    def setUp(self):
+        core.initialize()
+        core.ModelBase.metadata.create_all(core.get_engine())
+        self.context = context.Context()
+        with patch.object(xrpcapi.rpc, 'init'), patch.object(
+                xrpcapi.rpc, 'get_client') as mock_get_client:
+            self.xjob_api = xrpcapi.XJobAPI()
+        self.mock_cast = mock_get_client.return_value.prepare.return_value.cast
+
+    def _get_jobs(self):
+        return core.query_resource(self.context, models.AsyncJob, [], [])
+
+    def test_configure_route_coalesced(self):
+        for _ in xrange(500):
+            self.xjob_api.configure_route(self.context, 'project_id',
+                                          'router_id')
+        jobs = self._get_jobs()
+        self.assertEqual(1, len(jobs))
+        self.assertEqual(constants.JS_New, jobs[0]['status'])
+        self.mock_cast.assert_called_once_with(
+            self.context, 'configure_route',
+            payload={constants.JT_CONFIGURE_ROUTE: 'router_id'})
+
+        # triggers for other resources are not coalesced
+        self.xjob_api.configure_route(self.context, 'project_id',
+                                      'router_id2')
+        self.assertEqual(2, len(self._get_jobs()))
+        self.assertEqual(2, self.mock_cast.call_count)
+
+        # once the pending job is handled, a new job is created again
+        api.finish_job(self.context, jobs[0]['id'], True,
+                       jobs[0]['timestamp'])
+        self.xjob_api.configure_route(self.context, 'project_id',
+                                      'router_id')
+        self.assertEqual(3, self.mock_cast.call_count)
+
+    def test_touch_new_job(self):
+        job = api.new_job(self.context, 'project_id',
+                          constants.JT_CONFIGURE_ROUTE, 'router_id')
+        core.update_resource(self.context, models.AsyncJob, job['id'],
+                             {'timestamp': datetime.datetime(2000, 1, 1)})
+        self.assertTrue(api.touch_new_job(
+            self.context, constants.JT_CONFIGURE_ROUTE, 'router_id'))
+        job = api.get_job(self.context, job['id'])
+        self.assertGreater(job['timestamp'], datetime.datetime(2000, 1, 1))
+        self.assertFalse(api.touch_new_job(
+            self.context, constants.JT_CONFIGURE_ROUTE, 'router_id2'))
+
+    def test_trigger_after_failed_run(self):
+        self.xjob_api.configure_route(self.context, 'project_id',
+                                      'router_id')
+        job = self._get_jobs()[0]
+        core.update_resource(self.context, models.AsyncJob, job['id'],
+                             {'timestamp': datetime.datetime(2000, 1, 1)})
+        job = api.get_job(self.context, job['id'])
+        running_job = api.register_job(self.context, 'project_id',
+                                       constants.JT_CONFIGURE_ROUTE,
+                                       'router_id')
+        api.finish_job(self.context, running_job['id'], False,
+                       job['timestamp'])
+        self.assertEqual(
+            [constants.JS_Fail, constants.JS_New],
+            sorted(job['status'] for job in self._get_jobs()))
+
+        # the new job left behind by the failed run is not picked up by any
+        # worker, so the trigger is not coalesced into it
+        self.xjob_api.configure_route(self.context, 'project_id',
+                                      'router_id')
+        self.assertEqual(2, self.mock_cast.call_count)
+        # the next trigger is coalesced into the job created just now
+        self.xjob_api.configure_route(self.context, 'project_id',
+                                      'router_id')
+        self.assertEqual(2, self.mock_cast.call_count)
+
+    def test_invoke_method_not_coalesced(self):
+        # explicit job requests like redo are always delivered
+        for _ in xrange(2):
+            self.xjob_api.invoke_method(
+                self.context, 'project_id', 'configure_route',
+                constants.JT_CONFIGURE_ROUTE, 'router_id')
+        self.assertEqual(2, len(self._get_jobs()))
+        self.assertEqual(2, self.mock_cast.call_count)
+
+        cfg.CONF.set_override('enable_job_coalescing', False)
+        self.addCleanup(cfg.CONF.clear_override, 'enable_job_coalescing')
+        self.xjob_api.configure_route(self.context, 'project_id',
+                                      'router_id')
+        self.assertEqual(3, len(self._get_jobs()))
+
+    @patch.object(xrpcapi.eventlet, 'spawn_after')
+    def test_coalescing_window(self, mock_spawn_after):
+        cfg.CONF.set_override('job_coalescing_window', 2)
+        self.addCleanup(cfg.CONF.clear_override, 'job_coalescing_window')
+        for _ in xrange(3):
+            self.xjob_api.configure_route(self.context, 'project_id',
+                                          'router_id')
+        self.assertFalse(self.mock_cast.called)
+        mock_spawn_after.assert_called_once_with(
+            2, mock.ANY, self.context, 'configure_route',
+            constants.JT_CONFIGURE_ROUTE, 'router_id')
+        # the delayed notification is sent
+        mock_spawn_after.call_args[0][1](
+            *mock_spawn_after.call_args[0][2:])
+        self.assertEqual(1, self.mock_cast.call_count)
+
+    def test_job_sharding(self):
+        cfg.CONF.set_override('enable_job_sharding', True)
+        self.addCleanup(cfg.CONF.clear_override, 'enable_job_sharding')
+        mock_prepare = self.xjob_api.client.prepare
+
+        # no worker registered, the job is sent to the topic
+        self.xjob_api.configure_route(self.context, 'project_id',
+                                      'router_id')
+        mock_prepare.assert_called_with(exchange='openstack')
+
+        workers = ['host1.1', 'host1.2', 'host2.1']
+        for worker in workers:
+            api.report_xjob_worker(self.context, worker, worker[:5])
+        # the cached ring is reloaded after the refresh interval
+        self.xjob_api._shard_ring_loaded_at = None
+        owners = {}
+        for i in xrange(30):
+            router_id = 'router_id%d' % i
+            self.xjob_api.configure_route(self.context, 'project_id',
+                                          router_id)
+            owners[router_id] = mock_prepare.call_args[1]['server']
+            self.assertEqual(
+                owners[router_id],
+                self.xjob_api.get_shard_worker(self.context, router_id))
+        self.assertEqual(set(workers), set(owners.values()))
+
+        # a worker leaves, only its resources move to other workers
+        api.delete_xjob_worker(self.context, 'host1.1')
+        self.xjob_api._shard_ring_loaded_at = None
+        for router_id, owner in six.iteritems(owners):
+            new_owner = self.xjob_api.get_shard_worker(self.context,
+                                                       router_id)
+            if owner == 'host1.1':
+                self.assertIn(new_owner, ['host1.2', 'host2.1'])
+            else:
+                self.assertEqual(owner, new_owner)
+
+    def test_notify_job_done(self):
+        self.xjob_api.notify_job_done(self.context,
+                                      constants.JT_CONFIGURE_ROUTE,
+                                      'router_id')
+        self.xjob_api.client.prepare.assert_called_once_with(
+            exchange='openstack', fanout=True)
+        self.mock_cast.assert_called_once_with(
+            self.context, 'job_done',
+            payload={constants.JT_CONFIGURE_ROUTE: 'router_id'})
+
+    @patch.object(eventlet, 'sleep')
+    def test_wait_job(self, mock_sleep):
+        api.new_job(self.context, 'project_id', constants.JT_CONFIGURE_ROUTE,
+                    'router_id')
+        job = api.get_latest_job(self.context, constants.JS_New,
+                                 constants.JT_CONFIGURE_ROUTE, 'router_id')
+        now = [0]
+
+        def _sleep(seconds):
+            now[0] += seconds
+
+        mock_sleep.side_effect = _sleep
+        with patch.object(xrpcapi.time, 'time', side_effect=lambda: now[0]):
+            self.assertIsNone(self.xjob_api.wait_job(self.context, job, 1000))
+            # the job is polled with backoff and the wait time is capped
+            intervals = [call[0][0] for call in mock_sleep.call_args_list]
+            self.assertEqual([0.5, 1, 2, 4, 5], intervals[:5])
+            self.assertEqual(cfg.CONF.max_job_wait_time, sum(intervals))
+
+            # the job is handled while waiting
+            mock_sleep.reset_mock()
+            running_job = api.register_job(self.context, 'project_id',
+                                           constants.JT_CONFIGURE_ROUTE,
+                                           'router_id')
+
+            def _finish_job(seconds):
+                api.finish_job(self.context, running_job['id'], True,
+                               job['timestamp'])
+
+            mock_sleep.side_effect = _finish_job
+            self.assertEqual(constants.JS_Success,
+                             self.xjob_api.wait_job(self.context, job, 10))
+            self.assertEqual(1, mock_sleep.call_count)
+        # the xjob daemon is not called
+        self.assertFalse(self.xjob_api.client.prepare.called)
+
+    def tearDown(self):
+        core.ModelBase.metadata.drop_all(core.get_engine())
@@ -13,13 +13,22 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+import mock
+import six
 from six.moves import xrange
 import unittest
 
+from oslo_config import cfg
+from oslo_utils import timeutils
+import sqlalchemy as sql
+
+from tricircle.common import constants
 from tricircle.common import context
 from tricircle.common import exceptions
 
 from tricircle.db import api
+from tricircle.db import cache
 from tricircle.db import core
 from tricircle.db import models
 
@@ -86,6 +95,27 @@ class APITest(unittest.TestCase):
         self.assertEqual('test_pod_uuid_1', mappings[0][0]['pod_id'])
         self.assertEqual('top_uuid', mappings[0][1])
 
+    def test_get_bottom_mappings_by_top_ids(self):
+        self._create_pod(0, 'test_az_uuid_0')
+        self._create_pod(1, 'test_az_uuid_1')
+        self._create_pod(2, 'test_az_uuid_2')
+        self._create_resource_mappings()
+        api.create_resource_mapping(self.context, 'top_uuid2', 'bottom_uuid',
+                                    'test_pod_uuid_0', 'project_id', 'port')
+        mappings = api.get_bottom_mappings_by_top_ids(
+            self.context, ['top_uuid2', 'top_uuid3'], 'port')
+        self.assertEqual(
+            [('test_pod_uuid_2', 'bottom_uuid_2'),
+             ('test_pod_uuid_0', 'bottom_uuid')],
+            [(pod['pod_id'], bottom_id) for pod, bottom_id in mappings[
+                'top_uuid2']])
+        self.assertEqual([], mappings['top_uuid3'])
+
+        bottom_ids = api.get_bottom_ids_by_top_ids_region_name(
+            self.context, ['top_uuid', 'top_uuid2'], 'test_pod_2', 'port')
+        self.assertEqual({'top_uuid': None, 'top_uuid2': 'bottom_uuid_2'},
+                         bottom_ids)
+
     def test_get_bottom_mappings_by_tenant_pod(self):
         for i in xrange(3):
             pod = {'pod_id': 'test_pod_uuid_%d' % i,
@@ -350,6 +380,80 @@ class APITest(unittest.TestCase):
             self.context, top_id, 'network')
         self.assertEqual(0, len(mappings))
 
+    def test_routing_cache(self):
+        cfg.CONF.set_override('enable_routing_cache', True)
+        self._create_pod(0, 'test_az_uuid_0')
+        self._create_pod(1, 'test_az_uuid_1')
+        self._create_pod(2, 'test_az_uuid_2')
+        self._create_resource_mappings()
+
+        mappings = api.get_bottom_mappings_by_top_id(self.context,
+                                                     'top_uuid', 'network')
+        self.assertEqual(1, len(mappings))
+        self.assertEqual({'hits': 0, 'misses': 1, 'evictions': 0, 'size': 1},
+                         api.get_routing_cache_stats())
+        bottom_id = api.get_bottom_id_by_top_id_region_name(
+            self.context, 'top_uuid', 'test_pod_1', 'network')
+        self.assertEqual('top_uuid', bottom_id)
+        self.assertEqual(1, api.get_routing_cache_stats()['hits'])
+        # modifying the returned value doesn't pollute the cache
+        mappings[0][0]['region_name'] = 'fake_region'
+        mappings = api.get_bottom_mappings_by_top_id(self.context,
+                                                     'top_uuid', 'network')
+        self.assertEqual('test_pod_1', mappings[0][0]['region_name'])
+
+        api.create_resource_mapping(self.context, 'top_uuid', 'bottom_uuid',
+                                    'test_pod_uuid_2', 'project_id',
+                                    'network')
+        mappings = api.get_bottom_mappings_by_top_id(self.context,
+                                                     'top_uuid', 'network')
+        self.assertEqual(2, len(mappings))
+
+        routing_id = core.query_resource(
+            self.context, models.ResourceRouting,
+            [{'key': 'bottom_id', 'comparator': 'eq',
+              'value': 'bottom_uuid'}], [])[0]['id']
+        api.update_resource_routing(self.context, routing_id,
+                                    {'bottom_id': 'new_bottom_uuid'})
+        bottom_id = api.get_bottom_id_by_top_id_region_name(
+            self.context, 'top_uuid', 'test_pod_2', 'network')
+        self.assertEqual('new_bottom_uuid', bottom_id)
+
+        api.delete_mappings_by_bottom_id(self.context, 'new_bottom_uuid')
+        mappings = api.get_bottom_mappings_by_top_id(self.context,
+                                                     'top_uuid', 'network')
+        self.assertEqual(1, len(mappings))
+
+        pod = api.get_pod_by_top_id(self.context, 'top_uuid2')
+        self.assertEqual('test_pod_uuid_2', pod['pod_id'])
+        api.delete_mappings_by_top_id(self.context, 'top_uuid2')
+        self.assertIsNone(api.get_pod_by_top_id(self.context, 'top_uuid2'))
+
+        api.delete_mappings_by_top_id(self.context, 'top_uuid')
+        mappings = api.get_bottom_mappings_by_top_id(self.context,
+                                                     'top_uuid', 'network')
+        self.assertEqual(0, len(mappings))
+
+    def test_routing_cache_eviction(self):
+        routing_cache = cache.RoutingCache(max_size=2, ttl=60)
+        pod = {'pod_id': 'test_pod_uuid_0', 'region_name': 'test_pod_0'}
+        routing_cache.set('top_uuid_0', 'network', [(pod, 'bottom_uuid_0')])
+        routing_cache.set('top_uuid_1', 'network', [(pod, 'bottom_uuid_1')])
+        # top_uuid_0 becomes the most recently used entry
+        self.assertIsNotNone(routing_cache.get('top_uuid_0', 'network'))
+        routing_cache.set('top_uuid_2', 'network', [(pod, 'bottom_uuid_2')])
+        self.assertIsNone(routing_cache.get('top_uuid_1', 'network'))
+        self.assertIsNotNone(routing_cache.get('top_uuid_0', 'network'))
+        self.assertEqual(1, routing_cache.get_stats()['evictions'])
+
+        routing_cache.invalidate_bottom_id('bottom_uuid_2')
+        self.assertIsNone(routing_cache.get('top_uuid_2', 'network'))
+
+        routing_cache = cache.RoutingCache(max_size=2, ttl=0)
+        routing_cache.set('top_uuid_0', 'network', [(pod, 'bottom_uuid_0')])
+        # entry expires immediately
+        self.assertIsNone(routing_cache.get('top_uuid_0', 'network'))
+
     def test_update_pod(self):
         self._create_pod(0, 'test_az_uuid_0')
         pod_body = {
@@ -364,5 +468,506 @@ class APITest(unittest.TestCase):
         self.assertEqual(updated_pod['dc_name'], 'test_dc_name_1')
         self.assertEqual(updated_pod['az_name'], 'test_az_uuid_1')
 
+    def test_create_resource_mappings(self):
+        self._create_pod(0, 'test_az_uuid_0')
+        self._create_pod(1, 'test_az_uuid_1')
+        api.create_resource_mapping(self.context, 'top_uuid_0', None,
+                                    'test_pod_uuid_0', 'project_id',
+                                    'port')
+
+        def _entry(index, pod_index, resource_type='port'):
+            return {'top_id': 'top_uuid_%d' % index,
+                    'bottom_id': 'bottom_uuid_%d' % index,
+                    'pod_id': 'test_pod_uuid_%d' % pod_index,
+                    'project_id': 'project_id',
+                    'resource_type': resource_type}
+
+        entries = [_entry(0, 0), _entry(0, 1), _entry(1, 0),
+                   _entry(1, 0, 'network'), _entry(1, 0)]
+        created = api.create_resource_mappings(self.context, entries)
+        # the existing entry and the duplicated entry are skipped
+        self.assertEqual([entries[1], entries[2], entries[3]], created)
+        routings = api.list_resource_routings(
+            self.context, sorts=[(models.ResourceRouting.id, True)],
+            fields=['top_id', 'bottom_id', 'pod_id', 'resource_type'])
+        self.assertEqual(
+            [{'top_id': 'top_uuid_0', 'bottom_id': None,
+              'pod_id': 'test_pod_uuid_0', 'resource_type': 'port'}] + [
+                dict((key, entry[key]) for key in (
+                    'top_id', 'bottom_id', 'pod_id', 'resource_type'))
+                for entry in created],
+            routings)
+        for routing in api.list_resource_routings(self.context):
+            self.assertIsNotNone(routing['created_at'])
+
+        self.assertEqual([], api.create_resource_mappings(self.context,
+                                                          entries))
+        self.assertEqual([], api.create_resource_mappings(self.context, []))
+
+    def test_create_resource_mappings_conflict(self):
+        self._create_pod(0, 'test_az_uuid_0')
+        entries = [{'top_id': 'top_uuid_%d' % i,
+                    'bottom_id': 'bottom_uuid_%d' % i,
+                    'pod_id': 'test_pod_uuid_0',
+                    'project_id': 'project_id',
+                    'resource_type': 'port'} for i in xrange(3)]
+        api.create_resource_mapping(self.context, 'top_uuid_1',
+                                    'bottom_uuid_1', 'test_pod_uuid_0',
+                                    'project_id', 'port')
+        real_query = self.context.session.query
+
+        def fake_query(*args, **kwargs):
+            # simulate that another worker creates the entry after we check
+            self.context.session.query = real_query
+            return real_query(*args, **kwargs).filter(sql.false())
+
+        self.context.session.query = fake_query
+        created = api.create_resource_mappings(self.context, entries)
+        self.assertEqual([entries[0], entries[2]], created)
+        self.assertEqual(3, len(api.list_resource_routings(self.context)))
+
+    def test_iter_resource_routings(self):
+        self._create_pod(0, 'test_az_uuid_0')
+        self._create_pod(1, 'test_az_uuid_1')
+        self._create_pod(2, 'test_az_uuid_2')
+        self._create_resource_mappings()
+        filters = [{'key': 'resource_type', 'comparator': 'eq',
+                    'value': 'network'}]
+        routings = api.iter_resource_routings(
+            self.context, filters, sorts=[(models.ResourceRouting.id, True)],
+            batch_size=1, fields=['top_id', 'pod_id'])
+        self.assertEqual([{'top_id': 'top_uuid', 'pod_id': 'test_pod_uuid_0'},
+                          {'top_id': 'top_uuid', 'pod_id': 'test_pod_uuid_1'}],
+                         list(routings))
+
+    def test_iter_jobs(self):
+        api.new_job(self.context, 'project_id', 'router', 'uuid1')
+        job2 = api.new_job(self.context, 'project_id', 'router', 'uuid2')
+        api.finish_job(self.context, job2['id'], True, timeutils.utcnow())
+
+        jobs = [(job['resource_id'], job.get('status'))
+                for job in api.iter_jobs(self.context)]
+        self.assertEqual([('uuid1', constants.JS_New), ('uuid2', None)],
+                         jobs)
+        filters = [{'key': 'status', 'comparator': 'eq',
+                    'value': constants.JS_New}]
+        jobs = [job['resource_id']
+                for job in api.iter_jobs(self.context, filters)]
+        self.assertEqual(['uuid1'], jobs)
+        filters = [{'key': 'status', 'comparator': 'eq',
+                    'value': constants.JS_Success}]
+        jobs = [job['resource_id']
+                for job in api.iter_jobs(self.context, filters)]
+        self.assertEqual(['uuid2'], jobs)
+        # filters of the caller are not modified
+        self.assertEqual(1, len(filters))
+
+    def test_list_jobs_with_log(self):
+        now = timeutils.utcnow()
+        job_ids = []
+        for i in xrange(5):
+            job = api.new_job(self.context, 'project_id', 'router',
+                              'uuid%d' % i)
+            job_ids.append(job['id'])
+            timestamp = now + datetime.timedelta(seconds=i)
+            if i < 3:
+                api.finish_job(self.context, job['id'], True, timestamp)
+            else:
+                # sqlite stores the server default timestamp without
+                # microseconds, which breaks comparison with the marker
+                core.update_resource(self.context, models.AsyncJob,
+                                     job['id'], {'timestamp': timestamp})
+        sorts = [('timestamp', False)]
+
+        jobs = api.list_jobs_with_log(self.context, sorts=sorts)
+        # jobs in the job table come first
+        self.assertEqual(['uuid4', 'uuid3', 'uuid2', 'uuid1', 'uuid0'],
+                         [job['resource_id'] for job in jobs])
+
+        # page across the job table and the job log table
+        pages = []
+        marker = None
+        while True:
+            jobs = api.list_jobs_with_log(self.context, sorts=sorts,
+                                          limit=2, marker=marker)
+            if not jobs:
+                break
+            pages.append([job['resource_id'] for job in jobs])
+            marker = jobs[-1]['id']
+            self.assertLess(len(pages), 4)
+        self.assertEqual([['uuid4', 'uuid3'], ['uuid2', 'uuid1'], ['uuid0']],
+                         pages)
+
+        # time range filters only hit the job logs in the range
+        filters = [{'key': 'timestamp', 'comparator': 'gte',
+                    'value': now + datetime.timedelta(seconds=1)},
+                   {'key': 'timestamp', 'comparator': 'lte',
+                    'value': now + datetime.timedelta(seconds=1)},
+                   {'key': 'status', 'comparator': 'eq',
+                    'value': constants.JS_Success}]
+        jobs = api.list_jobs_with_log(self.context, filters, sorts)
+        self.assertEqual(['uuid1'], [job['resource_id'] for job in jobs])
+
+        self.assertRaises(exceptions.ResourceNotFound,
+                          api.list_jobs_with_log, self.context,
+                          limit=2, marker='fake_marker')
+
+    def test_purge_job_logs(self):
+        now = timeutils.utcnow()
+        for i in xrange(5):
+            job = api.new_job(self.context, 'project_id', 'router',
+                              'uuid%d' % i)
+            api.finish_job(self.context, job['id'], True,
+                           now - datetime.timedelta(days=i))
+
+        purged = api.purge_job_logs(
+            self.context, now - datetime.timedelta(days=1, hours=12),
+            batch_size=2)
+        self.assertEqual(3, purged)
+        jobs = api.list_jobs_from_log(self.context)
+        self.assertEqual(['uuid0', 'uuid1'],
+                         sorted([job['resource_id'] for job in jobs]))
+        self.assertEqual(0, api.purge_job_logs(
+            self.context, now - datetime.timedelta(days=1, hours=12)))
+
+    def test_job_lease(self):
+        self.assertTrue(api.claim_job_lease(
+            self.context, 'router', 'uuid1', 'owner1', 'host1', 60))
+        # the lease is valid, other workers fail to claim it
+        self.assertFalse(api.claim_job_lease(
+            self.context, 'router', 'uuid1', 'owner2', 'host2', 60))
+        # leases of other jobs are independent
+        self.assertTrue(api.claim_job_lease(
+            self.context, 'port', 'uuid1', 'owner2', 'host2', 60))
+
+        # only the owner can renew and release the lease
+        self.assertTrue(api.renew_job_lease(
+            self.context, 'router', 'uuid1', 'owner1', 60))
+        self.assertFalse(api.renew_job_lease(
+            self.context, 'router', 'uuid1', 'owner2', 60))
+        api.release_job_lease(self.context, 'router', 'uuid1', 'owner2')
+        lease = core.get_resource(self.context, models.AsyncJobLease,
+                                  ('router', 'uuid1'))
+        self.assertEqual('owner1', lease['owner'])
+
+        # expired lease is taken over
+        self.assertTrue(api.renew_job_lease(
+            self.context, 'router', 'uuid1', 'owner1', -1))
+        self.assertTrue(api.claim_job_lease(
+            self.context, 'router', 'uuid1', 'owner2', 'host2', 60))
+        lease = core.get_resource(self.context, models.AsyncJobLease,
+                                  ('router', 'uuid1'))
+        self.assertEqual(('owner2', 'host2'), (lease['owner'], lease['host']))
+        self.assertFalse(api.renew_job_lease(
+            self.context, 'router', 'uuid1', 'owner1', 60))
+
+        api.release_job_lease(self.context, 'router', 'uuid1', 'owner2')
+        self.assertTrue(api.claim_job_lease(
+            self.context, 'router', 'uuid1', 'owner1', 'host1', 60))
+
+    def test_job_stats(self):
+        api.update_job_stats(self.context, 'worker1', {'router': {}})
+        api.update_job_stats(self.context, 'worker2', {})
+        api.update_job_stats(self.context, 'worker1', {'port': {}})
+        job_stats = dict((stats['worker'], stats['stats'])
+                         for stats in api.list_job_stats(self.context))
+        self.assertEqual({'worker1': {'port': {}}, 'worker2': {}}, job_stats)
+
+        now = timeutils.utcnow()
+        core.update_resource(self.context, models.AsyncJobStats, 'worker2',
+                             {'updated_at': now - datetime.timedelta(
+                                 hours=2)})
+        self.assertEqual(['worker1'], [
+            stats['worker'] for stats in api.list_job_stats(
+                self.context, now - datetime.timedelta(hours=1))])
+        api.delete_job_stats(self.context, now - datetime.timedelta(hours=1))
+        self.assertEqual(['worker1'], [
+            stats['worker'] for stats in api.list_job_stats(self.context)])
+
+    def test_get_job_result(self):
+        job_type = constants.JT_CONFIGURE_ROUTE
+        for resource_id in ('router_id1', 'router_id2'):
+            api.new_job(self.context, 'project_id', job_type, resource_id)
+        jobs = {}
+        for resource_id in ('router_id1', 'router_id2'):
+            jobs[resource_id] = api.get_latest_job(
+                self.context, constants.JS_New, job_type, resource_id)
+            self.assertIsNone(api.get_job_result(
+                self.context, job_type, resource_id,
+                jobs[resource_id]['timestamp']))
+
+        for resource_id, successful in (('router_id1', True),
+                                        ('router_id2', False)):
+            running_job = api.register_job(self.context, 'project_id',
+                                           job_type, resource_id)
+            api.finish_job(self.context, running_job['id'], successful,
+                           jobs[resource_id]['timestamp'])
+        self.assertEqual(constants.JS_Success, api.get_job_result(
+            self.context, job_type, 'router_id1',
+            jobs['router_id1']['timestamp']))
+        self.assertEqual(constants.JS_Fail, api.get_job_result(
+            self.context, job_type, 'router_id2',
+            jobs['router_id2']['timestamp']))
+        # jobs created after the run are not handled yet
+        self.assertIsNone(api.get_job_result(
+            self.context, job_type, 'router_id1',
+            jobs['router_id1']['timestamp'] + datetime.timedelta(seconds=1)))
+
+    def test_xjob_workers(self):
+        api.report_xjob_worker(self.context, 'host2.1', 'host2')
+        api.report_xjob_worker(self.context, 'host1.1', 'host1')
+        api.report_xjob_worker(self.context, 'host1.1', 'host1')
+        self.assertEqual(['host1.1', 'host2.1'],
+                         api.list_xjob_workers(self.context))
+
+        now = timeutils.utcnow()
+        core.update_resource(self.context, models.XJobWorker, 'host2.1',
+                             {'heartbeat_at': now - datetime.timedelta(
+                                 minutes=1)})
+        self.assertEqual(['host1.1'], api.list_xjob_workers(
+            self.context, now - datetime.timedelta(seconds=30)))
+
+        api.delete_xjob_worker(self.context, 'host1.1')
+        self.assertEqual(['host2.1'], api.list_xjob_workers(self.context))
+
+    def test_route_digests(self):
+        key1 = ('pod_1', 'routers', 'router_id')
+        key2 = ('pod_2', 'routers', 'router_id')
+        key3 = ('pod_1', 'subnets', 'subnet_id')
+        api.update_route_digests(self.context, {key1: 'digest1',
+                                                key3: 'digest3'})
+        digests = api.get_route_digests(self.context, [key1, key2, key3])
+        self.assertEqual(set([key1, key3]), set(digests))
+        self.assertEqual('digest1', digests[key1][0])
+
+        api.update_route_digests(self.context, {key1: 'digest1_new',
+                                                key2: 'digest2'})
+        digests = api.get_route_digests(self.context, [key1, key2])
+        self.assertEqual({key1: 'digest1_new', key2: 'digest2'},
+                         dict((key, digest) for key, (
+                             digest, _) in six.iteritems(digests)))
+
+        api.delete_route_digests(self.context, [key1, key3])
+        self.assertEqual([key2], list(api.get_route_digests(
+            self.context, [key1, key2, key3])))
+        self.assertEqual({}, api.get_route_digests(self.context, []))
+
+    def test_route_digests_deleted_with_mappings(self):
+        self._create_pod(0, 'test_az_uuid_0')
+        self._create_pod(1, 'test_az_uuid_1')
+        api.create_resource_mapping(self.context, 'top_router_id',
+                                    'b_router_id_0', 'test_pod_uuid_0',
+                                    'project_id', 'router')
+        api.create_resource_mapping(self.context, 'top_router_id',
+                                    'b_router_id_1', 'test_pod_uuid_1',
+                                    'project_id', 'router')
+        api.create_resource_mapping(self.context, 'subnet_id', 'subnet_id',
+                                    'test_pod_uuid_0', 'project_id',
+                                    'subnet')
+        key1 = ('test_pod_0', 'routers', 'b_router_id_0')
+        key2 = ('test_pod_1', 'routers', 'b_router_id_1')
+        key3 = ('test_pod_0', 'subnets', 'subnet_id')
+        api.update_route_digests(self.context, {key1: 'digest1',
+                                                key2: 'digest2',
+                                                key3: 'digest3'})
+
+        api.delete_mappings_by_bottom_id(self.context, 'b_router_id_0')
+        self.assertEqual(set([key2, key3]), set(api.get_route_digests(
+            self.context, [key1, key2, key3])))
+        api.delete_mappings_by_top_id(self.context, 'top_router_id')
+        self.assertEqual([key3], list(api.get_route_digests(
+            self.context, [key1, key2, key3])))
+        routing_id = core.query_resource(
+            self.context, models.ResourceRouting,
+            [{'key': 'top_id', 'comparator': 'eq',
+              'value': 'subnet_id'}], [])[0]['id']
+        api.delete_resource_routing(self.context, routing_id)
+        self.assertEqual({}, api.get_route_digests(
+            self.context, [key1, key2, key3]))
+
+    def _count_statements(self, func, *args, **kwargs):
+        statements = []
+
+        def _before_execute(conn, cursor, statement, *args):
+            # skip the connection ping issued by oslo.db
+            if 'FROM' in statement:
+                statements.append(statement)
+
+        engine = core.get_engine()
+        sql.event.listen(engine, 'before_cursor_execute', _before_execute)
+        try:
+            ret = func(*args, **kwargs)
+        finally:
+            sql.event.remove(engine, 'before_cursor_execute',
+                             _before_execute)
+        return ret, len(statements)
+
+    def test_relationship_expand(self):
+        api.create_region(self.context, {'id': 'region_id',
+                                         'region_name': 'region'})
+        api.create_dc(self.context, {'id': 'dc_id', 'region_id': 'region_id',
+                                     'dc_name': 'dc'})
+        api.create_fabric(self.context, {'id': 'fabric_id', 'dc_id': 'dc_id',
+                                         'fabric_name': 'fabric'})
+        api.create_core_router(self.context, {
+            'id': 'router_id', 'dc': 'dc', 'project_id': 'project_id',
+            'core_router_name': 'router', 'admin_state_up': True,
+            'status': 'DOWN'})
+        with self.context.session.begin():
+            core.create_resource(self.context, models.CoreRouterRoute,
+                                 {'core_router_id': 'router_id',
+                                  'destination': '10.0.1.0/24',
+                                  'nexthop': '10.0.0.1'})
+        self.context.session.expunge_all()
+
+        # relationships are not loaded without expand
+        regions, count = self._count_statements(api.list_regions,
+                                                self.context)
+        self.assertEqual([{'id': 'region_id', 'region_name': 'region'}],
+                         regions)
+        self.assertEqual(1, count)
+        self.context.session.expunge_all()
+        router, count = self._count_statements(api.get_core_router,
+                                               self.context, 'router_id')
+        self.assertNotIn('routes', router)
+        self.assertEqual(1, count)
+        self.context.session.expunge_all()
+
+        regions = api.list_regions(self.context, expand=['dcs'])
+        self.assertEqual([{'id': 'dc_id', 'region_id': 'region_id',
+                           'dc_name': 'dc'}], regions[0]['dcs'])
+        self.context.session.expunge_all()
+        dc = api.get_dc(self.context, 'dc_id', expand=['fabrics'])
+        self.assertEqual(['fabric'],
+                         [fabric['fabric_name'] for fabric in dc['fabrics']])
+        self.context.session.expunge_all()
+        router, count = self._count_statements(
+            api.get_core_router, self.context, 'router_id',
+            expand=['routes', 'interfaces'])
+        self.assertEqual([{'core_router_id': 'router_id',
+                           'destination': '10.0.1.0/24',
+                           'nexthop': '10.0.0.1'}], router['routes'])
+        self.assertEqual([], router['interfaces'])
+        self.assertNotIn('firewall_bypasss', router)
+        # one query for the router and one for each expanded relationship
+        self.assertEqual(3, count)
+
+    def test_pod_registry(self):
+        self._create_pod(0, 'test_az_uuid_0')
+        self._create_pod(1, 'test_az_uuid_1')
+        self.assertEqual('test_pod_uuid_0',
+                         api.get_pod_by_name(self.context,
+                                             'test_pod_0')['pod_id'])
+
+        # changes made via db api bump the registry version
+        api.update_pod(self.context, 'test_pod_uuid_0',
+                       {'region_name': 'test_pod_new'})
+        self.assertIsNone(api.get_pod_by_name(self.context, 'test_pod_0'))
+        self.assertEqual('test_pod_new',
+                         api.get_pod(self.context,
+                                     'test_pod_uuid_0')['region_name'])
+        api.delete_pod(self.context, 'test_pod_uuid_1')
+        self.assertRaises(exceptions.ResourceNotFound, api.get_pod,
+                          self.context, 'test_pod_uuid_1')
+
+        # pods created by other processes are found after a lookup miss
+        with self.context.session.begin():
+            core.create_resource(self.context, models.Pod,
+                                 {'pod_id': 'test_pod_uuid_2',
+                                  'region_name': 'test_pod_2',
+                                  'az_name': 'test_az_uuid_2'})
+        self.assertEqual('test_pod_uuid_2',
+                         api.get_pod_by_name(self.context,
+                                             'test_pod_2')['pod_id'])
+
+        # pods updated by other processes are found after reconciling
+        with self.context.session.begin():
+            core.update_resource(self.context, models.Pod, 'test_pod_uuid_2',
+                                 {'dc_name': 'test_dc_name_2'})
+        self.assertIsNone(
+            api.get_pod(self.context, 'test_pod_uuid_2')['dc_name'])
+        cfg.CONF.set_override('pod_registry_refresh_interval', 0)
+        self.assertEqual(
+            'test_dc_name_2',
+            api.get_pod(self.context, 'test_pod_uuid_2')['dc_name'])
+
+        # getting the next pod of the last pod does not reload the registry
+        cfg.CONF.clear_override('pod_registry_refresh_interval')
+        api.get_pod(self.context, 'test_pod_uuid_2')
+        with mock.patch.object(cache.pod_registry, '_load') as mock_load:
+            self.assertIsNone(api.get_next_bottom_pod(
+                self.context, current_pod_id='test_pod_uuid_2'))
+            self.assertFalse(mock_load.called)
+
+        # unknown pods are remembered as missing for a while
+        with mock.patch.object(cache.pod_registry, '_load',
+                               wraps=cache.pod_registry._load) as mock_load:
+            for _ in xrange(3):
+                self.assertIsNone(api.get_pod_by_name(self.context,
+                                                      'test_pod_4'))
+            self.assertEqual(1, mock_load.call_count)
+        # pod changes made by the same process clear the missing lookups
+        self._create_pod(4, 'test_az_uuid_4')
+        self.assertEqual('test_pod_uuid_4',
+                         api.get_pod_by_name(self.context,
+                                             'test_pod_4')['pod_id'])
+
+        # returned pods are copies
+        pod = api.get_pod(self.context, 'test_pod_uuid_2')
+        pod['region_name'] = 'test_pod_3'
+        self.assertEqual('test_pod_2',
+                         api.get_pod(self.context,
+                                     'test_pod_uuid_2')['region_name'])
+
+    def test_upsert_cached_endpoints(self):
+        self._create_pod(0, 'test_az_uuid_0')
+        self._create_pod(1, 'test_az_uuid_1')
+        api.create_cached_endpoints(self.context,
+                                    {'service_id': 'service_uuid_0',
+                                     'pod_id': 'test_pod_uuid_0',
+                                     'service_type': 'neutron',
+                                     'service_url': 'http://127.0.0.1:1'})
+        self.assertEqual('http://127.0.0.1:1', api.get_cached_endpoint_url(
+            self.context, 'test_pod_uuid_0', 'neutron'))
+
+        api.upsert_cached_endpoints(
+            self.context,
+            {'test_pod_uuid_0': {'neutron': 'http://127.0.0.1:2',
+                                 'nova': 'http://127.0.0.1:3'},
+             'test_pod_uuid_1': {'neutron': 'http://127.0.0.1:4'}})
+        self.assertEqual(3, len(api.list_cached_endpoints(self.context)))
+        # the existing endpoint is updated in place
+        self.assertEqual('http://127.0.0.1:2', api.get_cached_endpoints(
+            self.context, 'service_uuid_0')['service_url'])
+        for pod_id, service_type, url in [
+                ('test_pod_uuid_0', 'neutron', 'http://127.0.0.1:2'),
+                ('test_pod_uuid_0', 'nova', 'http://127.0.0.1:3'),
+                ('test_pod_uuid_1', 'neutron', 'http://127.0.0.1:4')]:
+            self.assertEqual(url, api.get_cached_endpoint_url(
+                self.context, pod_id, service_type))
+
+        # endpoints created by other processes are found after a lookup miss
+        with self.context.session.begin():
+            core.create_resource(self.context, models.CachedEndpoint,
+                                 {'service_id': 'service_uuid_1',
+                                  'pod_id': 'test_pod_uuid_1',
+                                  'service_type': 'nova',
+                                  'service_url': 'http://127.0.0.1:5'})
+        self.assertEqual('http://127.0.0.1:5', api.get_cached_endpoint_url(
+            self.context, 'test_pod_uuid_1', 'nova'))
+
+        # lookups of endpoints marked as missing do not reload the registry
+        api.mark_cached_endpoint_missing('test_pod_uuid_1', 'cinder')
+        self.assertTrue(api.is_cached_endpoint_missing('test_pod_uuid_1',
+                                                       'cinder'))
+        with mock.patch.object(cache.endpoint_registry, '_load') as mock_load:
+            self.assertIsNone(api.get_cached_endpoint_url(
+                self.context, 'test_pod_uuid_1', 'cinder'))
+            self.assertFalse(mock_load.called)
+
     def tearDown(self):
         core.ModelBase.metadata.drop_all(core.get_engine())
+        cfg.CONF.clear_override('enable_routing_cache')
+        cfg.CONF.clear_override('pod_registry_refresh_interval')
+        api.invalidate_routing_cache()
+        cache.routing_cache.reset_stats()
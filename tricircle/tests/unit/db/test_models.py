@@ -15,7 +15,9 @@
 
 
 import datetime
+import gc
 import inspect
+import time
 import unittest
 
 import oslo_db.exception
@@ -26,6 +28,7 @@ from tricircle.common import exceptions
 from tricircle.db import api
 from tricircle.db import core
 from tricircle.db import models
+import tricircle.tests.unit.utils as test_utils
 
 
 def _get_field_value(column):
@@ -121,6 +124,24 @@ class ModelsTest(unittest.TestCase):
         pod_obj = models.Pod.from_dict(pod)
         for attr in pod_obj.attributes:
             self.assertEqual(getattr(pod_obj, attr), pod[attr])
+        self.assertEqual(pod, pod_obj.to_dict())
+
+        # model with only one attribute
+        cidr_obj = models.DestinationCidr.from_dict(
+            {'destination': '10.0.1.0/24'})
+        self.assertEqual({'destination': '10.0.1.0/24'}, cidr_obj.to_dict())
+
+    def test_obj_to_dict_unloaded(self):
+        pod = {'pod_id': 'test_pod_uuid',
+               'region_name': 'test_pod',
+               'az_name': 'test_az_uuid'}
+        api.create_pod(self.context, pod)
+        with self.context.session.begin():
+            pod_obj = core.get_resource_object(self.context, models.Pod,
+                                               'test_pod_uuid')
+            self.context.session.expire(pod_obj, ['region_name'])
+            self.assertNotIn('region_name', pod_obj.__dict__)
+            self.assertEqual('test_pod', pod_obj.to_dict()['region_name'])
 
     def test_create(self):
         pod = {'pod_id': 'test_pod_uuid',
@@ -212,6 +233,216 @@ class ModelsTest(unittest.TestCase):
                              sorts=[(models.Pod.pod_id, False)])
         self.assertEqual(pods, [pod3, pod2, pod1])
 
+    def _create_pods(self, num):
+        pods = []
+        for i in range(num):
+            pod = {'pod_id': 'test_pod%d_uuid' % i,
+                   'region_name': 'test_pod%d' % i,
+                   'pod_az_name': 'test_pod_az_name%d' % i,
+                   'dc_name': 'test_dc_name%d' % (i % 2),
+                   'az_name': 'test_az%d_uuid' % i}
+            api.create_pod(self.context, pod)
+            pods.append(pod)
+        return pods
+
+    def _query_pod_ids(self, filters, sorts=None, **kwargs):
+        with self.context.session.begin():
+            pods = core.query_resource(self.context, models.Pod, filters,
+                                       sorts or [(models.Pod.pod_id, True)],
+                                       **kwargs)
+        return [pod['pod_id'] for pod in pods]
+
+    def test_query_comparators(self):
+        self._create_pods(4)
+        # region name containing like wildcard
+        api.create_pod(self.context, {'pod_id': 'test_pod_uuid',
+                                      'region_name': 'test_%od',
+                                      'az_name': ''})
+
+        def _filter(key, comparator, value):
+            return [{'key': key, 'comparator': comparator, 'value': value}]
+
+        self.assertEqual(['test_pod0_uuid', 'test_pod2_uuid'],
+                         self._query_pod_ids(
+                             _filter('dc_name', 'eq', 'test_dc_name0')))
+        self.assertEqual(['test_pod1_uuid', 'test_pod3_uuid'],
+                         self._query_pod_ids(
+                             _filter('dc_name', 'ne', 'test_dc_name0')))
+        self.assertEqual(['test_pod1_uuid', 'test_pod3_uuid'],
+                         self._query_pod_ids(
+                             _filter('pod_id', 'in', ['test_pod1_uuid',
+                                                      'test_pod3_uuid'])))
+        self.assertEqual([], self._query_pod_ids(_filter('pod_id', 'in', [])))
+        self.assertEqual(['test_pod2_uuid', 'test_pod3_uuid',
+                          'test_pod_uuid'],
+                         self._query_pod_ids(
+                             _filter('pod_id', 'nin', ['test_pod0_uuid',
+                                                       'test_pod1_uuid'])))
+        self.assertEqual(['test_pod0_uuid', 'test_pod1_uuid'],
+                         self._query_pod_ids(
+                             _filter('pod_id', 'lt', 'test_pod2_uuid')))
+        self.assertEqual(['test_pod3_uuid', 'test_pod_uuid'],
+                         self._query_pod_ids(
+                             _filter('pod_id', 'gt', 'test_pod2_uuid')))
+        self.assertEqual(['test_pod2_uuid', 'test_pod3_uuid',
+                          'test_pod_uuid'],
+                         self._query_pod_ids(
+                             _filter('pod_id', 'gte', 'test_pod2_uuid')))
+        self.assertEqual(['test_pod1_uuid'],
+                         self._query_pod_ids(
+                             _filter('region_name', 'like', '%1')))
+        self.assertEqual(['test_pod_uuid'],
+                         self._query_pod_ids(
+                             _filter('region_name', 'prefix', 'test_%')))
+        # unknown comparators and keys are ignored
+        self.assertEqual(5, len(self._query_pod_ids(
+            _filter('region_name', 'unknown', 'test_pod0'))))
+        self.assertEqual(5, len(self._query_pod_ids(
+            _filter('unknown', 'eq', 'test_pod0'))))
+        # filters are combined
+        self.assertEqual(['test_pod2_uuid'], self._query_pod_ids(
+            _filter('dc_name', 'eq', 'test_dc_name0') + _filter(
+                'pod_id', 'gt', 'test_pod0_uuid')))
+
+    def test_query_pagination(self):
+        self._create_pods(5)
+        self.assertEqual(['test_pod0_uuid', 'test_pod1_uuid'],
+                         self._query_pod_ids([], limit=2))
+        self.assertEqual(['test_pod2_uuid', 'test_pod3_uuid'],
+                         self._query_pod_ids([], limit=2,
+                                             marker='test_pod1_uuid'))
+        self.assertEqual(['test_pod4_uuid'],
+                         self._query_pod_ids([], limit=2,
+                                             marker='test_pod3_uuid'))
+        self.assertEqual([], self._query_pod_ids([], limit=2,
+                                                 marker='test_pod4_uuid'))
+        # descending order, primary key is appended as tie breaker
+        self.assertEqual(['test_pod3_uuid', 'test_pod1_uuid'],
+                         self._query_pod_ids(
+                             [], sorts=[(models.Pod.dc_name, False)], limit=2))
+        self.assertEqual(['test_pod4_uuid', 'test_pod2_uuid'],
+                         self._query_pod_ids(
+                             [], sorts=[(models.Pod.dc_name, False)], limit=2,
+                             marker='test_pod1_uuid'))
+        # pagination works together with filters
+        filters = [{'key': 'dc_name', 'comparator': 'eq',
+                    'value': 'test_dc_name0'}]
+        self.assertEqual(['test_pod2_uuid', 'test_pod4_uuid'],
+                         self._query_pod_ids(filters, limit=2,
+                                             marker='test_pod0_uuid'))
+        self.assertRaises(exceptions.ResourceNotFound, self._query_pod_ids,
+                          [], limit=2, marker='test_pod9_uuid')
+
+    def test_query_fields(self):
+        pods = self._create_pods(2)
+        with self.context.session.begin():
+            ret = core.query_resource(
+                self.context, models.Pod, [], [(models.Pod.pod_id, True)],
+                fields=['pod_id', 'region_name', 'unknown'])
+        self.assertEqual([{'pod_id': pod['pod_id'],
+                           'region_name': pod['region_name']}
+                          for pod in pods], ret)
+
+    def test_iter_resources(self):
+        pods = self._create_pods(5)
+        filters = [{'key': 'dc_name', 'comparator': 'eq',
+                    'value': 'test_dc_name0'}]
+        with self.context.session.begin():
+            ret = core.iter_resources(self.context, models.Pod, filters,
+                                      [(models.Pod.pod_id, False)],
+                                      batch_size=2)
+            self.assertNotIsInstance(ret, list)
+            self.assertEqual([pods[4], pods[2], pods[0]], list(ret))
+            ret = core.iter_resources(self.context, models.Pod, [],
+                                      [(models.Pod.pod_id, True)],
+                                      batch_size=2, fields=['pod_id'])
+            self.assertEqual([{'pod_id': pod['pod_id']} for pod in pods],
+                             list(ret))
+
+    def _create_routings(self, num):
+        rows = [{'top_id': 'top_uuid_%d' % i,
+                 'bottom_id': 'bottom_uuid_%d' % i,
+                 'pod_id': 'test_pod_uuid',
+                 'project_id': 'project_id',
+                 'resource_type': 'port'} for i in range(num)]
+        api.create_pod(self.context, {'pod_id': 'test_pod_uuid',
+                                      'region_name': 'test_pod',
+                                      'az_name': 'test_az_uuid'})
+        with self.context.session.begin():
+            self.context.session.execute(
+                models.ResourceRouting.__table__.insert(), rows)
+
+    @staticmethod
+    def _naive_to_dict(obj):
+        d = {}
+        for attr in obj.__class__.attributes:
+            d[attr] = getattr(obj, attr)
+        return d
+
+    def test_to_dict(self):
+        num = 100
+        self._create_routings(num)
+        with self.context.session.begin():
+            objs = self.context.session.query(models.ResourceRouting).all()
+            naive_routings = [self._naive_to_dict(obj) for obj in objs]
+            routings = [obj.to_dict() for obj in objs]
+            query_routings = core.query_resource(
+                self.context, models.ResourceRouting, [], [])
+
+        # reading the instance dict and reading column tuples give the same
+        # dicts as reading the attributes of ORM objects
+        self.assertEqual(num, len(routings))
+        self.assertEqual(naive_routings, routings)
+        self.assertEqual(sorted(routings, key=lambda r: r['id']),
+                         sorted(query_routings, key=lambda r: r['id']))
+
+    @test_utils.benchmark
+    def test_to_dict_benchmark(self):
+        num = 100000
+        self._create_routings(num)
+
+        def _measure(func, objs, repeat=3):
+            # take the best of several runs to reduce noise
+            best = None
+            for _ in range(repeat):
+                start = time.time()
+                ret = [func(obj) for obj in objs]
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return ret, best
+
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with self.context.session.begin():
+                objs = self.context.session.query(
+                    models.ResourceRouting).all()
+                naive_routings, naive_time = _measure(self._naive_to_dict,
+                                                      objs)
+                routings, to_dict_time = _measure(
+                    models.ResourceRouting.to_dict, objs)
+                del objs
+
+                start = time.time()
+                orm_routings = [
+                    obj.to_dict() for obj in self.context.session.query(
+                        models.ResourceRouting)]
+                orm_query_time = time.time() - start
+                start = time.time()
+                query_routings = core.query_resource(
+                    self.context, models.ResourceRouting, [], [])
+                query_time = time.time() - start
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        self.assertEqual(num, len(routings))
+        self.assertEqual(naive_routings, routings)
+        self.assertEqual(orm_routings, query_routings)
+        print('%d resource routings: naive to_dict %.3fs, to_dict %.3fs, '
+              'ORM query and to_dict %.3fs, core.query_resource %.3fs' % (
+                  num, naive_time, to_dict_time, orm_query_time, query_time))
+
     def test_resources(self):
         """Create all the resources to test model definition"""
         try:
@@ -0,0 +1,122 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import re
+import unittest
+
+from oslo_config import cfg
+import sqlalchemy as sql
+
+from tricircle.common import constants
+from tricircle.common import context
+from tricircle.common import xrpcapi
+from tricircle.db import api
+from tricircle.db import core
+
+
+class QueryPlanTest(unittest.TestCase):
+    """Make sure hot queries are served by indexes instead of full scans"""
+
+    def setUp(self):
+        core.initialize()
+        core.ModelBase.metadata.create_all(core.get_engine())
+        self.context = context.Context()
+        self.engine = core.get_engine()
+        self.statements = []
+
+    def _before_execute(self, conn, cursor, statement, parameters, *args):
+        if statement.lstrip().upper().startswith('SELECT') and (
+                'FROM' in statement):
+            self.statements.append((statement, parameters))
+
+    def _capture_statements(self, func, *args, **kwargs):
+        self.statements = []
+        sql.event.listen(self.engine, 'before_cursor_execute',
+                         self._before_execute)
+        try:
+            func(*args, **kwargs)
+        finally:
+            sql.event.remove(self.engine, 'before_cursor_execute',
+                             self._before_execute)
+        self.assertTrue(self.statements)
+        return self.statements
+
+    def _explain(self, statement, parameters):
+        dialect = self.engine.dialect.name
+        if dialect == 'sqlite':
+            rows = self.engine.execute('EXPLAIN QUERY PLAN ' + statement,
+                                       parameters)
+            # the last column is the plan detail
+            return [row[-1] for row in rows]
+        elif dialect == 'mysql':
+            rows = self.engine.execute('EXPLAIN ' + statement, parameters)
+            return ['%s %s %s' % (row['table'], row['type'], row['key'])
+                    for row in rows]
+        self.skipTest('Query plan check is not supported for %s' % dialect)
+
+    def _assert_no_full_scan(self, statements, tables, indexes=None):
+        plans = []
+        for statement, parameters in statements:
+            plans.extend(self._explain(statement, parameters))
+        for plan in plans:
+            for table in tables:
+                # sqlite: "SCAN TABLE t" or "SCAN t" without using an index,
+                # mysql: access type "ALL"
+                self.assertIsNone(
+                    re.match(r'^SCAN (TABLE )?%s( AS \w+)?$' % table, plan),
+                    'full scan on %s: %s' % (table, plans))
+                self.assertIsNone(
+                    re.match(r'^%s ALL ' % table, plan),
+                    'full scan on %s: %s' % (table, plans))
+        for index in indexes or []:
+            self.assertTrue([plan for plan in plans if index in plan],
+                            'index %s not used: %s' % (index, plans))
+
+    def test_get_bottom_mappings_by_top_ids(self):
+        statements = self._capture_statements(
+            api.get_bottom_mappings_by_top_ids, self.context,
+            ['top_id1', 'top_id2'], constants.RT_NETWORK)
+        self._assert_no_full_scan(
+            statements, ['resource_routings'],
+            ['resource_routings0top_id0resource_type0pod_id0bottom_id'])
+
+    def test_get_route_by_top_id_pod_id(self):
+        filters = [{'key': 'top_id', 'comparator': 'eq', 'value': 'top_id'},
+                   {'key': 'pod_id', 'comparator': 'eq', 'value': 'pod_id'},
+                   {'key': 'resource_type', 'comparator': 'eq',
+                    'value': constants.RT_PORT}]
+        statements = self._capture_statements(
+            api.list_resource_routings, self.context, filters)
+        self._assert_no_full_scan(statements, ['resource_routings'])
+
+    def test_get_bottom_mappings_by_tenant_pod(self):
+        statements = self._capture_statements(
+            api.get_bottom_mappings_by_tenant_pod, self.context,
+            'project_id', 'pod_id', constants.RT_PORT)
+        self._assert_no_full_scan(
+            statements, ['resource_routings'],
+            ['resource_routings0pod_id0project_id0resource_type'])
+
+    def test_get_latest_failed_or_new_jobs(self):
+        for opt in xrpcapi.xjob_opts:
+            if opt.name == 'redo_time_span':
+                cfg.CONF.register_opt(opt)
+        statements = self._capture_statements(
+            api.get_latest_failed_or_new_jobs, self.context)
+        self._assert_no_full_scan(statements, ['async_jobs'],
+                                  ['async_jobs0type0resource_id0timestamp'])
+
+    def tearDown(self):
+        core.ModelBase.metadata.drop_all(core.get_engine())
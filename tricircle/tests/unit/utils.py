@@ -14,6 +14,8 @@
 #    under the License.
 
 import copy
+import os
+import unittest
 
 from oslo_utils import uuidutils
 import six
@@ -29,6 +31,17 @@ import neutron_lib.context as q_context
 from tricircle.common import constants
 
 
+def benchmark(test):
+    """Skip the benchmark test unless TRICIRCLE_RUN_BENCHMARKS is set
+
+    Benchmarks print their timings and never fail on them, run them with
+    TRICIRCLE_RUN_BENCHMARKS=1 python -m pytest -s -k benchmark
+    """
+    return unittest.skipUnless(
+        os.environ.get('TRICIRCLE_RUN_BENCHMARKS'),
+        'TRICIRCLE_RUN_BENCHMARKS is not set')(test)
+
+
 class ResourceStore(object):
     _resource_list = [('networks', constants.RT_NETWORK),
                       ('subnets', constants.RT_SUBNET),
@@ -582,6 +595,11 @@ class FakeClient(object):
             return res[0]
         return None
 
+    def get_resources_bulk(self, _type, ctx, ids, fields=None):
+        ids = set(ids)
+        return dict((res['id'], res) for res in self._res_map[
+            self.region_name][_type] if res['id'] in ids)
+
     def delete_resources(self, _type, ctx, _id):
         index = -1
         res_list = self._res_map[self.region_name][_type]
@@ -0,0 +1,130 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import six
+import time
+import unittest
+
+from oslo_config import cfg
+
+from tricircle.common import context
+from tricircle.common import exceptions
+from tricircle.db import core
+from tricircle.xjob import fanout
+
+
+class FanoutTest(unittest.TestCase):
+    def setUp(self):
+        self.context = context.Context()
+        self.pods = [{'pod_id': 'pod_id_%d' % i,
+                      'region_name': 'pod_%d' % i} for i in range(4)]
+
+    def test_fanout_results_in_order(self):
+        def func(ctx, pod):
+            # later pods finish first
+            eventlet.sleep(0.01 * (4 - int(pod['pod_id'][-1])))
+            return pod['region_name']
+
+        self.assertEqual(['pod_0', 'pod_1', 'pod_2', 'pod_3'],
+                         fanout.fanout(self.context, func, self.pods))
+        self.assertEqual([], fanout.fanout(self.context, func, []))
+
+    def test_fanout_concurrently(self):
+        def func(ctx, pod):
+            eventlet.sleep(0.2)
+
+        start = time.time()
+        fanout.fanout(self.context, func, self.pods)
+        # serial execution takes 0.8 seconds
+        self.assertLess(time.time() - start, 0.6)
+
+    def test_fanout_pool_size(self):
+        running = []
+        max_running = []
+
+        def func(ctx, pod):
+            running.append(pod)
+            max_running.append(len(running))
+            eventlet.sleep(0.01)
+            running.remove(pod)
+
+        fanout.fanout(self.context, func, self.pods, pool_size=2)
+        self.assertEqual(2, max(max_running))
+
+        del max_running[:]
+        cfg.CONF.set_override('fanout_pool_size', 1)
+        self.addCleanup(cfg.CONF.clear_override, 'fanout_pool_size')
+        fanout.fanout(self.context, func, self.pods)
+        self.assertEqual(1, max(max_running))
+
+    def test_fanout_failures_aggregated(self):
+        called = []
+
+        def func(ctx, pod):
+            called.append(pod['region_name'])
+            if pod['region_name'] in ('pod_1', 'pod_3'):
+                raise exceptions.PodNotFound(region_name=pod['region_name'])
+            return pod['region_name']
+
+        try:
+            fanout.fanout(self.context, func, self.pods)
+        except exceptions.FanoutFailed as e:
+            self.assertEqual(['pod_1', 'pod_3'],
+                             [label for label, _ in e.failures])
+            self.assertIn('2 of 4', six.text_type(e))
+        else:
+            self.fail('FanoutFailed not raised')
+        # one failure doesn't stop operations on other pods
+        self.assertEqual(4, len(called))
+
+    def test_fanout_timeout(self):
+        def func(ctx, pod):
+            if pod['region_name'] == 'pod_2':
+                eventlet.sleep(10)
+            return pod['region_name']
+
+        try:
+            fanout.fanout(self.context, func, self.pods, timeout=0.1)
+        except exceptions.FanoutFailed as e:
+            self.assertEqual(1, len(e.failures))
+            label, error = e.failures[0]
+            self.assertEqual('pod_2', label)
+            self.assertIsInstance(error, exceptions.FanoutTimeout)
+        else:
+            self.fail('FanoutFailed not raised')
+
+    def test_fanout_label(self):
+        def func(ctx, update):
+            raise Exception('update failed')
+
+        updates = [('pod_1', 'routers', 'router_id')]
+        try:
+            fanout.fanout(self.context, func, updates,
+                          label=lambda update: update[2])
+        except exceptions.FanoutFailed as e:
+            self.assertEqual('router_id', e.failures[0][0])
+        else:
+            self.fail('FanoutFailed not raised')
+
+    def test_session_per_green_thread(self):
+        core.initialize()
+
+        def func(ctx, pod):
+            return ctx.session
+
+        sessions = fanout.fanout(self.context, func, self.pods)
+        self.assertEqual(4, len(set([id(session) for session in sessions])))
+        self.assertIs(self.context.session, self.context.session)
@@ -0,0 +1,74 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+from tricircle.common import context
+from tricircle.common import metrics
+from tricircle.xjob import fanout
+from tricircle.xjob import telemetry
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.region_name = 'pod_1'
+
+    def list_ports(self, ctx, filters=None):
+        return []
+
+
+class TelemetryTest(unittest.TestCase):
+    def setUp(self):
+        telemetry.reset()
+        self.addCleanup(telemetry.reset)
+        self.addCleanup(telemetry.set_job_type, None)
+
+    def test_observe(self):
+        for seconds in (0.005, 0.2, 0.2, 4000):
+            telemetry.observe('router', metrics.EXECUTION, seconds)
+        telemetry.increment('router', metrics.SUCCESS)
+        telemetry.increment('router', metrics.SUCCESS)
+        telemetry.increment('router', metrics.LOCK_FAIL)
+
+        stats = telemetry.get_stats()['router']
+        histogram = stats['timers'][metrics.EXECUTION]
+        self.assertEqual(4, histogram['count'])
+        self.assertAlmostEqual(4000.405, histogram['sum'])
+        # buckets are cumulative, 4000 seconds only falls into +Inf
+        self.assertEqual([1, 1, 1, 3, 3, 3, 3, 3, 3, 3, 3, 4],
+                         histogram['buckets'])
+        self.assertEqual(0, stats['timers'][metrics.QUEUE_WAIT]['count'])
+        self.assertEqual(2, stats['counters'][metrics.SUCCESS])
+        self.assertEqual(1, stats['counters'][metrics.LOCK_FAIL])
+        self.assertEqual(0, stats['counters'][metrics.FAIL])
+
+    def test_timed_client(self):
+        client = telemetry.TimedClient(FakeClient(), 'pod_1')
+        self.assertEqual('pod_1', client.region_name)
+        # calls outside job handlers are not recorded
+        self.assertEqual([], client.list_ports(None))
+        self.assertEqual({}, telemetry.get_stats())
+
+        telemetry.set_job_type('router')
+        client.list_ports(None)
+        self.assertEqual(1, telemetry.get_stats()['router']['pod_calls'][
+            'pod_1']['count'])
+
+        # job type is passed to green threads spawned by fanout
+        fanout.fanout(context.Context(),
+                      lambda ctx, item: client.list_ports(ctx),
+                      ['a', 'b', 'c'], pool_size=3)
+        self.assertEqual(4, telemetry.get_stats()['router']['pod_calls'][
+            'pod_1']['count'])
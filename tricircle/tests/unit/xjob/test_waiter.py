@@ -0,0 +1,31 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import unittest
+
+from tricircle.xjob import waiter
+
+JOB_TYPE = 'fake_resource'
+
+
+class WaiterTest(unittest.TestCase):
+    def test_wait(self):
+        eventlet.spawn_after(0.1, waiter.notify, JOB_TYPE, 'fake_id')
+        self.assertTrue(waiter.wait(JOB_TYPE, 'fake_id', 10))
+        self.assertFalse(waiter.wait(JOB_TYPE, 'fake_id', 0.1))
+        # notifying resources nobody waits for is a no-op
+        waiter.notify(JOB_TYPE, 'other_id')
+        self.assertEqual({}, waiter._waiters)
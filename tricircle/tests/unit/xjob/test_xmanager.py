@@ -13,24 +13,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import copy
 import datetime
+import eventlet
 import mock
 from mock import patch
+import netaddr
+import os
+import shutil
 import six
 from six.moves import xrange
+import tempfile
+import time
 import unittest
 
 import neutron_lib.constants as q_constants
 from oslo_config import cfg
+from oslo_utils import timeutils
 from oslo_utils import uuidutils
 
 from tricircle.common import constants
 from tricircle.common import context
+from tricircle.common import metrics
+from tricircle.common import xrpcapi
 import tricircle.db.api as db_api
 from tricircle.db import core
 from tricircle.db import models
 from tricircle.network import helper
+from tricircle.xjob import telemetry
+from tricircle.xjob import waiter
 from tricircle.xjob import xmanager
 from tricircle.xjob import xservice
 
@@ -92,6 +104,9 @@ class FakeXJobAPI(object):
     def setup_shadow_ports(self, ctx, pod_id, t_net_id):
         pass
 
+    def notify_job_done(self, ctx, job_type, resource_id):
+        pass
+
 
 class FakeClient(object):
     def __init__(self, region_name=None):
@@ -119,6 +134,11 @@ class FakeClient(object):
                 res_list.append(copy.copy(res))
         return res_list
 
+    def get_resources_bulk(self, resource, cxt, ids, fields=None):
+        res_list = self.list_resources(
+            resource, cxt, [{'key': 'id', 'comparator': 'eq', 'value': ids}])
+        return dict((res['id'], res) for res in res_list)
+
     def create_resources(self, resource, cxt, body):
         res = body[resource]
         if 'id' not in res:
@@ -200,7 +220,15 @@ class XManagerTest(unittest.TestCase):
         core.get_engine().execute('pragma foreign_keys=on')
         for opt in xservice.common_opts:
             if opt.name in ('worker_handle_timeout', 'job_run_expire',
-                            'worker_sleep_time', 'redo_time_span'):
+                            'worker_sleep_time', 'max_redo_jobs_per_run',
+                            'job_lease_time', 'host',
+                            'job_log_retention_time',
+                            'job_log_purge_batch_size',
+                            'enable_incremental_route_config',
+                            'route_full_sync_interval',
+                            'enable_route_aggregation',
+                            'job_stats_prometheus_file',
+                            'job_lock_wait_timeout'):
                 cfg.CONF.register_opt(opt)
         self.context = context.Context()
         self.xmanager = FakeXManager()
@@ -444,6 +472,167 @@ class XManagerTest(unittest.TestCase):
             calls.append(call)
         self._check_extra_routes_calls(calls, mock_update.call_args_list)
 
+    @patch.object(FakeClient, 'update_routers')
+    def test_configure_route_incremental(self, mock_update):
+        cfg.CONF.set_override('enable_incremental_route_config', True)
+        self.addCleanup(cfg.CONF.clear_override,
+                        'enable_incremental_route_config')
+        top_router_id = 'router_id'
+        project_id = uuidutils.generate_uuid()
+        bridge_infos = self._prepare_east_west_network_test(top_router_id)
+
+        def configure_route():
+            mock_update.reset_mock()
+            db_api.new_job(self.context, project_id,
+                           constants.JT_CONFIGURE_ROUTE, top_router_id)
+            self.xmanager.configure_route(
+                self.context,
+                payload={constants.JT_CONFIGURE_ROUTE: top_router_id})
+
+        configure_route()
+        self.assertEqual(2, mock_update.call_count)
+
+        # routes are not changed, nothing is pushed
+        configure_route()
+        self.assertFalse(mock_update.called)
+
+        # new vm port in pod1 only changes routes of the router in pod2
+        RES_MAP['pod_1']['port'].append({
+            'id': 'vm_port_3_id',
+            'network_id': 'network_1_id',
+            'device_id': 'vm3_id',
+            'device_owner': 'compute:None',
+            'fixed_ips': [{'subnet_id': 'subnet_1_id',
+                           'ip_address': '10.0.1.4'}]})
+        configure_route()
+        routes = [{'nexthop': bridge_infos[0]['bridge_ip'],
+                   'destination': ip + '/32'}
+                  for ip in bridge_infos[0]['vm_ips'] + ['10.0.1.4']]
+        self.assertEqual(1, mock_update.call_count)
+        self._check_extra_routes_calls(
+            [mock.call(self.context, bridge_infos[1]['router_id'],
+                       {'router': {'routes': routes}})],
+            mock_update.call_args_list)
+
+        # routes are pushed again after the full sync interval
+        cfg.CONF.set_override('route_full_sync_interval', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'route_full_sync_interval')
+        configure_route()
+        self.assertEqual(2, mock_update.call_count)
+
+        cfg.CONF.set_override('route_full_sync_interval', 3600)
+        cfg.CONF.set_override('enable_incremental_route_config', False)
+        configure_route()
+        self.assertEqual(2, mock_update.call_count)
+
+    @patch.object(FakeClient, 'update_routers')
+    def test_configure_route_aggregation(self, mock_update):
+        cfg.CONF.set_override('enable_route_aggregation', True)
+        self.addCleanup(cfg.CONF.clear_override, 'enable_route_aggregation')
+        top_router_id = 'router_id'
+        project_id = uuidutils.generate_uuid()
+        bridge_infos = self._prepare_east_west_network_test(top_router_id)
+        db_api.new_job(self.context, project_id, constants.JT_CONFIGURE_ROUTE,
+                       top_router_id)
+        self.xmanager.configure_route(
+            self.context,
+            payload={constants.JT_CONFIGURE_ROUTE: top_router_id})
+        # vm ports of a subnet all live in the same pod, so one route to the
+        # subnet cidr is enough
+        calls = [
+            mock.call(self.context, bridge_infos[0]['router_id'],
+                      {'router': {'routes': [
+                          {'nexthop': bridge_infos[1]['bridge_ip'],
+                           'destination': '10.0.2.0/24'}]}}),
+            mock.call(self.context, bridge_infos[1]['router_id'],
+                      {'router': {'routes': [
+                          {'nexthop': bridge_infos[0]['bridge_ip'],
+                           'destination': '10.0.1.0/24'},
+                          {'nexthop': bridge_infos[0]['bridge_ip'],
+                           'destination': '10.0.3.0/24'}]}})]
+        self.assertEqual(2, mock_update.call_count)
+        self._check_extra_routes_calls(calls, mock_update.call_args_list)
+
+    def test_get_extra_routes_aggregation_benchmark(self):
+        # 10k vm ports in 40 subnets, ports of the first 20 subnets live in
+        # pod1, ports of the other 20 subnets are spread to pod1 and pod2,
+        # one of the spread subnets is also attached to the local router
+        nexthop1, nexthop2 = '100.0.1.3', '100.0.1.4'
+        cidr_nexthop_ips_map = {}
+        ip_nexthop_map = {}
+        for i in xrange(40):
+            cidr = '10.1.%d.0/24' % i
+            ips = ['10.1.%d.%d' % (i, j) for j in xrange(2, 252)]
+            if i < 20:
+                cidr_nexthop_ips_map[cidr] = {nexthop1: ips}
+            else:
+                cidr_nexthop_ips_map[cidr] = {nexthop1: ips[:125],
+                                              nexthop2: ips[125:]}
+            for nexthop, _ips in six.iteritems(cidr_nexthop_ips_map[cidr]):
+                for ip in _ips:
+                    ip_nexthop_map[ip] = nexthop
+        self.assertEqual(10000, len(ip_nexthop_map))
+        local_cidrs = {'10.1.39.0/24': []}
+
+        routes = xmanager.XManager._get_extra_routes(cidr_nexthop_ips_map,
+                                                     local_cidrs)
+        self.assertEqual(10000, len(routes))
+
+        cfg.CONF.set_override('enable_route_aggregation', True)
+        self.addCleanup(cfg.CONF.clear_override, 'enable_route_aggregation')
+        start = time.time()
+        routes = xmanager.XManager._get_extra_routes(cidr_nexthop_ips_map,
+                                                     local_cidrs)
+        elapsed = time.time() - start
+        # 20 subnet routes plus 17 merged routes for each spread subnet
+        self.assertEqual(360, len(routes), 'aggregated in %fs' % elapsed)
+        self.assertNotIn('10.1.39.0/24',
+                         [route['destination'] for route in routes])
+
+        # every vm port is still routed to its own nexthop
+        nexthop_ip_set_map = collections.defaultdict(netaddr.IPSet)
+        for route in routes:
+            nexthop_ip_set_map[route['nexthop']].add(route['destination'])
+        self.assertFalse(nexthop_ip_set_map[nexthop1] &
+                         nexthop_ip_set_map[nexthop2])
+        for ip, nexthop in six.iteritems(ip_nexthop_map):
+            self.assertIn(ip, nexthop_ip_set_map[nexthop])
+
+    @patch.object(FakeClient, 'update_subnets')
+    def test_update_subnet_drops_route_digest(self, mock_update):
+        b_pod = {'pod_id': 'pod_id_1', 'region_name': 'pod_1',
+                 'az_name': 'az_name_1'}
+        db_api.create_pod(self.context, b_pod)
+        t_subnet = {'id': 'subnet_id', 'cidr': '10.0.1.0/24',
+                    'gateway_ip': '10.0.1.1', 'description': '',
+                    'enable_dhcp': True, 'host_routes': [],
+                    'dns_nameservers': [],
+                    'allocation_pools': [{'start': '10.0.1.2',
+                                          'end': '10.0.1.254'}]}
+        RES_MAP['pod_1']['subnet'].append(dict(t_subnet))
+        db_api.create_resource_mapping(self.context, 'subnet_id',
+                                       'subnet_id', 'pod_id_1', 'project_id',
+                                       constants.RT_SUBNET)
+        key = ('pod_1', 'subnets', 'subnet_id')
+        other_key = ('pod_1', 'subnets', 'other_subnet_id')
+        db_api.update_route_digests(self.context, {key: 'digest',
+                                                   other_key: 'digest'})
+
+        self.xmanager._update_bottom_subnet(self.context, b_pod, t_subnet)
+        self.assertTrue(mock_update.called)
+        # host routes are overwritten, so configure_route needs to push them
+        # again
+        self.assertEqual([other_key], list(db_api.get_route_digests(
+            self.context, [key, other_key])))
+
+    def test_route_digest_non_ascii(self):
+        update = ('pod_1', 'subnets', 'subnet_id',
+                  {'subnet': {'host_routes': [
+                      {'destination': u'10.0.1.0/24',
+                       'nexthop': u'nexthop_\u00e9'}]}})
+        digest = self.xmanager._get_route_digest(update)
+        self.assertEqual(40, len(digest))
+
     @patch.object(FakeClient, 'update_subnets')
     @patch.object(FakeClient, 'update_routers')
     def test_configure_extra_routes_ew_gw(self, router_update, subnet_update):
@@ -698,6 +887,83 @@ class XManagerTest(unittest.TestCase):
                                 'security_group_id': sg_id}]})]
         mock_create.assert_has_calls(calls)
 
+    @patch.object(FakeClient, 'delete_security_group_rules')
+    @patch.object(FakeClient, 'create_security_group_rules')
+    def test_configure_security_group_rules_many_rules(self, mock_create,
+                                                       mock_delete):
+        project_id = uuidutils.generate_uuid()
+        sg_id = uuidutils.generate_uuid()
+
+        def build_rule(port, remote_group_id=None, remote_ip_prefix=None):
+            return {'id': uuidutils.generate_uuid(),
+                    'remote_group_id': remote_group_id,
+                    'direction': 'ingress',
+                    'remote_ip_prefix': remote_ip_prefix,
+                    'protocol': 'tcp',
+                    'ethertype': 'IPv4',
+                    'port_range_max': port,
+                    'port_range_min': port,
+                    'security_group_id': sg_id}
+
+        # 3 rules with remote group extended to 100 subnets, plus 50 rules
+        # without remote group
+        t_rules = [build_rule(port, remote_group_id=sg_id)
+                   for port in xrange(3)]
+        t_rules.extend([build_rule(port) for port in xrange(100, 150)])
+        RES_MAP['top']['security_group'].append(
+            {'id': sg_id, 'tenant_id': project_id, 'name': 'default',
+             'security_group_rules': t_rules})
+        for i in xrange(100):
+            RES_MAP['top']['subnet'].append(
+                {'id': 'subnet_%d_id' % i, 'tenant_id': project_id,
+                 'cidr': '10.%d.0.0/24' % i,
+                 'ip_version': q_constants.IP_VERSION_4})
+
+        # bottom security group has half of the rules and 10 stale rules
+        b_rules = [build_rule(port) for port in xrange(100, 125)]
+        b_rules.extend([build_rule(0, remote_ip_prefix='10.%d.0.0/24' % i)
+                        for i in xrange(50)])
+        stale_rules = [build_rule(port) for port in xrange(200, 210)]
+        b_rules.extend(stale_rules)
+        for i in xrange(1, 3):
+            pod_dict = {'pod_id': 'pod_id_%d' % i,
+                        'region_name': 'pod_%d' % i,
+                        'az_name': 'az_name_%d' % i}
+            db_api.create_pod(self.context, pod_dict)
+            RES_MAP['pod_%d' % i]['security_group'].append(
+                {'id': sg_id, 'name': 'default',
+                 'security_group_rules': b_rules})
+            route = {'top_id': sg_id, 'bottom_id': sg_id,
+                     'pod_id': pod_dict['pod_id'],
+                     'resource_type': 'security_group'}
+            with self.context.session.begin():
+                core.create_resource(self.context, models.ResourceRouting,
+                                     route)
+
+        db_api.new_job(self.context, project_id, constants.JT_SEG_RULE_SETUP,
+                       project_id)
+        with patch.object(FakeClient, 'list_subnets',
+                          side_effect=FakeClient('top').list_subnets) as (
+                mock_list_subnets):
+            self.xmanager.configure_security_group_rules(
+                self.context,
+                payload={constants.JT_SEG_RULE_SETUP: project_id})
+
+        # subnets are queried once for all rules with remote group
+        self.assertEqual(1, mock_list_subnets.call_count)
+        six.assertCountEqual(
+            self, [rule['id'] for rule in stale_rules] * 2,
+            [call_arg[0][1] for call_arg in mock_delete.call_args_list])
+        self.assertEqual(2, mock_create.call_count)
+        for call_arg in mock_create.call_args_list:
+            add_rules = call_arg[0][1]['security_group_rules']
+            # 250 rules with remote group not created yet and 25 rules
+            # without remote group not created yet
+            self.assertEqual(275, len(add_rules))
+            self.assertEqual(275, len(set(
+                (rule['remote_ip_prefix'],
+                 rule['port_range_min']) for rule in add_rules)))
+
     @patch.object(FakeClient, 'delete_security_group_rules')
     @patch.object(FakeClient, 'create_security_group_rules')
     def test_configure_security_group_rules_duplicated_cidr(self, mock_create,
@@ -903,6 +1169,59 @@ class XManagerTest(unittest.TestCase):
         self.assertEqual(fake_id, logs[0]['resource_id'])
         self.assertEqual(job_type, logs[0]['type'])
 
+    def test_job_handle_telemetry(self):
+        telemetry.reset()
+        self.addCleanup(telemetry.reset)
+        job_type = 'fake_resource'
+
+        @xmanager._job_handle(job_type)
+        def fake_handle(self, ctx, payload):
+            if payload[job_type] == 'fail_id':
+                raise Exception()
+
+        fake_project_id = uuidutils.generate_uuid()
+        for fake_id in ('fake_id', 'fail_id'):
+            db_api.new_job(self.context, fake_project_id, job_type, fake_id)
+            fake_handle(None, self.context, payload={job_type: fake_id})
+
+        stats = telemetry.get_stats()[job_type]
+        self.assertEqual(1, stats['counters'][metrics.SUCCESS])
+        self.assertEqual(1, stats['counters'][metrics.FAIL])
+        for timer in metrics.TIMERS:
+            self.assertEqual(2, stats['timers'][timer]['count'])
+        self.assertIsNone(telemetry.get_job_type())
+
+        # the job lease is held by another worker
+        cfg.CONF.set_override('job_lock_wait_timeout', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'job_lock_wait_timeout')
+        db_api.new_job(self.context, fake_project_id, job_type, 'fake_id')
+        db_api.claim_job_lease(self.context, job_type, 'fake_id', 'owner',
+                               'host', 60)
+        fake_handle(None, self.context, payload={job_type: 'fake_id'})
+        stats = telemetry.get_stats()[job_type]
+        self.assertEqual(1, stats['counters'][metrics.LOCK_FAIL])
+
+    def test_report_job_stats(self):
+        telemetry.reset()
+        self.addCleanup(telemetry.reset)
+        telemetry.increment(constants.JT_CONFIGURE_ROUTE, metrics.SUCCESS)
+        db_api.update_job_stats(self.context, 'other_worker',
+                                telemetry.get_stats())
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'xjob.prom')
+        cfg.CONF.set_override('job_stats_prometheus_file', path)
+        self.addCleanup(cfg.CONF.clear_override, 'job_stats_prometheus_file')
+
+        self.xmanager.report_job_stats(self.context)
+        job_stats = db_api.list_job_stats(self.context)
+        self.assertEqual(2, len(job_stats))
+        with open(path) as f:
+            # statistics of both workers are merged
+            self.assertIn('tricircle_job_total{type="%s",outcome="success"} 2'
+                          % constants.JT_CONFIGURE_ROUTE,
+                          f.read().splitlines())
+
     def test_job_handle_exception(self):
         job_type = 'fake_resource'
 
@@ -953,6 +1272,164 @@ class XManagerTest(unittest.TestCase):
         self.assertEqual(fake_id, logs[0]['resource_id'])
         self.assertEqual(job_type, logs[0]['type'])
 
+    def test_job_handle_lease(self):
+        job_type = 'fake_resource'
+        handled = []
+
+        @xmanager._job_handle(job_type)
+        def fake_handle(self, ctx, payload):
+            handled.append(payload[job_type])
+
+        fake_id = uuidutils.generate_uuid()
+        fake_project_id = uuidutils.generate_uuid()
+        payload = {job_type: fake_id}
+        db_api.new_job(self.context, fake_project_id, job_type, fake_id)
+        cfg.CONF.set_override('job_lock_wait_timeout', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'job_lock_wait_timeout')
+        # another worker holds a valid lease, the job is left to it
+        self.assertTrue(db_api.claim_job_lease(
+            self.context, job_type, fake_id, 'other_owner', 'other_host',
+            60))
+        fake_handle(None, self.context, payload=payload)
+        self.assertEqual([], handled)
+
+        # the other worker crashes, its lease expires and is taken over
+        core.update_resource(
+            self.context, models.AsyncJobLease, (job_type, fake_id),
+            {'expire_at': datetime.datetime.utcnow() -
+             datetime.timedelta(seconds=1)})
+        fake_handle(None, self.context, payload=payload)
+        self.assertEqual([fake_id], handled)
+        logs = core.query_resource(self.context, models.AsyncJobLog, [], [])
+        self.assertEqual(fake_id, logs[0]['resource_id'])
+        # the lease is released after the job finishes
+        self.assertEqual(
+            [], core.query_resource(self.context, models.AsyncJobLease, [],
+                                    []))
+
+    def test_job_handle_recheck_after_release(self):
+        job_type = 'fake_resource'
+        handled = []
+
+        @xmanager._job_handle(job_type)
+        def fake_handle(self, ctx, payload):
+            handled.append(payload[job_type])
+
+        fake_id = uuidutils.generate_uuid()
+        fake_project_id = uuidutils.generate_uuid()
+        payload = {job_type: fake_id}
+        db_api.new_job(self.context, fake_project_id, job_type, fake_id)
+        cfg.CONF.set_override('job_lock_wait_timeout', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'job_lock_wait_timeout')
+        release_job_lease = db_api.release_job_lease
+
+        def fake_release(ctx, *args):
+            if len(handled) == 1:
+                # a new job is created after the last check of the lease
+                # holder, the worker triggered by it fails to claim the lease
+                # and leaves the job to the holder
+                job = db_api.new_job(self.context, fake_project_id, job_type,
+                                     fake_id)
+                core.update_resource(
+                    self.context, models.AsyncJob, job['id'],
+                    {'timestamp': datetime.datetime.utcnow() +
+                     datetime.timedelta(seconds=10)})
+            release_job_lease(ctx, *args)
+
+        with patch.object(db_api, 'release_job_lease',
+                          side_effect=fake_release):
+            fake_handle(None, self.context, payload=payload)
+        # the lease holder checks again after releasing the lease
+        self.assertEqual([fake_id, fake_id], handled)
+        self.assertEqual(
+            [], core.query_resource(self.context, models.AsyncJobLease, [],
+                                    []))
+
+    def _wait_handled(self, handled, timeout=10):
+        start_time = time.time()
+        while not handled and time.time() - start_time < timeout:
+            eventlet.sleep(0.05)
+
+    def test_job_handle_lock_wait(self):
+        telemetry.reset()
+        self.addCleanup(telemetry.reset)
+        job_type = 'fake_resource'
+        handled = []
+
+        @xmanager._job_handle(job_type)
+        def fake_handle(self, ctx, payload):
+            handled.append(payload[job_type])
+
+        fake_id = uuidutils.generate_uuid()
+        fake_project_id = uuidutils.generate_uuid()
+        payload = {job_type: fake_id}
+        db_api.new_job(self.context, fake_project_id, job_type, fake_id)
+        self.assertTrue(db_api.claim_job_lease(
+            self.context, job_type, fake_id, 'other_owner', 'other_host',
+            60))
+
+        def end_other_run():
+            # the run of the other worker ends without seeing the new job
+            db_api.release_job_lease(self.context, job_type, fake_id,
+                                     'other_owner')
+            self.xmanager.job_done(self.context, {job_type: fake_id})
+
+        eventlet.spawn_after(0.1, end_other_run)
+        start_time = time.time()
+        fake_handle(None, self.context, payload=payload)
+        # the handler returns at once and the wait is handed over to a green
+        # thread, only one waiter per resource is spawned
+        self.assertEqual([], handled)
+        self.assertEqual(set([(job_type, fake_id)]), xmanager._lock_waiters)
+        fake_handle(None, self.context, payload=payload)
+        stats = telemetry.get_stats()[job_type]
+        self.assertEqual(1, stats['counters'][metrics.LOCK_FAIL])
+
+        # the job is checked again once the other run ends
+        self._wait_handled(handled)
+        self.assertEqual([fake_id], handled)
+        self.assertLess(time.time() - start_time, 10)
+        self.assertEqual(set(), xmanager._lock_waiters)
+        self.assertEqual({}, waiter._waiters)
+        self.assertEqual(constants.JS_Success, db_api.get_job_result(
+            self.context, job_type, fake_id, datetime.datetime(2000, 1, 1)))
+
+    def test_job_handle_lock_wait_notified_before_wait(self):
+        job_type = 'fake_resource'
+        handled = []
+
+        @xmanager._job_handle(job_type)
+        def fake_handle(self, ctx, payload):
+            handled.append(payload[job_type])
+
+        fake_id = uuidutils.generate_uuid()
+        fake_project_id = uuidutils.generate_uuid()
+        payload = {job_type: fake_id}
+        db_api.new_job(self.context, fake_project_id, job_type, fake_id)
+        self.assertTrue(db_api.claim_job_lease(
+            self.context, job_type, fake_id, 'other_owner', 'other_host',
+            60))
+        claim_job_lease = db_api.claim_job_lease
+
+        def fake_claim(ctx, *args):
+            claimed = claim_job_lease(ctx, *args)
+            if not claimed:
+                # the other run ends right after the failed claim
+                db_api.release_job_lease(self.context, job_type, fake_id,
+                                         'other_owner')
+                self.xmanager.job_done(self.context, {job_type: fake_id})
+            return claimed
+
+        cfg.CONF.set_override('job_lock_wait_timeout', 5)
+        self.addCleanup(cfg.CONF.clear_override, 'job_lock_wait_timeout')
+        start_time = time.time()
+        with patch.object(db_api, 'claim_job_lease', side_effect=fake_claim):
+            fake_handle(None, self.context, payload=payload)
+            self._wait_handled(handled)
+        # the notification is not lost, no need to wait until timeout
+        self.assertEqual([fake_id], handled)
+        self.assertLess(time.time() - start_time, 3)
+
     @patch.object(db_api, 'get_running_job')
     @patch.object(db_api, 'register_job')
     def test_worker_handle_timeout(self, mock_register, mock_get):
@@ -1025,6 +1502,184 @@ class XManagerTest(unittest.TestCase):
         six.assertCountEqual(self, expected_failed_jobs, failed_jobs)
         six.assertCountEqual(self, expected_new_jobs, new_jobs)
 
+    @patch('oslo_utils.timeutils.utcnow')
+    def test_redo_failed_or_new_job(self, mock_now):
+        mock_now.return_value = datetime.datetime(2000, 1, 2, 12, 0, 0)
+        # (project_id, type, resource_id, minutes before now, status)
+        job_list = [
+            ('project1', constants.JT_RESOURCE_RECYCLE, 'res1', 30,
+             constants.JS_New),
+            ('project1', constants.JT_PORT_DELETE, 'res2', 10,
+             constants.JS_New),
+            ('project1', constants.JT_PORT_DELETE, 'res3', 20,
+             constants.JS_New),
+            ('project1', constants.JT_CONFIGURE_ROUTE, 'res4', 40,
+             constants.JS_Fail),
+            ('project2', constants.JT_RESOURCE_RECYCLE, 'res5', 5,
+             constants.JS_New),
+            ('project2', constants.JT_SEG_RULE_SETUP, 'res6', 1,
+             constants.JS_New)]
+        for i, (project_id, job_type, resource_id, minutes,
+                status) in enumerate(job_list):
+            core.create_resource(
+                self.context, models.AsyncJob,
+                {'id': 'job_uuid%d' % i, 'extra_id': 'extra_uuid%d' % i,
+                 'project_id': project_id, 'type': job_type,
+                 'resource_id': resource_id, 'status': status,
+                 'timestamp': mock_now.return_value - datetime.timedelta(
+                     minutes=minutes)})
+
+        handled = []
+
+        def fake_handle(ctx, payload):
+            job_type, resource_id = list(payload.items())[0]
+            handled.append((ctx.tenant, resource_id))
+            if resource_id == 'res3':
+                raise Exception('fake exception')
+
+        self.xmanager.job_handles = dict(
+            (job_type, fake_handle) for job_type in constants.job_handles)
+
+        cfg.CONF.set_override('max_redo_jobs_per_run', 4)
+        self.addCleanup(cfg.CONF.clear_override, 'max_redo_jobs_per_run')
+        self.xmanager.redo_failed_or_new_job(self.context)
+        # projects take turns, and in each project jobs are ordered by
+        # priority and age, failing job doesn't stop the queue
+        self.assertEqual([('project1', 'res3'), ('project2', 'res6'),
+                          ('project1', 'res2'), ('project2', 'res5')],
+                         handled)
+        self.assertEqual({'depth': 6, 'new_jobs': 5, 'failed_jobs': 1,
+                          'max_wait_time': 2400, 'avg_wait_time': 1060},
+                         self.xmanager.job_queue_stats)
+
+        del handled[:]
+        cfg.CONF.set_override('max_redo_jobs_per_run', 10)
+        self.xmanager.redo_failed_or_new_job(self.context)
+        # failed jobs are redone after new jobs
+        self.assertEqual(('project1', 'res4'), handled[-1])
+        self.assertEqual(6, len(handled))
+
+    def test_redo_job_sharding(self):
+        cfg.CONF.set_override('enable_job_sharding', True)
+        self.addCleanup(cfg.CONF.clear_override, 'enable_job_sharding')
+        with patch.object(xrpcapi.rpc, 'init'), patch.object(
+                xrpcapi.rpc, 'get_client'):
+            self.xmanager.xjob_handler = xrpcapi.XJobAPI()
+        for i in xrange(20):
+            db_api.new_job(self.context, 'project_id',
+                           constants.JT_CONFIGURE_ROUTE, 'router_id%d' % i)
+        handled = []
+
+        def fake_handle(ctx, payload):
+            handled.extend(payload.values())
+
+        self.xmanager.job_handles = {
+            constants.JT_CONFIGURE_ROUTE: fake_handle}
+        self.xmanager.post_start_hook()
+        db_api.report_xjob_worker(self.context, 'other_host.1', 'other_host')
+        self.assertEqual(
+            sorted([self.xmanager.worker_name, 'other_host.1']),
+            db_api.list_xjob_workers(self.context))
+
+        # only jobs of resources owned by this worker are redone
+        self.xmanager.redo_failed_or_new_job(self.context)
+        self.assertTrue(handled)
+        self.assertLess(len(handled), 20)
+        for resource_id in handled:
+            self.assertEqual(
+                self.xmanager.worker_name,
+                self.xmanager.xjob_handler.get_shard_worker(self.context,
+                                                            resource_id))
+
+        # the other worker leaves, this worker takes over all its jobs
+        db_api.delete_xjob_worker(self.context, 'other_host.1')
+        self.xmanager.xjob_handler._shard_ring_loaded_at = None
+        del handled[:]
+        self.xmanager.redo_failed_or_new_job(self.context)
+        self.assertEqual(20, len(handled))
+
+        self.xmanager.cleanup_host()
+        self.assertEqual([], db_api.list_xjob_workers(self.context))
+
+    @patch.object(xmanager, '_REPORT_WORKER_INTERVAL', 0.2)
+    def test_worker_heartbeat_during_long_redo(self):
+        cfg.CONF.set_override('enable_job_sharding', True)
+        cfg.CONF.set_override('xjob_worker_down_time', 1)
+        self.addCleanup(cfg.CONF.clear_override, 'enable_job_sharding')
+        self.addCleanup(cfg.CONF.clear_override, 'xjob_worker_down_time')
+        with patch.object(xrpcapi.rpc, 'init'), patch.object(
+                xrpcapi.rpc, 'get_client'):
+            self.xmanager.xjob_handler = xrpcapi.XJobAPI()
+        db_api.new_job(self.context, 'project_id',
+                       constants.JT_CONFIGURE_ROUTE, 'router_id')
+        alive = []
+
+        def fake_handle(ctx, payload):
+            # the redo run lasts longer than the worker down time
+            eventlet.sleep(1.5)
+            alive_after = timeutils.utcnow() - datetime.timedelta(
+                seconds=cfg.CONF.xjob_worker_down_time)
+            alive.extend(db_api.list_xjob_workers(self.context, alive_after))
+
+        self.xmanager.job_handles = {
+            constants.JT_CONFIGURE_ROUTE: fake_handle}
+        self.xmanager.post_start_hook()
+        heartbeat = self.xmanager._worker_heartbeat
+        self.addCleanup(heartbeat.stop)
+        self.xmanager.redo_failed_or_new_job(self.context)
+        # the heartbeat is not blocked by the redo run, so the worker stays
+        # in the hash ring
+        self.assertEqual([self.xmanager.worker_name], alive)
+
+        self.xmanager.cleanup_host()
+        self.assertIsNone(self.xmanager._worker_heartbeat)
+
+    def test_serve_job_sharding(self):
+        cfg.CONF.set_override('enable_job_sharding', True)
+        self.addCleanup(cfg.CONF.clear_override, 'enable_job_sharding')
+        self.addCleanup(setattr, xservice, '_launcher', None)
+        fake_service = mock.Mock(manager=self.xmanager)
+        with patch.object(xservice.srv, 'ProcessLauncher') as mock_launcher:
+            xservice.serve(fake_service, 3)
+        launch_service = mock_launcher.return_value.launch_service
+        self.assertEqual(3, launch_service.call_count)
+
+        names = []
+        for call in launch_service.call_args_list:
+            worker = call[0][0]
+            # the launcher starts the same worker again after it dies
+            for _ in xrange(2):
+                worker.start()
+                names.append(self.xmanager.worker_name)
+        self.assertEqual(6, fake_service.start.call_count)
+        host = cfg.CONF.host
+        self.assertEqual(['%s.0' % host, '%s.0' % host,
+                          '%s.1' % host, '%s.1' % host,
+                          '%s.2' % host, '%s.2' % host], names)
+
+    @patch('oslo_utils.timeutils.utcnow')
+    def test_purge_job_logs(self, mock_now):
+        mock_now.return_value = datetime.datetime(2000, 1, 10, 12, 0, 0)
+        for i in xrange(1, 6):
+            core.create_resource(
+                self.context, models.AsyncJobLog,
+                {'id': 'log_uuid%d' % i, 'project_id': 'uuid1',
+                 'resource_id': 'uuid%d' % i, 'type': 'res%d' % i,
+                 'timestamp': datetime.datetime(2000, 1, 10 - i, 12, 0, 0)})
+
+        # retention is disabled by default
+        self.xmanager.purge_job_logs(self.context)
+        self.assertEqual(5, len(db_api.list_jobs_from_log(self.context)))
+
+        cfg.CONF.set_override('job_log_retention_time', 3 * 24 * 3600)
+        cfg.CONF.set_override('job_log_purge_batch_size', 1)
+        self.addCleanup(cfg.CONF.clear_override, 'job_log_retention_time')
+        self.addCleanup(cfg.CONF.clear_override, 'job_log_purge_batch_size')
+        self.xmanager.purge_job_logs(self.context)
+        logs = db_api.list_jobs_from_log(self.context)
+        six.assertCountEqual(self, ['log_uuid1', 'log_uuid2', 'log_uuid3'],
+                             [log['id'] for log in logs])
+
     def tearDown(self):
         core.ModelBase.metadata.drop_all(core.get_engine())
         for res in RES_LIST:
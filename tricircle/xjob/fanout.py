@@ -0,0 +1,107 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from tricircle.common import exceptions
+from tricircle.common.i18n import _
+from tricircle.xjob import telemetry
+
+
+fanout_opts = [
+    cfg.IntOpt('fanout_pool_size', default=8,
+               help=_("Max number of concurrent per pod operations issued "
+                      "by one xjob handler")),
+    cfg.IntOpt('fanout_pod_timeout', default=300,
+               help=_("Timeout in seconds of the operation on one pod when "
+                      "an xjob handler operates on several pods "
+                      "concurrently. Set to 0 to disable the timeout")),
+]
+CONF = cfg.CONF
+CONF.register_opts(fanout_opts)
+
+LOG = logging.getLogger(__name__)
+
+
+def _run(func, ctx, item, label, timeout, job_type=None):
+    if job_type:
+        # client calls in the spawned green thread are recorded for the job
+        telemetry.set_job_type(job_type)
+    try:
+        with eventlet.Timeout(timeout or None):
+            return True, func(ctx, item)
+    except eventlet.Timeout:
+        LOG.error('Operation on %(label)s timed out after %(timeout)s '
+                  'seconds', {'label': label, 'timeout': timeout})
+        return False, exceptions.FanoutTimeout(label=label, timeout=timeout)
+    except Exception as e:
+        LOG.exception('Operation on %(label)s failed', {'label': label})
+        return False, e
+
+
+def fanout(ctx, func, items, label=None, timeout=None, pool_size=None):
+    """Call func(ctx, item) for every item concurrently
+
+    Items are usually pods or per pod operations. Every call runs in its own
+    green thread with a timeout, and all the calls run to completion even if
+    some of them fail, so one unavailable pod doesn't stop the operations on
+    the others.
+
+    :param ctx: context passed to func
+    :param func: function with signature func(ctx, item)
+    :param items: list of items
+    :param label: function to get the name of an item used in logs and
+    errors, region_name of the pod is used by default
+    :param timeout: seconds each call can take, fanout_pod_timeout by default
+    :param pool_size: max number of concurrent calls, fanout_pool_size by
+    default
+    :return: list of results in the order of items
+    :raises: FanoutFailed if any call fails
+    """
+    items = list(items)
+    if not items:
+        return []
+    if label is None:
+        label = _get_region_name
+    if timeout is None:
+        timeout = CONF.fanout_pod_timeout
+    pool_size = min(pool_size or CONF.fanout_pool_size, len(items))
+
+    if pool_size <= 1:
+        outcomes = [_run(func, ctx, item, label(item), timeout)
+                    for item in items]
+    else:
+        pool = eventlet.GreenPool(pool_size)
+        job_type = telemetry.get_job_type()
+        threads = [pool.spawn(_run, func, ctx, item, label(item), timeout,
+                              job_type) for item in items]
+        outcomes = [thread.wait() for thread in threads]
+
+    failures = [(label(item), outcome[1])
+                for item, outcome in zip(items, outcomes) if not outcome[0]]
+    if failures:
+        raise exceptions.FanoutFailed(failures=failures, total=len(items))
+    return [outcome[1] for outcome in outcomes]
+
+
+def _get_region_name(item):
+    if isinstance(item, dict):
+        return item.get('region_name', item.get('pod_id'))
+    if isinstance(item, tuple) and item and isinstance(item[0], dict):
+        return _get_region_name(item[0])
+    return str(item)
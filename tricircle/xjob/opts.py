@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import tricircle.xjob.fanout
 import tricircle.xjob.xservice
 
 
@@ -20,4 +21,5 @@ def list_opts():
     return [
         ('DEFAULT', tricircle.xjob.xservice.common_opts),
         ('DEFAULT', tricircle.xjob.xservice.service_opts),
+        ('DEFAULT', tricircle.xjob.fanout.fanout_opts),
     ]
@@ -0,0 +1,107 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Job execution statistics of xjob workers
+
+Every worker records the following statistics for each job type:
+
+* queue_wait: seconds from the job creation to the job running
+* lock_wait: seconds spent claiming the job lease and registering the
+  running job
+* execution: seconds the job handler runs
+* pod_call: seconds of client calls, per region
+* outcome counters: success, fail, lock_fail, retry, expired and timeout
+
+Statistics are kept in memory in the format described in
+tricircle.common.metrics, which also merges and formats them.
+"""
+
+import copy
+import time
+
+from eventlet import corolocal
+
+from tricircle.common import metrics
+
+_stats = {}
+# job type being handled in the current green thread
+_local = corolocal.local()
+
+
+def set_job_type(job_type):
+    _local.job_type = job_type
+
+
+def get_job_type():
+    return getattr(_local, 'job_type', None)
+
+
+def _get_job_stats(job_type):
+    if job_type not in _stats:
+        _stats[job_type] = {
+            'counters': dict((name, 0) for name in metrics.COUNTERS),
+            'timers': dict((name, metrics.new_histogram())
+                           for name in metrics.TIMERS),
+            'pod_calls': {}}
+    return _stats[job_type]
+
+
+def observe(job_type, timer, seconds):
+    metrics.observe_histogram(_get_job_stats(job_type)['timers'][timer],
+                              max(seconds, 0))
+
+
+def observe_pod_call(region_name, seconds, job_type=None):
+    job_type = job_type or get_job_type()
+    if not job_type:
+        # client calls outside job handlers are not recorded
+        return
+    pod_calls = _get_job_stats(job_type)['pod_calls']
+    if region_name not in pod_calls:
+        pod_calls[region_name] = metrics.new_histogram()
+    metrics.observe_histogram(pod_calls[region_name], seconds)
+
+
+def increment(job_type, counter):
+    _get_job_stats(job_type)['counters'][counter] += 1
+
+
+def get_stats():
+    return copy.deepcopy(_stats)
+
+
+def reset():
+    _stats.clear()
+
+
+class TimedClient(object):
+    """Client wrapper recording the time of every call per region"""
+
+    def __init__(self, client, region_name):
+        self._client = client
+        self._region_name = region_name
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def timed_call(*args, **kwargs):
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                observe_pod_call(self._region_name, time.time() - start)
+        return timed_call
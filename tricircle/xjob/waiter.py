@@ -0,0 +1,84 @@
+# Copyright 2017 Huawei Technologies Co., Ltd.
+# All Rights Reserved
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Job completion notification of xjob workers
+
+When a job handler run for a resource ends, the worker notifies green
+threads waiting for the resource in its own process at once, and the other
+workers by a fanout rpc cast which ends up in notify() of every worker.
+Waiters then check the job state in the database again, so a notification
+is only a hint and missing one only delays the waiter until its timeout.
+"""
+
+import eventlet
+from eventlet import event as e_event
+
+# (job_type, resource_id) -> [event, number of waiters]
+_waiters = {}
+
+
+def notify(job_type, resource_id):
+    """Wake up green threads waiting for job runs of the resource"""
+    waiter = _waiters.pop((job_type, resource_id), None)
+    if waiter:
+        waiter[0].send()
+
+
+def listen(job_type, resource_id):
+    """Start listening for the end of job runs of the resource
+
+    Call it before checking the state waited for, so a notification sent in
+    between is not lost, and call unlisten() when done.
+
+    :return: the waiter to pass to wait_listened() and unlisten()
+    """
+    key = (job_type, resource_id)
+    if key not in _waiters:
+        _waiters[key] = [e_event.Event(), 0]
+    waiter = _waiters[key]
+    waiter[1] += 1
+    return waiter
+
+
+def unlisten(job_type, resource_id, waiter):
+    waiter[1] -= 1
+    key = (job_type, resource_id)
+    if not waiter[1] and _waiters.get(key) is waiter:
+        del _waiters[key]
+
+
+def wait_listened(waiter, timeout):
+    """Wait for a notification to the waiter returned by listen()
+
+    :param timeout: seconds to wait at most
+    :return: True if notified, False if timeout
+    """
+    with eventlet.Timeout(timeout, False):
+        waiter[0].wait()
+        return True
+    return False
+
+
+def wait(job_type, resource_id, timeout):
+    """Wait for the current job run of the resource to end
+
+    :param timeout: seconds to wait at most
+    :return: True if notified, False if timeout
+    """
+    waiter = listen(job_type, resource_id)
+    try:
+        return wait_listened(waiter, timeout)
+    finally:
+        unlisten(job_type, resource_id, waiter)
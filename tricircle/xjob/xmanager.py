@@ -14,17 +14,22 @@
 # limitations under the License.
 
 import collections
+import copy
 import datetime
 import eventlet
+import functools
+import hashlib
 import netaddr
-import random
 import six
 import time
 
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
+from oslo_service import loopingcall
 from oslo_service import periodic_task
+from oslo_utils import timeutils
+from oslo_utils import uuidutils
 
 import neutron_lib.constants as q_constants
 import neutron_lib.exceptions as q_exceptions
@@ -33,97 +38,257 @@ import neutronclient.common.exceptions as q_cli_exceptions
 from tricircle.common import client
 from tricircle.common import constants
 import tricircle.common.context as t_context
+from tricircle.common import metrics
 from tricircle.common import xrpcapi
 import tricircle.db.api as db_api
 import tricircle.network.exceptions as t_network_exc
 from tricircle.network import helper
+from tricircle.xjob import fanout
+from tricircle.xjob import telemetry
+from tricircle.xjob import waiter
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
 IN_TEST = False
+# seconds between two runs of job log purging
+_PURGE_JOB_LOG_INTERVAL = 3600
+# seconds between two reports of job statistics of the worker
+_REPORT_JOB_STATS_INTERVAL = 60
+# statistics of workers not reported within this time are removed
+_JOB_STATS_EXPIRE_TIME = 3600
+# seconds between two heartbeats of the worker for job sharding
+_REPORT_WORKER_INTERVAL = 10
+# max number of green threads waiting for running jobs to end on behalf of
+# workers failing to claim the job lease
+_MAX_LOCK_WAITERS = 100
 AZ_HINTS = 'availability_zone_hints'
 
 
+def _renew_job_lease(job_type, resource_id, owner):
+    # runs in its own green thread, so it uses its own context, the session
+    # of the handler context can not be shared across green threads.
+    # renewal is best effort: if the lease is lost, e.g. the database is not
+    # reachable for longer than job_lease_time, the running handler is not
+    # interrupted since stopping it half way may leave resources in a worse
+    # state. Another worker may then take over the lease and run the same
+    # job concurrently, job handlers are idempotent so the later run fixes
+    # up the result
+    ctx = t_context.get_db_context()
+    while True:
+        eventlet.sleep(CONF.job_lease_time / 3.0)
+        try:
+            if not db_api.renew_job_lease(ctx, job_type, resource_id, owner,
+                                          CONF.job_lease_time):
+                LOG.warning('Lease of job of type %(job_type)s for resource '
+                            '%(resource)s is lost, the running handler is '
+                            'not stopped',
+                            {'job_type': job_type, 'resource': resource_id})
+                return
+        except Exception:
+            LOG.exception('Failed to renew lease of job of type '
+                          '%(job_type)s for resource %(resource)s',
+                          {'job_type': job_type, 'resource': resource_id})
+
+
+def _notify_job_done(manager, ctx, job_type, resource_id):
+    # waiters in this worker are woken up at once, waiters in other workers
+    # by the fanout notification
+    waiter.notify(job_type, resource_id)
+    if not isinstance(manager, XManager):
+        return
+    try:
+        manager.xjob_handler.notify_job_done(ctx, job_type, resource_id)
+    except Exception:
+        LOG.exception('Failed to notify the end of job of type %(job_type)s '
+                      'for resource %(resource)s',
+                      {'job_type': job_type, 'resource': resource_id})
+
+
+# (job_type, resource_id) of the resources having a lock waiter
+_lock_waiters = set()
+
+
+def _wait_lock_and_recheck(job_type, resource_id, lock_waiter, recheck):
+    try:
+        waiter.wait_listened(lock_waiter, CONF.job_lock_wait_timeout)
+    finally:
+        waiter.unlisten(job_type, resource_id, lock_waiter)
+        _lock_waiters.discard((job_type, resource_id))
+    try:
+        recheck()
+    except Exception:
+        LOG.exception('Failed to check job of type %(job_type)s for '
+                      'resource %(resource)s again',
+                      {'job_type': job_type, 'resource': resource_id})
+
+
+def _spawn_lock_waiter(job_type, resource_id, lock_waiter, recheck):
+    # the wait runs in its own green thread so the rpc handler returns at
+    # once and doesn't hold a green thread of the rpc executor. one waiter
+    # per resource is enough since the recheck handles all its new jobs
+    key = (job_type, resource_id)
+    if key in _lock_waiters or len(_lock_waiters) >= _MAX_LOCK_WAITERS:
+        return False
+    _lock_waiters.add(key)
+    eventlet.spawn_n(_wait_lock_and_recheck, job_type, resource_id,
+                     lock_waiter, recheck)
+    return True
+
+
 def _job_handle(job_type):
     def handle_func(func):
-        @six.wraps(func)
-        def handle_args(*args, **kwargs):
-            if IN_TEST:
-                # NOTE(zhiyuan) job mechanism will cause some unpredictable
-                # result in unit test so we would like to bypass it. However
-                # we have problem mocking a decorator which decorates member
-                # functions, that's why we use this label, not an elegant
-                # way though.
-                func(*args, **kwargs)
-                return
+        def run(args, kwargs, lock_waited):
             ctx = args[1]
             payload = kwargs['payload']
 
             resource_id = payload[job_type]
             start_time = datetime.datetime.now()
+            # identify this run, the lease can only be renewed and released
+            # by its owner
+            owner = uuidutils.generate_uuid()
+            heartbeat = None
+            lock_start_time = None
+            claimed = False
+            telemetry.set_job_type(job_type)
 
-            while True:
-                current_time = datetime.datetime.now()
-                delta = current_time - start_time
-                if delta.seconds >= CONF.worker_handle_timeout:
-                    # quit when this handle is running for a long time
-                    break
-                job_new = db_api.get_latest_job(
-                    ctx, constants.JS_New, job_type, resource_id)
-                if not job_new:
-                    break
-                job_succ = db_api.get_latest_job(
-                    ctx, constants.JS_Success, job_type, resource_id)
-                if job_succ and job_succ['timestamp'] >= job_new['timestamp']:
-                    break
-                job = db_api.register_job(ctx, job_new['project_id'], job_type,
-                                          resource_id)
-                if not job:
-                    # fail to obtain the lock, let other worker handle the job
-                    running_job = db_api.get_running_job(ctx, job_type,
-                                                         resource_id)
-                    if not running_job:
-                        # there are two reasons that running_job is None. one
-                        # is that the running job has just been finished, the
-                        # other is that all workers fail to register the job
-                        # due to deadlock exception. so we sleep and try again
-                        eventlet.sleep(CONF.worker_sleep_time)
-                        continue
-                    job_time = running_job['timestamp']
+            try:
+                while True:
                     current_time = datetime.datetime.now()
-                    delta = current_time - job_time
-                    if delta.seconds > CONF.job_run_expire:
-                        # previous running job expires, we set its status to
-                        # fail and try again to obtain the lock
-                        db_api.finish_job(ctx, running_job['id'], False,
-                                          job_new['timestamp'])
-                        LOG.warning('Job %(job)s of type %(job_type)s for '
-                                    'resource %(resource)s expires, set '
-                                    'its state to Fail',
-                                    {'job': running_job['id'],
-                                     'job_type': job_type,
-                                     'resource': resource_id})
+                    delta = current_time - start_time
+                    if delta.seconds >= CONF.worker_handle_timeout:
+                        # quit when this handle is running for a long time
+                        telemetry.increment(job_type, metrics.TIMEOUT)
+                        break
+                    job_new = db_api.get_latest_job(
+                        ctx, constants.JS_New, job_type, resource_id)
+                    if job_new:
+                        job_succ = db_api.get_latest_job(
+                            ctx, constants.JS_Success, job_type, resource_id)
+                        if job_succ and (
+                                job_succ['timestamp'] >= job_new['timestamp']):
+                            job_new = None
+                    if not job_new:
+                        if not heartbeat:
+                            break
+                        # a new job may be created after the check above
+                        # but before the lease is released, and the workers
+                        # failing to claim the lease have left it to us, so
+                        # release the lease and check again
+                        heartbeat.kill()
+                        heartbeat = None
+                        db_api.release_job_lease(ctx, job_type, resource_id,
+                                                 owner)
+                        # a worker claiming the lease after the release
+                        # checks the new job itself, no need to wait for it
+                        lock_waited = True
+                        continue
+                    if lock_start_time is None:
+                        lock_start_time = time.time()
+                    if not heartbeat:
+                        # listen before claiming the lease, so the end of
+                        # the running job notified in between is not lost
+                        lock_waiter = None
+                        if not lock_waited and (
+                                CONF.job_lock_wait_timeout > 0):
+                            lock_waiter = waiter.listen(job_type, resource_id)
+                        handed_over = False
+                        try:
+                            if not db_api.claim_job_lease(
+                                    ctx, job_type, resource_id, owner,
+                                    CONF.host, CONF.job_lease_time):
+                                # another worker holds the lease, it will
+                                # pick up the new job after its current run.
+                                # but the run may be ending without seeing
+                                # the new job, so wait for it to end and
+                                # check again
+                                if lock_waiter:
+                                    recheck = functools.partial(
+                                        run, (args[0], copy.copy(ctx)) +
+                                        args[2:], kwargs, True)
+                                    handed_over = _spawn_lock_waiter(
+                                        job_type, resource_id, lock_waiter,
+                                        recheck)
+                                if not handed_over:
+                                    telemetry.increment(job_type,
+                                                        metrics.LOCK_FAIL)
+                                break
+                        finally:
+                            if lock_waiter and not handed_over:
+                                waiter.unlisten(job_type, resource_id,
+                                                lock_waiter)
+                        heartbeat = eventlet.spawn(
+                            _renew_job_lease, job_type, resource_id, owner)
+                        claimed = True
+                        running_job = db_api.get_running_job(
+                            ctx, job_type, resource_id)
+                        if running_job:
+                            # the lease of the worker running this job has
+                            # expired, so the worker is gone
+                            db_api.finish_job(ctx, running_job['id'], False,
+                                              job_new['timestamp'])
+                            telemetry.increment(job_type, metrics.EXPIRED)
+                            LOG.warning('Job %(job)s of type %(job_type)s '
+                                        'for resource %(resource)s expires, '
+                                        'set its state to Fail',
+                                        {'job': running_job['id'],
+                                         'job_type': job_type,
+                                         'resource': resource_id})
+                    job = db_api.register_job(ctx, job_new['project_id'],
+                                              job_type, resource_id)
+                    if not job:
+                        # the running job record fails to be created due to
+                        # deadlock, we still hold the lease so try again
+                        telemetry.increment(job_type, metrics.RETRY)
                         eventlet.sleep(CONF.worker_sleep_time)
                         continue
-                    else:
-                        # previous running job is still valid, we just leave
-                        # the job to the worker who holds the lock
+                    run_start_time = time.time()
+                    telemetry.observe(job_type, metrics.LOCK_WAIT,
+                                      run_start_time - lock_start_time)
+                    telemetry.observe(job_type, metrics.QUEUE_WAIT, (
+                        timeutils.utcnow() - job_new['timestamp']
+                    ).total_seconds())
+                    lock_start_time = None
+                    try:
+                        func(*args, **kwargs)
+                    except Exception:
+                        telemetry.observe(job_type, metrics.EXECUTION,
+                                          time.time() - run_start_time)
+                        telemetry.increment(job_type, metrics.FAIL)
+                        db_api.finish_job(ctx, job['id'], False,
+                                          job_new['timestamp'])
+                        LOG.error('Job %(job)s of type %(job_type)s for '
+                                  'resource %(resource)s fails',
+                                  {'job': job['id'],
+                                   'job_type': job_type,
+                                   'resource': resource_id})
                         break
-                # successfully obtain the lock, start to execute handler
-                try:
-                    func(*args, **kwargs)
-                except Exception:
-                    db_api.finish_job(ctx, job['id'], False,
+                    telemetry.observe(job_type, metrics.EXECUTION,
+                                      time.time() - run_start_time)
+                    telemetry.increment(job_type, metrics.SUCCESS)
+                    db_api.finish_job(ctx, job['id'], True,
                                       job_new['timestamp'])
-                    LOG.error('Job %(job)s of type %(job_type)s for '
-                              'resource %(resource)s fails',
-                              {'job': job['id'],
-                               'job_type': job_type,
-                               'resource': resource_id})
-                    break
-                db_api.finish_job(ctx, job['id'], True, job_new['timestamp'])
-                eventlet.sleep(CONF.worker_sleep_time)
+                    eventlet.sleep(CONF.worker_sleep_time)
+            finally:
+                telemetry.set_job_type(None)
+                if heartbeat:
+                    heartbeat.kill()
+                    db_api.release_job_lease(ctx, job_type, resource_id,
+                                             owner)
+                if claimed:
+                    _notify_job_done(args[0], ctx, job_type, resource_id)
+
+        @six.wraps(func)
+        def handle_args(*args, **kwargs):
+            if IN_TEST:
+                # NOTE(zhiyuan) job mechanism will cause some unpredictable
+                # result in unit test so we would like to bypass it. However
+                # we have problem mocking a decorator which decorates member
+                # functions, that's why we use this label, not an elegant
+                # way though.
+                func(*args, **kwargs)
+                return
+            run(args, kwargs, False)
         return handle_args
     return handle_func
 
@@ -136,6 +301,10 @@ class PeriodicTasks(periodic_task.PeriodicTasks):
 class XManager(PeriodicTasks):
 
     target = messaging.Target(version='1.0')
+    # looping call reporting the heartbeat of the worker
+    _worker_heartbeat = None
+    # index of the worker process on the host, kept when the worker restarts
+    worker_index = 0
 
     def __init__(self, host=None, service_name='xjob'):
 
@@ -147,7 +316,8 @@ class XManager(PeriodicTasks):
         self.service_name = service_name
         # self.notifier = rpc.get_notifier(self.service_name, self.host)
         self.additional_endpoints = []
-        self.clients = {constants.TOP: client.Client()}
+        self.clients = {constants.TOP: telemetry.TimedClient(
+            client.Client(), constants.TOP)}
         self.job_handles = {
             constants.JT_CONFIGURE_ROUTE: self.configure_route,
             constants.JT_ROUTER_SETUP: self.setup_bottom_router,
@@ -162,13 +332,23 @@ class XManager(PeriodicTasks):
             constants.JT_TRUNK_SYNC: self.sync_trunk}
         self.helper = helper.NetworkHelper()
         self.xjob_handler = xrpcapi.XJobAPI()
+        self.job_queue_stats = {'depth': 0, 'new_jobs': 0, 'failed_jobs': 0,
+                                'max_wait_time': 0, 'avg_wait_time': 0}
         super(XManager, self).__init__()
 
+    @property
+    def worker_name(self):
+        # the name is the rpc server target of the worker, it stays the same
+        # when the worker restarts so the queue of the worker is reused
+        # instead of leaving a stale queue behind with every restart
+        return '%s.%d' % (CONF.host, self.worker_index)
+
     def _get_client(self, region_name=None):
         if not region_name:
             return self.clients[constants.TOP]
         if region_name not in self.clients:
-            self.clients[region_name] = client.Client(region_name)
+            self.clients[region_name] = telemetry.TimedClient(
+                client.Client(region_name), region_name)
         return self.clients[region_name]
 
     def periodic_tasks(self, context, raise_on_error=False):
@@ -192,6 +372,14 @@ class XManager(PeriodicTasks):
         Child classes should override this method.
         """
         LOG.debug('XManager cleanup_host...')
+        if self._worker_heartbeat is not None:
+            self._worker_heartbeat.stop()
+            self._worker_heartbeat = None
+        if CONF.enable_job_sharding:
+            # leave the hash ring at once so other workers take over the
+            # jobs without waiting for the heartbeat to expire
+            db_api.delete_xjob_worker(t_context.get_admin_context(),
+                                      self.worker_name)
 
     def pre_start_hook(self):
         """pre_start_hook
@@ -213,8 +401,23 @@ class XManager(PeriodicTasks):
         Child classes should override this method.
         """
         LOG.debug('XManager post_start_hook...')
+        if CONF.enable_job_sharding:
+            ctx = t_context.get_admin_context()
+            self.report_worker_state(ctx)
+            # the heartbeat runs in its own green thread, not as a periodic
+            # task, so a long redo run of the periodic tasks does not make
+            # the worker look down and drop out of the hash ring
+            self._worker_heartbeat = loopingcall.FixedIntervalLoopingCall(
+                self._report_worker_state, ctx)
+            self._worker_heartbeat.start(
+                interval=_REPORT_WORKER_INTERVAL,
+                initial_delay=_REPORT_WORKER_INTERVAL)
 
     # rpc message endpoint handling
+    def job_done(self, ctx, payload):
+        for job_type, resource_id in six.iteritems(payload):
+            waiter.notify(job_type, resource_id)
+
     def test_rpc(self, ctx, payload):
 
         LOG.info("xmanager receive payload: %s", payload)
@@ -240,36 +443,134 @@ class XManager(PeriodicTasks):
             q_constants.DEVICE_OWNER_ROUTER_INTF,
             q_constants.DEVICE_OWNER_DVR_INTERFACE)]
 
+    @staticmethod
+    def _get_job_sort_key(job):
+        return (constants.job_priority_map.get(
+            job['type'], constants.JOB_DEFAULT_PRIORITY), job['timestamp'])
+
+    def _schedule_jobs(self, jobs):
+        """Order jobs to be redone
+
+        Jobs of one project are ordered by priority and then by age, oldest
+        first. Projects take turns, each round picks the next job of every
+        project, so a project with a large backlog cannot starve the others.
+
+        :param jobs: list of job dicts with type, project_id and timestamp
+        :return: list of ordered job dicts
+        """
+        project_jobs = collections.OrderedDict()
+        for job in sorted(jobs, key=self._get_job_sort_key):
+            project_jobs.setdefault(job['project_id'], []).append(job)
+        queue = []
+        for round_jobs in six.moves.zip_longest(*project_jobs.values()):
+            queue.extend(sorted([job for job in round_jobs if job],
+                                key=self._get_job_sort_key))
+        return queue
+
+    def _update_job_queue_stats(self, new_jobs, failed_jobs):
+        self.job_queue_stats = metrics.get_queue_stats(new_jobs,
+                                                         failed_jobs)
+        if self.job_queue_stats['depth']:
+            LOG.info('Job queue depth %(depth)d, %(new_jobs)d new and '
+                     '%(failed_jobs)d failed, max wait time '
+                     '%(max_wait_time).1f seconds', self.job_queue_stats)
+
     @periodic_task.periodic_task
     def redo_failed_or_new_job(self, ctx):
-        failed_jobs, new_jobs = db_api.get_latest_failed_or_new_jobs(ctx)
+        failed_jobs, new_jobs = db_api.get_latest_failed_or_new_jobs(
+            ctx, with_timestamp=True)
         failed_jobs = [
             job for job in failed_jobs if job['type'] in self.job_handles]
         new_jobs = [
             job for job in new_jobs if job['type'] in self.job_handles]
+        if CONF.enable_job_sharding:
+            failed_jobs = self._filter_shard_jobs(ctx, failed_jobs)
+            new_jobs = self._filter_shard_jobs(ctx, new_jobs)
+        self._update_job_queue_stats(new_jobs, failed_jobs)
         if not failed_jobs and not new_jobs:
             return
-        if new_jobs:
-            jobs = new_jobs
-            is_new_job = True
-        else:
-            jobs = failed_jobs
-            is_new_job = False
-        # in one run we only pick one job to handle
-        job_index = random.randint(0, len(jobs) - 1)
-        job_type = jobs[job_index]['type']
-        resource_id = jobs[job_index]['resource_id']
-        project_id = jobs[job_index]['project_id']
-        payload = {job_type: resource_id}
-        LOG.debug('Redo %(status)s job for %(resource_id)s of type '
-                  '%(job_type)s',
-                  {'status': 'new' if is_new_job else 'failed',
-                   'resource_id': resource_id, 'job_type': job_type})
-        # this is an admin context, we set the correct project id
-        ctx.tenant = project_id
-        if not is_new_job:
-            db_api.new_job(ctx, project_id, job_type, resource_id)
-        self.job_handles[job_type](ctx, payload=payload)
+        # new jobs go before failed jobs since failed jobs are likely to
+        # fail again
+        queue = [(job, True) for job in self._schedule_jobs(new_jobs)]
+        queue.extend([(job, False) for job in self._schedule_jobs(
+            failed_jobs)])
+        for job, is_new_job in queue[:CONF.max_redo_jobs_per_run]:
+            job_type = job['type']
+            resource_id = job['resource_id']
+            project_id = job['project_id']
+            payload = {job_type: resource_id}
+            LOG.debug('Redo %(status)s job for %(resource_id)s of type '
+                      '%(job_type)s',
+                      {'status': 'new' if is_new_job else 'failed',
+                       'resource_id': resource_id, 'job_type': job_type})
+            # this is an admin context, we set the correct project id
+            ctx.tenant = project_id
+            try:
+                if not is_new_job:
+                    db_api.new_job(ctx, project_id, job_type, resource_id)
+                self.job_handles[job_type](ctx, payload=payload)
+            except Exception:
+                # keep draining the queue, the job will be picked up again
+                # in the next run
+                LOG.exception('Failed to redo job for %(resource_id)s of '
+                              'type %(job_type)s',
+                              {'resource_id': resource_id,
+                               'job_type': job_type})
+
+    def _filter_shard_jobs(self, ctx, jobs):
+        """Only keep jobs of resources owned by this worker
+
+        Jobs of resources owned by workers that are down are picked up by
+        the new owners once the workers are removed from the hash ring. If
+        no worker is alive in the ring, all the jobs are kept.
+        """
+        shard_jobs = []
+        for job in jobs:
+            worker = self.xjob_handler.get_shard_worker(
+                ctx, job['resource_id'])
+            if not worker or worker == self.worker_name:
+                shard_jobs.append(job)
+        return shard_jobs
+
+    def report_worker_state(self, ctx):
+        if not CONF.enable_job_sharding:
+            return
+        db_api.report_xjob_worker(ctx, self.worker_name, CONF.host)
+
+    def _report_worker_state(self, ctx):
+        # an exception stops the looping call, so only log it and try again
+        # in the next interval
+        try:
+            self.report_worker_state(ctx)
+        except Exception:
+            LOG.exception('Failed to report state of worker %s',
+                          self.worker_name)
+
+    @periodic_task.periodic_task(spacing=_REPORT_JOB_STATS_INTERVAL)
+    def report_job_stats(self, ctx):
+        db_api.update_job_stats(ctx, self.worker_name, telemetry.get_stats())
+        # statistics of workers not reporting for a long time are removed
+        now = timeutils.utcnow()
+        db_api.delete_job_stats(ctx, now - datetime.timedelta(
+            seconds=_JOB_STATS_EXPIRE_TIME))
+        if CONF.job_stats_prometheus_file:
+            stats = metrics.merge_stats(
+                [job_stats['stats'] for job_stats in db_api.list_job_stats(
+                    ctx)])
+            metrics.write_prometheus_file(CONF.job_stats_prometheus_file,
+                                            stats)
+
+    @periodic_task.periodic_task(spacing=_PURGE_JOB_LOG_INTERVAL)
+    def purge_job_logs(self, ctx):
+        if CONF.job_log_retention_time <= 0:
+            return
+        before = timeutils.utcnow() - datetime.timedelta(
+            seconds=CONF.job_log_retention_time)
+        purged = db_api.purge_job_logs(
+            ctx, before, batch_size=CONF.job_log_purge_batch_size)
+        if purged:
+            LOG.info('Purged %(count)d job logs earlier than %(before)s',
+                     {'count': purged, 'before': before})
 
     @staticmethod
     def _safe_create_bottom_floatingip(t_ctx, pod, client, fip_net_id,
@@ -461,11 +762,14 @@ class XManager(PeriodicTasks):
         add_fips = [ip for ip in t_ip_fip_map if ip not in b_ip_fip_map]
         del_fips = [ip for ip in b_ip_fip_map if ip not in t_ip_fip_map]
 
+        # resolve bottom ports of all the floating ips in one query
+        b_int_port_id_map = db_api.get_bottom_ids_by_top_ids_region_name(
+            ctx, [t_ip_fip_map[add_fip]['port_id'] for add_fip in add_fips],
+            b_pod['region_name'], constants.RT_PORT)
         for add_fip in add_fips:
             fip = t_ip_fip_map[add_fip]
             t_int_port_id = fip['port_id']
-            b_int_port_id = db_api.get_bottom_id_by_top_id_region_name(
-                ctx, t_int_port_id, b_pod['region_name'], constants.RT_PORT)
+            b_int_port_id = b_int_port_id_map[t_int_port_id]
             if not b_int_port_id:
                 LOG.warning('Port %(port_id)s associated with floating ip '
                             '%(fip)s is not mapped to bottom pod',
@@ -621,15 +925,9 @@ class XManager(PeriodicTasks):
             b_pods.append(b_ns_pdd)
             b_router_ids.append(b_ns_router_id)
 
-        router_ew_bridge_ip_map = {}
-        router_ns_bridge_ip_map = {}
-        router_ips_map = {}
-
-        pod_subnet_nexthop_map = {}  # {pod_name: {subnet_id: nexthop}
-        subnet_cidr_map = {}  # {subnet_id: cidr}
-
-        for i, b_pod in enumerate(b_pods):
-            is_ns_router = b_router_ids[i] == b_ns_router_id
+        def _collect_router_info(ctx, index):
+            b_pod, b_router_id = b_pods[index], b_router_ids[index]
+            is_ns_router = b_router_id == b_ns_router_id
             bottom_client = self._get_client(b_pod['region_name'])
             if is_ns_router:
                 device_owner_filter = ns_attached_port_types
@@ -638,37 +936,46 @@ class XManager(PeriodicTasks):
             b_interfaces = bottom_client.list_ports(
                 ctx, filters=[{'key': 'device_id',
                                'comparator': 'eq',
-                               'value': b_router_ids[i]},
+                               'value': b_router_id},
                               {'key': 'device_owner',
                                'comparator': 'eq',
                                'value': device_owner_filter}])
-            router_ips_map[b_router_ids[i]] = {}
-            pod_subnet_nexthop_map[b_pod['region_name']] = {}
+            bridge_ip = None
+            cidr_ips_map = {}
+            subnet_nexthop_map = {}
+            subnet_cidrs = {}
 
+            bridge_cidr = netaddr.IPNetwork(CONF.client.bridge_cidr)
+            network_interfaces = []
             for b_interface in b_interfaces:
                 ip = b_interface['fixed_ips'][0]['ip_address']
-                bridge_cidr = CONF.client.bridge_cidr
-                if netaddr.IPAddress(ip) in netaddr.IPNetwork(bridge_cidr):
-                    if is_ns_router:
-                        # this ip is the default gateway ip for north-south
-                        # networking
-                        router_ns_bridge_ip_map[b_router_ids[i]] = ip
-                    else:
-                        # this ip is the next hop for east-west networking
-                        router_ew_bridge_ip_map[b_router_ids[i]] = ip
+                if netaddr.IPAddress(ip) in bridge_cidr:
+                    # for north-south router, this ip is the default gateway
+                    # ip, otherwise it is the next hop for east-west
+                    # networking
+                    bridge_ip = ip
                     continue
+                network_interfaces.append(b_interface)
+            # fetch subnets of all the interfaces in batches
+            b_subnets = bottom_client.get_resources_bulk(
+                constants.RT_SUBNET, ctx,
+                [b_interface['fixed_ips'][0]['subnet_id']
+                 for b_interface in network_interfaces],
+                fields=['gateway_ip', 'cidr'])
+
+            for b_interface in network_interfaces:
+                ip = b_interface['fixed_ips'][0]['ip_address']
                 b_net_id = b_interface['network_id']
                 b_subnet_id = b_interface['fixed_ips'][0]['subnet_id']
 
-                b_subnet = bottom_client.get_subnets(ctx, b_subnet_id)
+                b_subnet = b_subnets[b_subnet_id]
                 if b_subnet['gateway_ip'] != ip:
                     # ip of the interface attached to the non local router is
                     # different from the gateway ip, meaning that the interface
                     # is for east-west traffic purpose, so we save necessary
                     # information for next process
-                    pod_subnet_nexthop_map[
-                        b_pod['region_name']][b_subnet_id] = ip
-                    subnet_cidr_map[b_subnet_id] = b_subnet['cidr']
+                    subnet_nexthop_map[b_subnet_id] = ip
+                    subnet_cidrs[b_subnet_id] = b_subnet['cidr']
 
                 b_ports = bottom_client.list_ports(
                     ctx, filters=[{'key': 'network_id',
@@ -678,18 +985,45 @@ class XManager(PeriodicTasks):
                     'device_owner', '') not in non_vm_port_types]
                 ips = [vm_port['fixed_ips'][0][
                     'ip_address'] for vm_port in b_vm_ports]
-                router_ips_map[b_router_ids[i]][b_subnet['cidr']] = ips
+                cidr_ips_map[b_subnet['cidr']] = ips
+            return bridge_ip, cidr_ips_map, subnet_nexthop_map, subnet_cidrs
+
+        router_ew_bridge_ip_map = {}
+        router_ns_bridge_ip_map = {}
+        router_ips_map = {}
+
+        pod_subnet_nexthop_map = {}  # {pod_name: {subnet_id: nexthop}
+        subnet_cidr_map = {}  # {subnet_id: cidr}
+
+        # query the interfaces of bottom routers in all pods concurrently
+        router_infos = fanout.fanout(
+            ctx, _collect_router_info, range(len(b_pods)),
+            label=lambda index: b_pods[index]['region_name'])
+        for i, (bridge_ip, cidr_ips_map, subnet_nexthop_map,
+                subnet_cidrs) in enumerate(router_infos):
+            if bridge_ip:
+                if b_router_ids[i] == b_ns_router_id:
+                    router_ns_bridge_ip_map[b_router_ids[i]] = bridge_ip
+                else:
+                    router_ew_bridge_ip_map[b_router_ids[i]] = bridge_ip
+            router_ips_map[b_router_ids[i]] = cidr_ips_map
+            pod_subnet_nexthop_map[b_pods[i]['region_name']] = (
+                subnet_nexthop_map)
+            subnet_cidr_map.update(subnet_cidrs)
+
+        # bottom resource updates, issued to all pods concurrently at last
+        updates = []
 
         # handle extra routes for east-west traffic
         for i, b_router_id in enumerate(b_router_ids):
             if b_router_id == b_ns_router_id:
                 continue
-            bottom_client = self._get_client(b_pods[i]['region_name'])
-            extra_routes = []
+            region_name = b_pods[i]['region_name']
             if not router_ips_map[b_router_id]:
-                bottom_client.update_routers(
-                    ctx, b_router_id, {'router': {'routes': extra_routes}})
+                updates.append((region_name, 'routers', b_router_id,
+                                {'router': {'routes': []}}))
                 continue
+            cidr_nexthop_ips_map = collections.defaultdict(dict)
             for router_id, cidr_ips_map in six.iteritems(router_ips_map):
                 if router_id == b_router_id:
                     continue
@@ -699,17 +1033,18 @@ class XManager(PeriodicTasks):
                         # already vm ports in the pod of b_router, so no need
                         # to add extra routes
                         continue
-                    for ip in ips:
-                        route = {'nexthop': router_ew_bridge_ip_map[router_id],
-                                 'destination': ip + '/32'}
-                        extra_routes.append(route)
+                    if ips:
+                        cidr_nexthop_ips_map[cidr].setdefault(
+                            router_ew_bridge_ip_map[router_id], []).extend(ips)
+            extra_routes = self._get_extra_routes(
+                cidr_nexthop_ips_map, router_ips_map[b_router_id])
 
             if router_ns_bridge_ip_map and t_ext_net_id:
                 extra_routes.append(
                     {'nexthop': router_ns_bridge_ip_map.values()[0],
                      'destination': constants.DEFAULT_DESTINATION})
-            bottom_client.update_routers(
-                ctx, b_router_id, {'router': {'routes': extra_routes}})
+            updates.append((region_name, 'routers', b_router_id,
+                            {'router': {'routes': extra_routes}}))
 
         # configure host routes for local network attached to local router
         for (pod_name,
@@ -721,41 +1056,144 @@ class XManager(PeriodicTasks):
                         continue
                     host_routes.append({'destination': cidr,
                                         'nexthop': nexthop})
-                bottom_client = self._get_client(pod_name)
-                bottom_client.update_subnets(
-                    ctx, subnet_id, {'subnet': {'host_routes': host_routes}})
+                updates.append((pod_name, 'subnets', subnet_id,
+                                {'subnet': {'host_routes': host_routes}}))
 
         if not b_ns_router_id:
             # router for north-south networking not exist, skip extra routes
             # configuration for north-south router
-            return
-        if not t_ext_net_id:
+            pass
+        elif not t_ext_net_id:
             # router not attached to external gateway but router for north-
             # south networking exists, clear the extra routes
-            bottom_client = self._get_client(b_ns_pdd['region_name'])
-            bottom_client.update_routers(
-                ctx, b_ns_router_id, {'router': {'routes': []}})
+            updates.append((b_ns_pdd['region_name'], 'routers',
+                            b_ns_router_id, {'router': {'routes': []}}))
+        else:
+            # handle extra routes for north-south router
+            cidr_nexthop_ips_map = collections.defaultdict(dict)
+            for router_id, cidr_ips_map in six.iteritems(router_ips_map):
+                if router_id not in router_ew_bridge_ip_map:
+                    continue
+                for cidr, ips in six.iteritems(cidr_ips_map):
+                    if ips:
+                        cidr_nexthop_ips_map[cidr].setdefault(
+                            router_ew_bridge_ip_map[router_id], []).extend(ips)
+            extra_routes = self._get_extra_routes(
+                cidr_nexthop_ips_map, router_ips_map.get(b_ns_router_id, {}))
+            updates.append((b_ns_pdd['region_name'], 'routers',
+                            b_ns_router_id,
+                            {'router': {'routes': extra_routes}}))
+
+        if not CONF.enable_incremental_route_config:
+            self._update_bottom_resources(ctx, updates)
             return
 
-        # handle extra routes for north-south router
-        ip_bridge_ip_map = {}
-        for router_id, cidr_ips_map in six.iteritems(router_ips_map):
-            if router_id not in router_ew_bridge_ip_map:
+        update_digests = {}
+        for update in updates:
+            update_digests[self._get_route_digest_key(update)] = (
+                self._get_route_digest(update))
+        applied_digests = db_api.get_route_digests(ctx, update_digests.keys())
+        expire_time = timeutils.utcnow() - datetime.timedelta(
+            seconds=CONF.route_full_sync_interval)
+        changed_updates = []
+        for update in updates:
+            key = self._get_route_digest_key(update)
+            if key in applied_digests:
+                digest, updated_at = applied_digests[key]
+                if digest == update_digests[key] and updated_at > expire_time:
+                    continue
+            changed_updates.append(update)
+        LOG.debug('%(changed)d of %(total)d bottom routers and subnets need '
+                  'route update for router %(router)s',
+                  {'changed': len(changed_updates), 'total': len(updates),
+                   'router': t_router_id})
+
+        changed_keys = [self._get_route_digest_key(
+            update) for update in changed_updates]
+        try:
+            self._update_bottom_resources(ctx, changed_updates)
+        except Exception:
+            # we don't know which routes have been applied, so remove the
+            # digests to push the routes again next time
+            db_api.delete_route_digests(ctx, changed_keys)
+            raise
+        db_api.update_route_digests(
+            ctx, dict((key, update_digests[key]) for key in changed_keys))
+
+    @staticmethod
+    def _get_extra_routes(cidr_nexthop_ips_map, local_cidrs):
+        """Get extra routes to the remote vm ports
+
+        One host route is generated for every vm port by default. If route
+        aggregation is enabled, routes are collapsed into the subnet cidr when
+        all the ports of the subnet live behind the same nexthop and the
+        subnet is not attached to the local router, otherwise host routes
+        with the same nexthop are merged into the fewest covering cidrs.
+
+        :param cidr_nexthop_ips_map: {cidr: {nexthop: [vm_port_ip]}}
+        :param local_cidrs: cidrs of the subnets attached to the local router
+        :return: list of routes
+        """
+        if not CONF.enable_route_aggregation:
+            destination_nexthop_map = {}
+            for nexthop_ips_map in six.itervalues(cidr_nexthop_ips_map):
+                for nexthop, ips in six.iteritems(nexthop_ips_map):
+                    for ip in ips:
+                        destination_nexthop_map[ip + '/32'] = nexthop
+            return [{'nexthop': nexthop, 'destination': destination}
+                    for destination, nexthop in six.iteritems(
+                        destination_nexthop_map)]
+
+        routes = []
+        for cidr, nexthop_ips_map in six.iteritems(cidr_nexthop_ips_map):
+            if len(nexthop_ips_map) == 1 and cidr not in local_cidrs:
+                routes.append({'nexthop': list(nexthop_ips_map)[0],
+                               'destination': cidr})
                 continue
-            for cidr, ips in six.iteritems(cidr_ips_map):
-                for ip in ips:
-                    nexthop = router_ew_bridge_ip_map[router_id]
-                    destination = ip + '/32'
-                    ip_bridge_ip_map[destination] = nexthop
-
-        bottom_client = self._get_client(b_ns_pdd['region_name'])
-        extra_routes = []
-        for fixed_ip in ip_bridge_ip_map:
-            extra_routes.append(
-                {'nexthop': ip_bridge_ip_map[fixed_ip],
-                 'destination': fixed_ip})
-        bottom_client.update_routers(
-            ctx, b_ns_router_id, {'router': {'routes': extra_routes}})
+            for nexthop, ips in six.iteritems(nexthop_ips_map):
+                for ip_net in netaddr.cidr_merge(ips):
+                    routes.append({'nexthop': nexthop,
+                                   'destination': str(ip_net)})
+        return routes
+
+    @staticmethod
+    def _get_route_digest_key(update):
+        region_name, resource, resource_id, _ = update
+        return region_name, resource, resource_id
+
+    @staticmethod
+    def _get_route_digest(update):
+        """Get digest of the routes in the router or subnet update body
+
+        Routes are sorted first so the digest doesn't depend on the order of
+        routes.
+        """
+        _, resource, _, body = update
+        if resource == 'routers':
+            routes = body['router']['routes']
+        else:
+            routes = body['subnet']['host_routes']
+        route_strs = sorted(['%s,%s' % (route['destination'],
+                                        route['nexthop']) for route in routes])
+        return hashlib.sha1(
+            ';'.join(route_strs).encode('utf-8')).hexdigest()
+
+    def _update_bottom_resources(self, ctx, updates):
+        """Update bottom resources in different pods concurrently
+
+        :param ctx: tricircle context
+        :param updates: list of (region_name, resource, resource_id, body)
+        tuples, resource is the plural resource name like "routers"
+        :return: None
+        """
+        def _update(ctx, update):
+            region_name, resource, resource_id, body = update
+            client = self._get_client(region_name)
+            getattr(client, 'update_' + resource)(ctx, resource_id, body)
+
+        fanout.fanout(ctx, _update, updates,
+                      label=lambda update: '%s %s in %s' % (
+                          update[1], update[2], update[0]))
 
     @_job_handle(constants.JT_PORT_DELETE)
     def delete_server_port(self, ctx, payload):
@@ -791,12 +1229,32 @@ class XManager(PeriodicTasks):
                 'security_group_id': sg_id}
 
     @staticmethod
-    def _compare_rule(rule1, rule2):
-        for key in ('direction', 'remote_ip_prefix', 'protocol', 'ethertype',
-                    'port_range_max', 'port_range_min'):
-            if rule1[key] != rule2[key]:
-                return False
-        return True
+    def _get_rule_key(rule):
+        """Canonicalise the rule into a hashable tuple used for diffing"""
+        return tuple(rule[key] for key in (
+            'direction', 'remote_ip_prefix', 'protocol', 'ethertype',
+            'port_range_max', 'port_range_min'))
+
+    def _get_remote_group_cidrs(self, ctx, project_id):
+        """Get cidrs that rules containing remote_group_id are extended to"""
+        subnets = self._get_client().list_subnets(
+            ctx, [{'key': 'tenant_id', 'comparator': 'eq',
+                   'value': project_id}])
+        bridge_ip_net = netaddr.IPNetwork(CONF.client.bridge_cidr)
+        cidrs = []
+        subnet_cidr_set = set()
+        for subnet in subnets:
+            # Tricircle has not supported IPv6 well yet,
+            # so we ignore seg rules temporarily.
+            if subnet['ip_version'] != q_constants.IP_VERSION_4:
+                continue
+            if netaddr.IPNetwork(subnet['cidr']) in bridge_ip_net:
+                continue
+            if subnet['cidr'] in subnet_cidr_set:
+                continue
+            subnet_cidr_set.add(subnet['cidr'])
+            cidrs.append(subnet['cidr'])
+        return cidrs
 
     @_job_handle(constants.JT_SEG_RULE_SETUP)
     def configure_security_group_rules(self, ctx, payload):
@@ -805,6 +1263,8 @@ class XManager(PeriodicTasks):
         sg_filters = [{'key': 'tenant_id', 'comparator': 'eq',
                        'value': project_id}]
         top_sgs = top_client.list_security_groups(ctx, sg_filters)
+        # subnets are only queried once per job when needed
+        remote_group_cidrs = None
         for top_sg in top_sgs:
             new_b_rules = []
             for t_rule in top_sg['security_group_rules']:
@@ -819,65 +1279,68 @@ class XManager(PeriodicTasks):
                     continue
                 if t_rule['ethertype'] != 'IPv4':
                     continue
-                subnets = top_client.list_subnets(
-                    ctx, [{'key': 'tenant_id', 'comparator': 'eq',
-                           'value': project_id}])
-                bridge_ip_net = netaddr.IPNetwork(CONF.client.bridge_cidr)
-                subnet_cidr_set = set()
-                for subnet in subnets:
-                    ip_net = netaddr.IPNetwork(subnet['cidr'])
-                    if ip_net in bridge_ip_net:
-                        continue
+                if remote_group_cidrs is None:
+                    remote_group_cidrs = self._get_remote_group_cidrs(
+                        ctx, project_id)
+                for cidr in remote_group_cidrs:
                     # leave sg_id empty here.
-                    # Tricircle has not supported IPv6 well yet,
-                    # so we ignore seg rules temporarily.
-                    if subnet['ip_version'] == q_constants.IP_VERSION_4:
-                        if subnet['cidr'] in subnet_cidr_set:
-                            continue
-                        subnet_cidr_set.add(subnet['cidr'])
-                        new_b_rules.append(
-                            self._construct_bottom_rule(t_rule, '',
-                                                        subnet['cidr']))
+                    new_b_rules.append(
+                        self._construct_bottom_rule(t_rule, '', cidr))
 
             mappings = db_api.get_bottom_mappings_by_top_id(
                 ctx, top_sg['id'], constants.RT_SG)
-            for pod, b_sg_id in mappings:
-                client = self._get_client(pod['region_name'])
-                b_sg = client.get_security_groups(ctx, b_sg_id)
-                add_rules = []
-                del_rules = []
-                match_index = set()
-                for b_rule in b_sg['security_group_rules']:
-                    match = False
-                    for i, rule in enumerate(new_b_rules):
-                        if self._compare_rule(b_rule, rule):
-                            match = True
-                            match_index.add(i)
-                            break
-                    if not match:
-                        del_rules.append(b_rule)
-                for i, rule in enumerate(new_b_rules):
-                    if i not in match_index:
-                        add_rules.append(rule)
-
-                for del_rule in del_rules:
-                    self._safe_delete_security_group_rule(
-                        ctx, client, del_rule['id'])
-                if add_rules:
-                    rule_body = {'security_group_rules': []}
-                    for add_rule in add_rules:
-                        add_rule['security_group_id'] = b_sg_id
-                        rule_body['security_group_rules'].append(add_rule)
-                    self._safe_create_security_group_rule(
-                        ctx, client, rule_body)
+            fanout.fanout(
+                ctx, functools.partial(self._sync_bottom_security_group_rules,
+                                       new_b_rules=new_b_rules),
+                mappings, label=lambda mapping: mapping[0]['region_name'])
+
+    def _sync_bottom_security_group_rules(self, ctx, mapping, new_b_rules):
+        pod, b_sg_id = mapping
+        client = self._get_client(pod['region_name'])
+        b_sg = client.get_security_groups(ctx, b_sg_id)
+
+        new_rule_keys = set([self._get_rule_key(
+            rule) for rule in new_b_rules])
+        b_rule_keys = set()
+        del_rule_ids = []
+        for b_rule in b_sg['security_group_rules']:
+            b_rule_key = self._get_rule_key(b_rule)
+            b_rule_keys.add(b_rule_key)
+            if b_rule_key not in new_rule_keys:
+                del_rule_ids.append(b_rule['id'])
+        add_rules = []
+        for rule in new_b_rules:
+            rule_key = self._get_rule_key(rule)
+            if rule_key not in b_rule_keys:
+                # also skip duplicated new rules
+                b_rule_keys.add(rule_key)
+                add_rules.append(rule)
+
+        # neutron doesn't support bulk deletion, so the deletions in the pod
+        # are issued concurrently as one batch
+        def _delete_rule(ctx, rule_id):
+            self._safe_delete_security_group_rule(ctx, client, rule_id)
+
+        fanout.fanout(ctx, _delete_rule, del_rule_ids,
+                      label=lambda rule_id: '%s in %s' % (
+                          rule_id, pod['region_name']))
+        if add_rules:
+            rule_body = {'security_group_rules': []}
+            for add_rule in add_rules:
+                # new_b_rules is shared by all the pods, so copy the rule
+                # before filling in the bottom security group id
+                add_rule = dict(add_rule, security_group_id=b_sg_id)
+                rule_body['security_group_rules'].append(add_rule)
+            self._safe_create_security_group_rule(
+                ctx, client, rule_body)
 
     @_job_handle(constants.JT_NETWORK_UPDATE)
     def update_network(self, ctx, payload):
         """update bottom network
 
-        if bottom pod id equal to POD_NOT_SPECIFIED, dispatch jobs for every
-        mapped bottom pod via RPC, otherwise update network in the specified
-        pod.
+        if bottom pod id equal to POD_NOT_SPECIFIED, update network in every
+        mapped bottom pod concurrently, otherwise update network in the
+        specified pod.
 
         :param ctx: tricircle context
         :param payload: dict whose key is JT_NETWORK_UPDATE and value
@@ -892,21 +1355,21 @@ class XManager(PeriodicTasks):
         if not t_network:
             return
 
-        project_id = t_network['tenant_id']
         if b_pod_id == constants.POD_NOT_SPECIFIED:
             mappings = db_api.get_bottom_mappings_by_top_id(
                 ctx, t_network_id, constants.RT_NETWORK)
             b_pods = [mapping[0] for mapping in mappings]
-            for b_pod in b_pods:
-                self.xjob_handler.update_network(ctx, project_id,
-                                                 t_network_id, b_pod['pod_id'])
-            return
+        else:
+            b_pods = [db_api.get_pod(ctx, b_pod_id)]
+        fanout.fanout(ctx, functools.partial(self._update_bottom_network,
+                                             t_network=t_network),
+                      b_pods)
 
-        b_pod = db_api.get_pod(ctx, b_pod_id)
+    def _update_bottom_network(self, ctx, b_pod, t_network):
         b_region_name = b_pod['region_name']
         b_client = self._get_client(region_name=b_region_name)
         b_network_id = db_api.get_bottom_id_by_top_id_region_name(
-            ctx, t_network_id, b_region_name, constants.RT_NETWORK)
+            ctx, t_network['id'], b_region_name, constants.RT_NETWORK)
         # name is not allowed to be updated, because it is used by
         # lock_handle to retrieve bottom/local resources that have been
         # created but not registered in the resource routing table
@@ -929,9 +1392,9 @@ class XManager(PeriodicTasks):
     def update_subnet(self, ctx, payload):
         """update bottom subnet
 
-        if bottom pod id equal to POD_NOT_SPECIFIED, dispatch jobs for every
-        mapped bottom pod via RPC, otherwise update subnet in the specified
-        pod.
+        if bottom pod id equal to POD_NOT_SPECIFIED, update subnet in every
+        mapped bottom pod concurrently, otherwise update subnet in the
+        specified pod.
 
         :param ctx: tricircle context
         :param payload: dict whose key is JT_SUBNET_UPDATE and value
@@ -946,20 +1409,20 @@ class XManager(PeriodicTasks):
         if not t_subnet:
             return
 
-        project_id = t_subnet['tenant_id']
         if b_pod_id == constants.POD_NOT_SPECIFIED:
             mappings = db_api.get_bottom_mappings_by_top_id(
                 ctx, t_subnet_id, constants.RT_SUBNET)
             b_pods = [mapping[0] for mapping in mappings]
-            for b_pod in b_pods:
-                self.xjob_handler.update_subnet(ctx, project_id,
-                                                t_subnet_id, b_pod['pod_id'])
-            return
+        else:
+            b_pods = [db_api.get_pod(ctx, b_pod_id)]
+        fanout.fanout(ctx, functools.partial(self._update_bottom_subnet,
+                                             t_subnet=t_subnet),
+                      b_pods)
 
-        b_pod = db_api.get_pod(ctx, b_pod_id)
+    def _update_bottom_subnet(self, ctx, b_pod, t_subnet):
         b_region_name = b_pod['region_name']
         b_subnet_id = db_api.get_bottom_id_by_top_id_region_name(
-            ctx, t_subnet_id, b_region_name, constants.RT_SUBNET)
+            ctx, t_subnet['id'], b_region_name, constants.RT_SUBNET)
         b_client = self._get_client(region_name=b_region_name)
         b_subnet = b_client.get_subnets(ctx, b_subnet_id)
         b_gateway_ip = b_subnet['gateway_ip']
@@ -988,6 +1451,10 @@ class XManager(PeriodicTasks):
             LOG.error('subnet: %(subnet_id)s not found, '
                       'pod name: %(name)s',
                       {'subnet_id': b_subnet_id, 'name': b_region_name})
+        # host routes of the bottom subnet are overwritten by the top ones,
+        # drop the digest so configure_route pushes its host routes again
+        db_api.delete_route_digests(
+            ctx, [(b_region_name, 'subnets', b_subnet_id)])
 
     @_job_handle(constants.JT_SHADOW_PORT_SETUP)
     def setup_shadow_ports(self, ctx, payload):
@@ -1026,31 +1493,17 @@ class XManager(PeriodicTasks):
             LOG.debug('Pod %s not found %s', target_pod_id, run_label)
             # network is not mapped to the specified pod, nothing to do
             return
-        for b_pod, b_net_id in mappings:
-            b_client = self._get_client(b_pod['region_name'])
-            # port table has (network_id, device_owner) index
-            b_sw_ports = b_client.list_ports(
-                ctx, filters=[{'key': 'network_id', 'comparator': 'eq',
-                               'value': b_net_id},
-                              {'key': 'device_owner', 'comparator': 'eq',
-                               'value': constants.DEVICE_OWNER_SHADOW},
-                              {'key': 'fields', 'comparator': 'eq',
-                               'value': ['id', 'status']}])
+        # query shadow ports and real ports from all the pods concurrently
+        pod_ports = fanout.fanout(
+            ctx, self._list_bottom_network_ports, mappings,
+            label=lambda mapping: mapping[0]['region_name'])
+        for (b_pod, _), (b_sw_ports, b_ports) in zip(mappings, pod_ports):
             b_sw_port_ids = set([port['id'] for port in b_sw_ports])
             if b_pod['pod_id'] == target_pod['pod_id']:
                 b_down_sw_port_ids = set(
                     [port['id'] for port in b_sw_ports if (
                         port['status'] == q_constants.PORT_STATUS_DOWN)])
             pod_sw_port_ids_map[b_pod['pod_id']] = b_sw_port_ids
-            # port table has (network_id, device_owner) index
-            b_ports = b_client.list_ports(
-                ctx, filters=[{'key': 'network_id', 'comparator': 'eq',
-                               'value': b_net_id},
-                              {'key': 'fields', 'comparator': 'eq',
-                               'value': ['id', 'binding:vif_type',
-                                         'binding:host_id', 'fixed_ips',
-                                         'device_owner', 'device_id',
-                                         'mac_address']}])
             LOG.debug('Shadow ports %s in pod %s %s',
                       b_sw_ports, target_pod_id, run_label)
             LOG.debug('Ports %s in pod %s %s',
@@ -1126,6 +1579,28 @@ class XManager(PeriodicTasks):
             self.xjob_handler.setup_shadow_ports(ctx, project_id,
                                                  pod_id, t_net_id)
 
+    def _list_bottom_network_ports(self, ctx, mapping):
+        b_pod, b_net_id = mapping
+        b_client = self._get_client(b_pod['region_name'])
+        # port table has (network_id, device_owner) index
+        b_sw_ports = b_client.list_ports(
+            ctx, filters=[{'key': 'network_id', 'comparator': 'eq',
+                           'value': b_net_id},
+                          {'key': 'device_owner', 'comparator': 'eq',
+                           'value': constants.DEVICE_OWNER_SHADOW},
+                          {'key': 'fields', 'comparator': 'eq',
+                           'value': ['id', 'status']}])
+        # port table has (network_id, device_owner) index
+        b_ports = b_client.list_ports(
+            ctx, filters=[{'key': 'network_id', 'comparator': 'eq',
+                           'value': b_net_id},
+                          {'key': 'fields', 'comparator': 'eq',
+                           'value': ['id', 'binding:vif_type',
+                                     'binding:host_id', 'fixed_ips',
+                                     'device_owner', 'device_id',
+                                     'mac_address']}])
+        return b_sw_ports, b_ports
+
     def _get_bottom_need_created_subports(self, ctx, t_ctx, project_id,
                                           trunk_id, add_subport_ids):
         t_client = self._get_client()
@@ -1143,10 +1618,14 @@ class XManager(PeriodicTasks):
                         'value': constants.RT_PORT},
                        {'key': 'project_id',
                         'comparator': 'eq',
-                        'value': project_id}]
-
-        port_mappings = db_api.list_resource_routings(t_ctx, map_filters)
-        mapping_port_ids = [port['top_id'] for port in port_mappings]
+                        'value': project_id},
+                       {'key': 'top_id',
+                        'comparator': 'in',
+                        'value': list(add_subport_ids)}]
+
+        port_mappings = db_api.list_resource_routings(t_ctx, map_filters,
+                                                      fields=['top_id'])
+        mapping_port_ids = set(port['top_id'] for port in port_mappings)
         pop_attrs = ['status', 'tags', 'updated_at',
                      'created_at', 'revision_number', 'id']
         for port in trunk_subports:
@@ -1394,10 +1873,10 @@ class XManager(PeriodicTasks):
                           constants.RT_PORT_PAIR]
 
         for res_type in resource_types:
+            res_mappings = db_api.get_bottom_mappings_by_top_ids(
+                ctx, res_map[res_type], res_type)
             for res_id in res_map[res_type]:
-                b_resources = db_api.get_bottom_mappings_by_top_id(
-                    ctx, res_id, res_type)
-                for b_pod, b_res_id in b_resources:
+                for b_pod, b_res_id in res_mappings[res_id]:
                     b_client = self._get_client(b_pod['region_name'])
                     self._delete_bottom_resource_by_id(
                         ctx, res_type, b_res_id, b_client, ctx.project_id)
@@ -1469,8 +1948,10 @@ class XManager(PeriodicTasks):
 
         t_pps = {}
         t_ppgs = []
+        ppg_map = t_client.get_resources_bulk(
+            constants.RT_PORT_PAIR_GROUP, ctx, t_pc['port_pair_groups'])
         for ppg_id in t_pc['port_pair_groups']:
-            ppg = t_client.get_port_pair_groups(ctx, ppg_id)
+            ppg = ppg_map.get(ppg_id)
             if not ppg:
                 LOG.error('port pair group: %(ppg_id)s not found, '
                           'pod name: %(name)s', {'ppg_id': ppg_id,
@@ -1508,8 +1989,10 @@ class XManager(PeriodicTasks):
             b_ppg_ids.append(b_ppg_id)
 
         b_fc_ids = []
+        fc_map = t_client.get_resources_bulk(
+            constants.RT_FLOW_CLASSIFIER, ctx, t_pc['flow_classifiers'])
         for fc_id in t_pc['flow_classifiers']:
-            fc = t_client.get_flow_classifiers(ctx, fc_id)
+            fc = fc_map.get(fc_id)
             if fc:
                 fc_id = fc.pop('id')
                 b_fc_id = self._prepare_sfc_bottom_element(
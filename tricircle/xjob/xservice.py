@@ -51,14 +51,55 @@ common_opts = [
                       " seconds")),
     cfg.IntOpt('job_run_expire', default=180,
                help=_("Running job is considered expires after this time, in"
-                      " seconds")),
+                      " seconds"),
+               deprecated_for_removal=True,
+               deprecated_reason=_("Running jobs are protected by leases, "
+                                   "see job_lease_time")),
+    cfg.IntOpt('job_lease_time', default=30,
+               help=_("Seconds the lease of a running job stays valid, the "
+                      "worker renews the lease every one third of this "
+                      "time. The job is taken over by other workers once "
+                      "its lease expires. Renewal is best effort, a handler "
+                      "losing its lease is not stopped")),
+    cfg.IntOpt('job_lock_wait_timeout', default=30,
+               help=_("Seconds a worker failing to claim the lease of a job "
+                      "waits for the running job to end before checking "
+                      "the job again, so a new job created while the "
+                      "running job is ending is not left to the periodic "
+                      "redo task. Set to 0 to not wait")),
     cfg.FloatOpt('worker_sleep_time', default=0.1,
                  help=_("Seconds a worker sleeps after one run in a loop")),
-    cfg.IntOpt('redo_time_span', default=172800,
-               help=_("Time span in seconds, we calculate the latest job "
-                      "timestamp by subtracting this time span from the "
-                      "current timestamp, jobs created between these two "
-                      "timestamps will be redone")),
+    cfg.IntOpt('max_redo_jobs_per_run', default=20,
+               help=_("Max number of failed or new jobs redone in one run "
+                      "of the periodic task, jobs are ordered by priority "
+                      "and age, and projects take turns")),
+    cfg.IntOpt('job_log_retention_time', default=0,
+               help=_("Time in seconds that successful jobs are kept in "
+                      "the job log table, older job logs are purged "
+                      "periodically. Set to 0 to keep job logs forever")),
+    cfg.IntOpt('job_log_purge_batch_size', default=1000,
+               help=_("Max number of job logs deleted in one transaction "
+                      "when purging job logs")),
+    cfg.StrOpt('job_stats_prometheus_file',
+               help=_("Path of the file that job statistics of all xjob "
+                      "workers are written to in Prometheus text format "
+                      "periodically. Leave it empty to disable the file")),
+    cfg.BoolOpt('enable_incremental_route_config', default=False,
+                help=_("Only push extra routes and host routes to bottom "
+                       "routers and subnets when they differ from the last "
+                       "applied ones")),
+    cfg.BoolOpt('enable_route_aggregation', default=False,
+                help=_("Collapse the host extra routes to vm ports into the "
+                       "subnet cidr when all the ports of the subnet live "
+                       "behind the same nexthop, and merge the other host "
+                       "routes with the same nexthop into the fewest "
+                       "covering cidrs")),
+    cfg.IntOpt('route_full_sync_interval', default=3600,
+               help=_("Seconds after which extra routes and host routes "
+                      "of a bottom router or subnet are pushed again even "
+                      "if they are not changed, used to repair routes "
+                      "modified outside Tricircle when incremental route "
+                      "configuration is enabled")),
     cfg.BoolOpt('enable_api_gateway',
                 default=False,
                 help=_('Whether the Nova API gateway is enabled'))
@@ -121,7 +162,12 @@ class XService(srv.Service):
 
         LOG.debug(_("Creating RPC server for service %s"), self.topic)
 
-        target = messaging.Target(topic=self.topic, server=self.host)
+        server = self.host
+        if CONF.enable_job_sharding:
+            # every worker process listens on its own server target, so jobs
+            # can be sent to the worker owning the resource
+            server = self.manager.worker_name
+        target = messaging.Target(topic=self.topic, server=server)
 
         endpoints = [
             self.manager,
@@ -237,6 +283,35 @@ def create_service():
     return xservice
 
 
+class _IndexedWorker(srv.ServiceBase):
+
+    """Run the xjob service as the worker process of the given index
+
+    The process launcher restarts a dead worker with the same wrapper, so
+    the restarted worker gets the index, and the rpc server target, of the
+    worker it replaces.
+    """
+
+    def __init__(self, xservice, index):
+        self.xservice = xservice
+        self.index = index
+
+    def start(self):
+        # called in the forked worker process, the manager of the parent
+        # process is not changed
+        self.xservice.manager.worker_index = self.index
+        self.xservice.start()
+
+    def stop(self):
+        self.xservice.stop()
+
+    def wait(self):
+        self.xservice.wait()
+
+    def reset(self):
+        self.xservice.reset()
+
+
 _launcher = None
 
 
@@ -245,7 +320,14 @@ def serve(xservice, workers=1):
     if _launcher:
         raise RuntimeError(_('serve() can only be called once'))
 
-    _launcher = srv.launch(CONF, xservice, workers=workers)
+    if CONF.enable_job_sharding and workers > 1:
+        # with job sharding every worker listens on a queue named after its
+        # index, launch the workers one by one so each keeps its index
+        _launcher = srv.ProcessLauncher(CONF)
+        for index in range(workers):
+            _launcher.launch_service(_IndexedWorker(xservice, index))
+    else:
+        _launcher = srv.launch(CONF, xservice, workers=workers)
 
 
 def wait():